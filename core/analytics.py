@@ -0,0 +1,145 @@
+# core/analytics.py
+# Precomputed admin analytics. admin_dashboard reads one AnalyticsSnapshot
+# document instead of scanning users, courses and enrollments per request.
+#
+# The snapshot is kept current incrementally by the write paths (register,
+# upload_course, enroll / unenroll, Course.delete) and fully rebuilt in the
+# background when it gets older than ANALYTICS_REFRESH_INTERVAL, or by
+# `python manage.py refresh_analytics` (cron / --interval loop).
+#
+# A rebuild only replaces the snapshot if no incremental update landed while it
+# was counting (same updated_at), otherwise that $inc would be lost.
+import datetime
+import threading
+
+from django.conf import settings
+from mongoengine.errors import NotUniqueError
+
+from core.models import AnalyticsSnapshot, Course, Enrollment, User
+
+SNAPSHOT_KEY = 'global'
+REFRESH_INTERVAL = datetime.timedelta(seconds=getattr(settings, 'ANALYTICS_REFRESH_INTERVAL', 15 * 60))
+REBUILD_ATTEMPTS = 3
+
+_refresh_lock = threading.Lock()
+
+
+def _snapshot():
+    # Only ever update an existing snapshot, a missing one is built in full on first read
+    return AnalyticsSnapshot.objects(key=SNAPSHOT_KEY)
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def _count():
+    top_course = Course.objects(enrollment_count__gt=0).order_by('-enrollment_count', 'id') \
+        .only('id', 'title', 'created_by', 'enrollment_count').no_dereference().first()
+    total_enrollments = next(iter(Enrollment.objects.aggregate([
+        {'$group': {'_id': None, 'count': {'$sum': 1}}}
+    ])), {}).get('count', 0)
+    return {
+        'total_users': User.objects(role__ne='admin').count(),
+        'total_courses': Course.objects.count(),
+        'total_enrollments': total_enrollments,
+        'top_course_id': top_course.id if top_course else None,
+        'top_course_title': top_course.title if top_course else None,
+        'top_course_created_by': top_course.created_by.id if top_course else None,
+        'top_course_enrollments': top_course.enrollment_count if top_course else 0,
+    }
+
+
+def rebuild_snapshot():
+    """Recount everything, or return None if the counters kept moving meanwhile (the snapshot stays stale)."""
+    for _ in range(REBUILD_ATTEMPTS):
+        current = _snapshot().only('updated_at').first()
+        fields = _count()
+        now = _now()
+        if current is None:
+            try:
+                return AnalyticsSnapshot(key=SNAPSHOT_KEY, refreshed_at=now, updated_at=now, **fields).save(
+                    force_insert=True)
+            except NotUniqueError:
+                continue  # a concurrent rebuild created it
+        updates = {f'set__{name}': value for name, value in fields.items()}
+        if _snapshot().filter(updated_at=current.updated_at).update_one(
+                set__refreshed_at=now, set__updated_at=now, **updates):
+            return _snapshot().first()
+    return None
+
+
+def refresh_in_background():
+    # Single-flight: at most one rebuild per process, readers keep the current snapshot meanwhile
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            rebuild_snapshot()
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name='analytics-refresh', daemon=True).start()
+    return True
+
+
+def get_snapshot():
+    snapshot = _snapshot().first()
+    if snapshot is None:
+        return rebuild_snapshot() or _snapshot().first()
+    if snapshot.refreshed_at is None or _now() - snapshot.refreshed_at > REFRESH_INTERVAL:
+        refresh_in_background()
+    return snapshot
+
+
+# Incremental events, called from the write paths
+
+def record_registration(user):
+    if user.role != 'admin':
+        _snapshot().update_one(inc__total_users=1, set__updated_at=_now())
+
+
+def record_user_deleted(user):
+    if user.role != 'admin':
+        _snapshot().update_one(dec__total_users=1, set__updated_at=_now())
+
+
+def record_course_created(course):
+    _snapshot().update_one(inc__total_courses=1, set__updated_at=_now())
+
+
+def record_course_deleted(course):
+    _snapshot().update_one(
+        dec__total_courses=1,
+        dec__total_enrollments=course.enrollment_count,
+        set__updated_at=_now(),
+    )
+    # Losing the top course means we no longer know the runner-up: mark stale for a rebuild
+    _snapshot().filter(top_course_id=course.id).update_one(
+        set__top_course_id=None,
+        set__top_course_title=None,
+        set__top_course_created_by=None,
+        set__top_course_enrollments=0,
+        set__refreshed_at=None,
+    )
+
+
+def record_enrollment(course, count=1):
+    """`course` must carry its enrollment_count *after* the $inc."""
+    _snapshot().update_one(inc__total_enrollments=count, set__updated_at=_now())
+    _snapshot().filter(top_course_enrollments__lt=course.enrollment_count).update_one(
+        set__top_course_id=course.id,
+        set__top_course_title=course.title,
+        set__top_course_created_by=course._data['created_by'].id,
+        set__top_course_enrollments=course.enrollment_count,
+    )
+
+
+def record_unenrollment(course_id):
+    _snapshot().update_one(dec__total_enrollments=1, set__updated_at=_now())
+    # Another course may overtake the top one now, let the next rebuild decide
+    _snapshot().filter(top_course_id=course_id).update_one(
+        dec__top_course_enrollments=1,
+        set__refreshed_at=None,
+    )
@@ -0,0 +1,487 @@
+# core/bench.py
+# Synthetic dataset + endpoint benchmark, driven by `python manage.py benchmark`.
+#
+# seed() fills a dedicated database with users, courses, enrollments,
+# assignments, submissions and GridFS videos (bulk inserts, so large
+# datasets seed quickly). Every route in core/urls.py has a scenario that
+# builds one request per iteration; requests are built (and any state they
+# need written) before the timed part, then sent either through the Django
+# test client (in process) or over HTTP to a running server.
+#
+# Per endpoint we report p50/p95/p99 latency, throughput, Mongo commands
+# per request (from the Server-Timing header of core/metrics.py) and the
+# peak RSS of the benchmarking process.
+import datetime
+import io
+import json
+import re
+import resource
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from bson import ObjectId
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from core import analytics, metrics, passwords, search, tokens
+from core.models import (User, Course, Enrollment, Assignment, Submission, AnalyticsSnapshot, UploadSession,
+                         Job, VideoRendition, CacheVersion, Tombstone)
+from core.mongo import get_fs
+from core.uploads import GRIDFS_CHUNK_SIZE, append_chunks, gridfs_collections
+
+BENCH_PASSWORD = 'bench-password'
+SEGMENT_SIZE = 64 * 1024
+SERVER_TIMING_COMMANDS_RE = re.compile(r'desc="(\d+) commands')
+
+MODELS = (User, Course, Enrollment, Assignment, Submission, AnalyticsSnapshot, UploadSession, Job,
+          VideoRendition, CacheVersion, Tombstone)
+
+
+class Spec:
+    """One request: JSON (dict), raw bytes or multipart (dict, multipart=True) body."""
+
+    def __init__(self, method, path, token=None, data=None, multipart=False, content_type='application/json',
+                 headers=None):
+        self.method = method
+        self.path = path
+        self.headers = dict(headers or {})
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self.body = None
+        self.content_type = content_type
+        if multipart:
+            self.body = encode_multipart(BOUNDARY, data)
+            self.content_type = MULTIPART_CONTENT
+        elif isinstance(data, bytes):
+            self.body = data
+        elif data is not None:
+            self.body = json.dumps(data).encode()
+
+
+def token_for(user):
+    return tokens.issue({
+        'id': str(user['_id']),
+        'username': user['username'],
+        'email': user['email'],
+        'role': user['role'],
+        'ver': 0,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24),
+    })
+
+
+# Seeding
+
+def drop_all():
+    for model in MODELS:
+        model.drop_collection()
+    for collection in gridfs_collections():
+        collection.drop()
+
+
+def insert(model, docs):
+    if docs:
+        model._get_collection().insert_many(docs, ordered=False)
+    return docs
+
+
+def make_users(prefix, role, count, password):
+    return [{'_id': ObjectId(), 'username': f'{prefix}{i}', 'email': f'{prefix}{i}@bench.example.com',
+             'password': password, 'role': role, 'token_version': 0} for i in range(count)]
+
+
+def assignment_title(course, a):
+    return f'Assignment {a} of {course["title"]}'
+
+
+def seed(rng, students, teachers, courses, enrollments, assignments, submissions, videos, video_size):
+    """Drop and refill the current database. Returns the context scenarios draw from."""
+    drop_all()
+    now = datetime.datetime.utcnow()
+    password = passwords.hash_password(BENCH_PASSWORD)
+
+    student_docs = insert(User, make_users('student', 'student', students, password))
+    teacher_docs = insert(User, make_users('teacher', 'teacher', teachers, password))
+    admin_docs = insert(User, make_users('admin', 'admin', 1, password))
+
+    fs = get_fs()
+    video_ids = [fs.put(rng.randbytes(video_size), filename=f'bench{i}.mp4',
+                        metadata={'contentType': 'video/mp4'}) for i in range(videos)]
+
+    course_docs = [{'_id': ObjectId(), 'title': f'Course {i}', 'description': f'Synthetic course {i}',
+                    'created_by': teacher_docs[i % teachers]['_id'], 'created_at': now,
+                    'video_id': video_ids[i] if i < videos else None, 'enrollment_count': 0}
+                   for i in range(courses)]
+    for course in course_docs:
+        course.update(search.document_terms(course['title'], course['description'],
+                                            [assignment_title(course, a) for a in range(assignments)]))
+
+    rosters = {course['_id']: [] for course in course_docs}
+    enrollment_docs = []
+    for student in student_docs:
+        for course in rng.sample(course_docs, min(enrollments, courses)):
+            rosters[course['_id']].append(student['_id'])
+            enrollment_docs.append({'student': student['_id'], 'course': course['_id'], 'enrolled_at': now})
+    for course in course_docs:
+        course['enrollment_count'] = len(rosters[course['_id']])
+    insert(Course, course_docs)
+    insert(Enrollment, enrollment_docs)
+
+    assignment_docs = insert(Assignment, [
+        {'_id': ObjectId(), 'title': assignment_title(course, a), 'description': 'Synthetic',
+         'course': course['_id'], 'created_by': course['created_by'], 'created_at': now}
+        for course in course_docs for a in range(assignments)
+    ])
+    submission_docs = insert(Submission, [
+        {'assignment': assignment['_id'], 'student': student_id, 'content': 'answer', 'submitted_at': now}
+        for assignment in assignment_docs
+        for student_id in rosters[assignment['course']] if rng.random() < submissions
+    ])
+
+    if video_ids:
+        # Fake three-segment rendition of the first video, for the HLS routes
+        segment_ids = [fs.put(rng.randbytes(SEGMENT_SIZE), metadata={'contentType': 'video/iso.segment'})
+                       for _ in range(3)]
+        init_id = fs.put(rng.randbytes(1024), metadata={'contentType': 'video/mp4'})
+        VideoRendition(video_id=video_ids[0], segment_seconds=6, init_id=init_id, segment_ids=segment_ids,
+                       durations=[6.0] * 3).save()
+
+    analytics.rebuild_snapshot()
+    return {
+        'students': student_docs,
+        'teachers': teacher_docs,
+        'admin': admin_docs[0],
+        'courses': course_docs,
+        'assignments': assignment_docs,
+        'video_ids': video_ids,
+        'counts': {'users': len(student_docs) + len(teacher_docs) + 1, 'courses': len(course_docs),
+                   'enrollments': len(enrollment_docs), 'assignments': len(assignment_docs),
+                   'submissions': len(submission_docs), 'videos': len(video_ids)},
+        'run': ObjectId(),  # unique suffix for users created while benchmarking
+    }
+
+
+# Scenarios: (ctx, i) -> Spec. Anything they write to set a request up is
+# written before the timed part starts.
+
+def pick(items, i):
+    return items[i % len(items)]
+
+
+def fresh_students(ctx, count=1):
+    # New, unenrolled students for the write scenarios (unique per call)
+    prefix = f"new{ctx['run']}-{ctx.setdefault('fresh', 0)}-"
+    ctx['fresh'] += 1
+    return insert(User, make_users(prefix, 'student', count, ctx['students'][0]['password']))
+
+
+def course_of_teacher(ctx, i):
+    teacher = pick(ctx['teachers'], i)
+    course = next(c for c in ctx['courses'] if c['created_by'] == teacher['_id'])
+    return teacher, course
+
+
+def upload_session(ctx, i, size):
+    teacher = pick(ctx['teachers'], i)
+    session = UploadSession(teacher=teacher['_id'], title=f'Upload {i}', filename='bench.mp4', size=size,
+                            chunk_size=GRIDFS_CHUNK_SIZE).save()
+    return teacher, session
+
+
+def magic_token(student):
+    return tokens.issue({'id': str(student['_id']), 'email': student['email'],
+                         'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=10)})
+
+
+def first_video(ctx):
+    return ctx['video_ids'][0] if ctx['video_ids'] else ObjectId()
+
+
+def register(ctx, i):
+    name = f"reg{ctx['run']}-{i}"
+    return Spec('POST', '/register/', data={'username': name, 'password': BENCH_PASSWORD,
+                                            'email': f'{name}@bench.example.com', 'role': 'student'})
+
+
+def send_magic_link(ctx, i):
+    return Spec('POST', '/send-magic-link/', data={'email': pick(ctx['students'], i)['email']})
+
+
+def verify_token(ctx, i):
+    return Spec('GET', f"/verify-token/?token={magic_token(pick(ctx['students'], i))}")
+
+
+def login_password(ctx, i):
+    return Spec('POST', '/login-password/', data={'username': pick(ctx['students'], i)['username'],
+                                                  'password': BENCH_PASSWORD})
+
+
+def dashboard(ctx, i):
+    return Spec('GET', '/dashboard/', token_for(pick(ctx['students'], i)))
+
+
+def upload_course(ctx, i):
+    return Spec('POST', '/upload-course/', token_for(pick(ctx['teachers'], i)), multipart=True, data={
+        'title': f'Uploaded {i}', 'description': 'bench', 'video': ('bench.mp4', io.BytesIO(bytes(SEGMENT_SIZE)))})
+
+
+def upload_course_init(ctx, i):
+    return Spec('POST', '/upload-course/init/', token_for(pick(ctx['teachers'], i)), data={
+        'title': f'Resumable {i}', 'filename': 'bench.mp4', 'size': GRIDFS_CHUNK_SIZE})
+
+
+def upload_course_status(ctx, i):
+    teacher, session = upload_session(ctx, i, GRIDFS_CHUNK_SIZE)
+    return Spec('GET', f'/upload-course/{session.id}/', token_for(teacher))
+
+
+def upload_course_chunk(ctx, i):
+    teacher, session = upload_session(ctx, i, GRIDFS_CHUNK_SIZE)
+    return Spec('PUT', f'/upload-course/{session.id}/', token_for(teacher), data=bytes(GRIDFS_CHUNK_SIZE),
+                content_type='application/octet-stream', headers={'Upload-Offset': '0'})
+
+
+def upload_course_complete(ctx, i):
+    teacher, session = upload_session(ctx, i, GRIDFS_CHUNK_SIZE)
+    append_chunks(session, io.BytesIO(bytes(GRIDFS_CHUNK_SIZE)), 0, GRIDFS_CHUNK_SIZE)
+    return Spec('POST', f'/upload-course/{session.id}/complete/', token_for(teacher))
+
+
+def teacher_dashboard(ctx, i):
+    return Spec('GET', '/teacher-dashboard/', token_for(pick(ctx['teachers'], i)))
+
+
+def get_courses(ctx, i):
+    return Spec('GET', '/courses/', token_for(pick(ctx['students'], i)))
+
+
+def search_courses(ctx, i):
+    # Alternate a common word, a typed prefix and one teacher's courses
+    query = ('course', f'synthetic {i % 100}', 'synth')[i % 3]
+    teacher = f"&teacher={pick(ctx['teachers'], i)['username']}" if i % 2 else ''
+    return Spec('GET', f'/search/?q={urllib.parse.quote(query)}{teacher}', token_for(pick(ctx['students'], i)))
+
+
+def enroll_course(ctx, i):
+    student = fresh_students(ctx)[0]
+    return Spec('POST', '/enroll/', token_for(student), data={'course_id': str(pick(ctx['courses'], i)['_id'])})
+
+
+def bulk_enroll(ctx, i):
+    teacher, course = course_of_teacher(ctx, i)
+    return Spec('POST', '/bulk-enroll/', token_for(teacher), data={
+        'course_id': str(course['_id']), 'students': [s['username'] for s in fresh_students(ctx, 20)]})
+
+
+def my_courses(ctx, i):
+    return Spec('GET', '/my-courses/', token_for(pick(ctx['students'], i)))
+
+
+def upload_assignment(ctx, i):
+    teacher, course = course_of_teacher(ctx, i)
+    return Spec('POST', '/upload-assignment/', token_for(teacher), data={
+        'title': f'New assignment {i}', 'course_id': str(course['_id'])})
+
+
+def list_assignments(ctx, i):
+    course = pick(ctx['courses'], i)
+    return Spec('GET', f"/list-assignments/?course_id={course['_id']}", token_for(pick(ctx['students'], i)))
+
+
+def submit_assignment(ctx, i):
+    student = fresh_students(ctx)[0]
+    return Spec('POST', '/submit-assignment/', token_for(student), data={
+        'assignment_id': str(pick(ctx['assignments'], i)['_id']), 'content': 'answer'})
+
+
+def view_submissions(ctx, i):
+    assignment = pick(ctx['assignments'], i)
+    teacher = next(t for t in ctx['teachers'] if t['_id'] == assignment['created_by'])
+    return Spec('GET', f"/view-submissions/?assignment_id={assignment['_id']}", token_for(teacher))
+
+
+def sync_changes(ctx, i):
+    # A dashboard that synced a minute ago: the delta, not the first full load
+    since = int(time.time()) - 60
+    users = ctx['teachers'] if i % 2 else ctx['students']
+    return Spec('GET', f'/sync/?since={since}', token_for(pick(users, i)))
+
+
+def admin_dashboard(ctx, i):
+    return Spec('GET', '/admin-dashboard/', token_for(ctx['admin']))
+
+
+def mongo_pool(ctx, i):
+    return Spec('GET', '/admin-dashboard/mongo-pool/', token_for(ctx['admin']))
+
+
+def performance_metrics(ctx, i):
+    return Spec('GET', '/admin-dashboard/metrics/', token_for(ctx['admin']))
+
+
+def serve_video(ctx, i):
+    return Spec('GET', f'/serve_video/{first_video(ctx)}', headers={'Range': 'bytes=0-65535'})
+
+
+def hls_playlist(ctx, i):
+    return Spec('GET', f'/videos/{first_video(ctx)}/playlist.m3u8')
+
+
+def hls_init_segment(ctx, i):
+    return Spec('GET', f'/videos/{first_video(ctx)}/init.mp4')
+
+
+def hls_segment(ctx, i):
+    return Spec('GET', f'/videos/{first_video(ctx)}/segments/{i % 3}.m4s')
+
+
+# One per route in core/urls.py, named after its view (except the teacher_events stream, which never ends)
+SCENARIOS = {func.__name__: func for func in (
+    register, send_magic_link, verify_token, login_password, dashboard,
+    upload_course, upload_course_init, upload_course_status, upload_course_chunk, upload_course_complete,
+    teacher_dashboard, get_courses, search_courses, enroll_course, bulk_enroll, my_courses,
+    upload_assignment, list_assignments, submit_assignment, view_submissions, sync_changes,
+    admin_dashboard, mongo_pool, performance_metrics,
+    serve_video, hls_playlist, hls_init_segment, hls_segment,
+)}
+
+
+TRACED_METHODS = ('find', 'aggregate', 'count_documents', 'distinct', 'insert_one', 'insert_many', 'update_one',
+                  'update_many', 'find_one_and_update', 'delete_one', 'delete_many', 'replace_one')
+
+
+@contextmanager
+def trace_mongomock():
+    """
+    mongomock emits no command events: inside this block, count its collection
+    operations into core.metrics instead, so Server-Timing still reports
+    (approximate) command counts when benchmarking in memory. The original
+    methods are put back on exit.
+    """
+    from mongomock.collection import Collection
+    originals = {name: Collection.__dict__.get(name) for name in TRACED_METHODS}
+
+    def traced(method):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                metrics.record_command((time.perf_counter() - started) * 1e6)
+        return wrapper
+
+    for name in TRACED_METHODS:
+        setattr(Collection, name, traced(getattr(Collection, name)))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            if method is None:
+                delattr(Collection, name)
+            else:
+                setattr(Collection, name, method)
+
+
+# Senders: spec -> (status, headers)
+
+class TestClientSender:
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, spec):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        response = client.generic(spec.method, spec.path, spec.body or b'', content_type=spec.content_type,
+                                  headers=spec.headers)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response.status_code, response.headers
+
+
+class HttpSender:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def __call__(self, spec):
+        headers = dict(spec.headers)
+        if spec.body is not None:
+            headers['Content-Type'] = spec.content_type
+        request = urllib.request.Request(self.base_url + spec.path, data=spec.body, headers=headers,
+                                         method=spec.method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers
+
+
+# Measuring
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # High-water mark of the whole process so far (KB on Linux), never goes down
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_scenario(name, ctx, sender, requests, concurrency):
+    specs = [SCENARIOS[name](ctx, i) for i in range(requests)]
+    rss_before = peak_rss_mb()
+
+    def send(spec):
+        started = time.perf_counter()
+        status, headers = sender(spec)
+        elapsed = (time.perf_counter() - started) * 1000
+        match = SERVER_TIMING_COMMANDS_RE.search(headers.get('Server-Timing') or '')
+        return elapsed, status, int(match.group(1)) if match else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(send, specs))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(s[0] for s in samples)
+    commands = [s[2] for s in samples if s[2] is not None]
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'throughput_rps': round(requests / wall, 1) if wall else None,
+        'mongo_commands': round(sum(commands) / len(commands), 2) if commands else None,
+        # How much this scenario raised the process peak, 0 if it stayed under an earlier one
+        'rss_growth_mb': round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return human readable regressions of `results` against a saved baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base['p95_ms'] and result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {result['p95_ms']}ms")
+        if base.get('mongo_commands') is not None and result['mongo_commands'] is not None \
+                and result['mongo_commands'] > base['mongo_commands']:
+            regressions.append(f"{name}: mongo commands {base['mongo_commands']} -> {result['mongo_commands']}")
+    return regressions
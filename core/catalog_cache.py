@@ -0,0 +1,87 @@
+# core/catalog_cache.py
+# Shared cache of the serialized course catalog (GET /courses/).
+#
+# The catalog is the same for every user, so each page is serialized once
+# and kept in the Django cache (CATALOG_CACHE_ALIAS). Keys embed the
+# 'courses' and 'enrollments' versions from core/http_cache.py: a new
+# course, a deleted course or an enrollment bumps a version, and the next
+# request simply misses. Nothing is ever deleted explicitly, and old
+# entries age out after CATALOG_CACHE_TTL.
+#
+# With the default LocMemCache every process keeps its own copy; point
+# CATALOG_CACHE_ALIAS at a shared backend (file, memcached, redis) to share
+# one copy between processes. The versions live in Mongo either way, so no
+# process can serve a stale catalog.
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.http_cache import version_state
+
+CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+CACHE_TTL = getattr(settings, 'CATALOG_CACHE_TTL', 10 * 60)
+VERSION_KEYS = ('courses', 'enrollments')
+
+# Single flight: one build per key and process, concurrent misses wait for it
+_locks = {}
+_locks_guard = threading.Lock()
+
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    requests = result['hits'] + result['misses'] + result['coalesced']
+    result['hit_rate'] = round((result['hits'] + result['coalesced']) / requests, 3) if requests else None
+    return result
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def cache_key(request):
+    state, _ = version_state(request, VERSION_KEYS)
+    # Same page / fields in any parameter order share an entry
+    query = '&'.join(sorted(request.GET.urlencode().split('&')))
+    return 'catalog:' + hashlib.md5(f'{state}|{query}'.encode()).hexdigest()
+
+
+def get_or_build(request, build):
+    """Return the serialized JSON body for this catalog request, calling `build()` on a miss."""
+    cache = caches[CACHE_ALIAS]
+    key = cache_key(request)
+    body = cache.get(key)
+    if body is not None:
+        _count('hits')
+        return body
+
+    with _locks_guard:
+        lock = _locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            body = cache.get(key)
+            if body is not None:
+                _count('coalesced')  # another thread built it while we waited
+                return body
+            _count('misses')
+            body = json.dumps(build(), cls=DjangoJSONEncoder)
+            cache.set(key, body, CACHE_TTL)
+            return body
+    finally:
+        with _locks_guard:
+            if _locks.get(key) is lock:
+                del _locks[key]
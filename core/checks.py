@@ -0,0 +1,29 @@
+# core/checks.py
+# `python manage.py check --database default` fails while a model that does
+# not build its own indexes (auto_create_index: False) is missing one of them.
+# Run `python manage.py mongo_indexes --dedupe --build` to fix it.
+from django.core.checks import Error, Tags, register
+from pymongo.errors import PyMongoError
+
+
+@register(Tags.database)
+def declared_indexes(app_configs=None, databases=('default',), **kwargs):
+    from core.management.commands.mongo_indexes import all_models
+
+    if not databases:  # only with --database, as Django's own database checks
+        return []
+    errors = []
+    for document in all_models():
+        if document._meta.get('auto_create_index', True):
+            continue
+        try:
+            missing = document.compare_indexes()['missing']
+        except PyMongoError as e:
+            return [Error(f'Cannot read the MongoDB indexes: {e}', id='core.E002')]
+        for index in missing:
+            errors.append(Error(
+                f'{document.__name__} is missing index {index}',
+                hint='Run python manage.py mongo_indexes --dedupe --build',
+                id='core.E001',
+            ))
+    return errors
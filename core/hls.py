@@ -0,0 +1,119 @@
+# core/hls.py
+# Segmented (HLS) representation of course videos.
+#
+# A `segment_video` job cuts the stored video into fixed-duration fMP4
+# segments with ffmpeg (stream copy, no re-encoding), stores every segment
+# as its own GridFS file and records them in a VideoRendition. The playlist
+# and segments are then served by index, each response immutable and
+# cacheable by a reverse proxy.
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+
+SEGMENT_SECONDS = getattr(settings, 'VIDEO_SEGMENT_SECONDS', 6)
+FFMPEG = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+SEGMENT_CONTENT_TYPE = 'video/iso.segment'
+INIT_CONTENT_TYPE = 'video/mp4'
+
+EXTINF_RE = re.compile(r'^#EXTINF:([\d.]+)')
+MAP_RE = re.compile(r'^#EXT-X-MAP:URI="([^"]+)"')
+
+
+class SegmentError(Exception):
+    pass
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG) is not None
+
+
+def parse_playlist(text):
+    """Return (init segment name, [(segment name, duration)]) from an ffmpeg VOD playlist."""
+    init, segments, duration = None, [], None
+    for line in text.splitlines():
+        line = line.strip()
+        if MAP_RE.match(line):
+            init = MAP_RE.match(line).group(1)
+        elif EXTINF_RE.match(line):
+            duration = float(EXTINF_RE.match(line).group(1))
+        elif line and not line.startswith('#'):
+            if duration is None:
+                raise SegmentError(f'Segment {line} has no #EXTINF')
+            segments.append((line, duration))
+            duration = None
+    return init, segments
+
+
+def segment_file(source, workdir, seconds=SEGMENT_SECONDS):
+    """
+    Copy the GridFS file to disk in pieces and cut it with ffmpeg.
+    Returns (init path, [(segment path, duration)]).
+    """
+    source_path = os.path.join(workdir, 'source')
+    with open(source_path, 'wb') as out:
+        for chunk in iter(lambda: source.read(source.chunk_size), b''):
+            out.write(chunk)
+
+    playlist = os.path.join(workdir, 'index.m3u8')
+    command = [
+        FFMPEG, '-v', 'error', '-y', '-i', source_path,
+        '-c', 'copy', '-f', 'hls',
+        '-hls_time', str(seconds),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4',
+        '-hls_fmp4_init_filename', 'init.mp4',
+        '-hls_segment_filename', os.path.join(workdir, 'seg%05d.m4s'),
+        playlist,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SegmentError(result.stderr.strip() or 'ffmpeg failed')
+
+    with open(playlist) as f:
+        init, segments = parse_playlist(f.read())
+    return (os.path.join(workdir, init) if init else None,
+            [(os.path.join(workdir, name), duration) for name, duration in segments])
+
+
+def build_rendition(fs, source, video_id):
+    """Segment `source` and store init + segments in GridFS, returns the VideoRendition fields."""
+    with tempfile.TemporaryDirectory(prefix='hls-') as workdir:
+        init_path, segments = segment_file(source, workdir)
+
+        def store(path, kind, index=None):
+            with open(path, 'rb') as f:
+                return fs.put(f, filename=os.path.basename(path), metadata={
+                    'video_id': video_id, 'kind': kind, 'index': index,
+                    'contentType': INIT_CONTENT_TYPE if kind == 'init' else SEGMENT_CONTENT_TYPE,
+                })
+
+        return {
+            'init_id': store(init_path, 'init') if init_path else None,
+            'segment_ids': [store(path, 'segment', i) for i, (path, _) in enumerate(segments)],
+            'durations': [duration for _, duration in segments],
+        }
+
+
+def render_playlist(rendition):
+    # Segment URIs are relative to the playlist URL: /videos/<id>/playlist.m3u8
+    target = max([1] + [int(d + 0.999) for d in rendition.durations])
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:7',
+        f'#EXT-X-TARGETDURATION:{target}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        '#EXT-X-INDEPENDENT-SEGMENTS',
+    ]
+    if rendition.init_id:
+        lines.append('#EXT-X-MAP:URI="init.mp4"')
+    for index, duration in enumerate(rendition.durations):
+        lines.append(f'#EXTINF:{duration:.3f},')
+        lines.append(f'segments/{index}.m4s')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
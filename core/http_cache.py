@@ -0,0 +1,103 @@
+# core/http_cache.py
+# Conditional GETs for the JSON read endpoints.
+#
+# Every endpoint depends on a few named version counters (CacheVersion):
+#
+#   'courses'            a course was created, deleted or its video changed
+#   'enrollments'        any enrollment changed (counts, rosters)
+#   'student:<id>'       the enrollments of one student changed
+#   'course:<id>'        the assignments of one course changed
+#
+# Writes bump the counters they affect. A GET reads the counters in one
+# query and derives the ETag / Last-Modified from them, so an unchanged
+# payload is answered with 304 before the view runs any other query or
+# serializes anything.
+import datetime
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from pymongo.errors import BulkWriteError
+
+from core.models import CacheVersion
+
+# Browsers keep the response but always revalidate it (cheap 304)
+PRIVATE_REVALIDATE = 'private, no-cache'
+
+
+def bump(*keys):
+    """Invalidate everything that depends on `keys`, one round trip once the counters exist."""
+    keys = list(set(keys))
+    if not keys:
+        return
+    now = datetime.datetime.utcnow()
+    collection = CacheVersion._get_collection()
+    result = collection.update_many({'_id': {'$in': keys}}, {'$inc': {'version': 1}, '$set': {'updated_at': now}})
+    if result.matched_count < len(keys):
+        # First bump of some keys. A duplicate key here means a concurrent
+        # bump created the counter, which invalidates just the same.
+        existing = set(collection.distinct('_id', {'_id': {'$in': keys}}))
+        try:
+            collection.insert_many([{'_id': key, 'version': 1, 'updated_at': now}
+                                    for key in keys if key not in existing], ordered=False)
+        except BulkWriteError:
+            pass
+
+
+def current_versions(keys):
+    return {v['_id']: v for v in CacheVersion.objects(key__in=list(keys)).as_pymongo()}
+
+
+def version_state(request, keys):
+    """
+    Return (state, versions) for `keys`, state being a string that changes
+    whenever one of them is bumped. Memoized on the request, so the ETag and
+    the catalog cache (core/catalog_cache.py) share a single lookup.
+    """
+    memo = request.__dict__.setdefault('_cache_versions', {})
+    keys = tuple(sorted(keys))
+    if keys not in memo:
+        versions = current_versions(keys)
+        state = ','.join(f"{key}={versions.get(key, {}).get('version', 0)}" for key in keys)
+        memo[keys] = state, versions
+    return memo[keys]
+
+
+def validators(request, keys):
+    """Return (etag, last_modified timestamp or None) for this request and user."""
+    state, versions = version_state(request, keys)
+    user_id = getattr(getattr(request, 'user', None), 'id', '')
+    digest = hashlib.md5(f'{user_id}|{request.get_full_path()}|{state}'.encode()).hexdigest()
+
+    updated = [v['updated_at'] for v in versions.values() if v.get('updated_at')]
+    last_modified = int(max(updated).replace(tzinfo=datetime.timezone.utc).timestamp()) if updated else None
+    return f'"{digest}"', last_modified
+
+
+def conditional(keys):
+    """
+    View decorator (inside @jwt_auth): `keys(request, *args, **kwargs)` returns
+    the version keys the response depends on.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            etag, last_modified = validators(request, keys(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                return response
+
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = PRIVATE_REVALIDATE
+            patch_vary_headers(response, ['Authorization'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,144 @@
+# core/jobs.py
+# Small Mongo-backed job queue, so post-processing needs no external broker.
+#
+#   enqueue('process_video', course_id=...)      from a request
+#   python manage.py run_jobs --processes 2      worker processes
+#
+# Workers claim jobs with one atomic findAndModify and hold a lease, renewed
+# by a heartbeat while the handler runs; a job whose worker died is picked up
+# again once its lease expires, or failed if that was its last attempt. Only
+# the lease holder records the outcome, and handlers must be safe to run
+# twice. Failed jobs are retried with exponential backoff up to max_attempts.
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+from mongoengine.queryset.visitor import Q
+
+from core.models import Job
+
+LEASE = datetime.timedelta(seconds=getattr(settings, 'JOB_LEASE_SECONDS', 30 * 60))
+RETRY_DELAY = getattr(settings, 'JOB_RETRY_DELAY_SECONDS', 30)
+HEARTBEAT_SECONDS = LEASE.total_seconds() / 3
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register a function as the handler for `kind` jobs."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, max_attempts=3, delay=None, **payload):
+    """Queue a job, to run `delay` (a timedelta) from now if given."""
+    run_after = datetime.datetime.utcnow() + (delay or datetime.timedelta())
+    return Job(kind=kind, payload=payload, max_attempts=max_attempts, run_after=run_after).save()
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+HAS_ATTEMPTS_LEFT = {'$expr': {'$lt': ['$attempts', '$max_attempts']}}
+
+
+def fail_expired(now):
+    # A job whose worker died on its last attempt is not run again
+    return Job.objects(Q(status=Job.RUNNING, locked_until__lt=now) & Q(__raw__={'$nor': [HAS_ATTEMPTS_LEFT]})).update(
+        set__status=Job.FAILED, set__error='Lease expired on the last attempt',
+        set__finished_at=now, unset__locked_until=True)
+
+
+def claim(worker):
+    now = datetime.datetime.utcnow()
+    if fail_expired(now):
+        logger.warning("Marked jobs whose lease expired on their last attempt as failed")
+    ready = Q(status=Job.QUEUED, run_after__lte=now) | \
+        Q(status=Job.RUNNING, locked_until__lt=now, __raw__=HAS_ATTEMPTS_LEFT)
+    return Job.objects(ready).order_by('run_after').modify(
+        set__status=Job.RUNNING,
+        set__locked_by=worker,
+        set__locked_until=now + LEASE,
+        set__started_at=now,
+        inc__attempts=1,
+        new=True,
+    )
+
+
+def leased(job):
+    # The job, as long as this worker still holds its lease
+    return Job.objects(id=job.id, status=Job.RUNNING, locked_by=job.locked_by)
+
+
+@contextmanager
+def heartbeat(job):
+    """Renew the lease of `job` every HEARTBEAT_SECONDS while the block runs (e.g. a long ffmpeg)."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_SECONDS):
+            if not leased(job).update_one(set__locked_until=datetime.datetime.utcnow() + LEASE):
+                logger.warning("Job %s lost its lease, another worker may run it", job.id)
+                return
+
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{job.id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f'No handler for job kind {job.kind!r}')
+        with heartbeat(job):
+            result = func(**job.payload) or {}
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = datetime.timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+            recorded = leased(job).update_one(set__status=Job.QUEUED, set__error=error,
+                                              set__run_after=datetime.datetime.utcnow() + delay,
+                                              unset__locked_until=True)
+        else:
+            recorded = leased(job).update_one(set__status=Job.FAILED, set__error=error,
+                                              set__finished_at=datetime.datetime.utcnow(), unset__locked_until=True)
+        if not recorded:
+            logger.warning("Job %s failed after losing its lease, outcome left to the new holder", job.id)
+        return False
+
+    if not leased(job).update_one(set__status=Job.DONE, set__result=result,
+                                  set__finished_at=datetime.datetime.utcnow(), unset__locked_until=True):
+        logger.warning("Job %s finished after losing its lease, outcome left to the new holder", job.id)
+        return False
+    return True
+
+
+def run_worker(poll_interval=2.0, once=False, stop=None):
+    """Process jobs until `stop` (a threading/multiprocessing Event) is set, or the queue is empty if `once`."""
+    import core.tasks  # noqa: F401, registers the handlers
+
+    worker = worker_name()
+    while not (stop and stop.is_set()):
+        job = claim(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
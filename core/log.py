@@ -0,0 +1,155 @@
+# core/log.py
+# Structured, non-blocking logging for the `core` loggers.
+#
+# BackgroundHandler only puts records on an in-memory queue; a
+# QueueListener thread formats them as one JSON object per line and writes
+# them out, so a slow stdout / log pipe never blocks a request. When the
+# queue is full records are dropped (and counted) instead of waiting.
+#
+# RequestIdMiddleware gives every request an id (incoming X-Request-ID or a
+# new one), echoed in the response and attached to every record logged
+# while handling it. DEBUG records are sampled per request
+# (LOG_DEBUG_SAMPLE_RATE): a sampled request logs all of its debug lines,
+# the others none.
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Attributes every LogRecord has, everything else was passed with extra=
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_debug_sampled = contextvars.ContextVar('debug_sampled', default=None)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def debug_sample_rate():
+    return getattr(settings, 'LOG_DEBUG_SAMPLE_RATE', 0.01)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RESERVED_ATTRS})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SampleDebugFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        sampled = _debug_sampled.get()
+        if sampled is None:  # outside a request
+            return random.random() < debug_sample_rate()
+        return sampled
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Hands records to a QueueListener thread that writes JSON lines to `stream`."""
+
+    def __init__(self, maxsize=10000, stream=None):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Runs on the request thread: resolve everything that depends on it
+        # (message args, exception, request id) so the listener only serializes
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = get_request_id()
+        return record
+
+    def close(self):
+        # Called by logging.shutdown() at exit: flush what is still queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+def dropped_records():
+    return sum(getattr(handler, 'dropped', 0) for handler in logging.getLogger('core').handlers)
+
+
+class RequestIdMiddleware:
+    """
+    Put it first in MIDDLEWARE so every log line of the request carries the id.
+    Sync and async capable, like MetricsMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        incoming = request.headers.get('X-Request-ID', '')
+        request.request_id = incoming if REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        return _request_id.set(request.request_id), _debug_sampled.set(random.random() < debug_sample_rate())
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        id_token, sample_token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_id.reset(id_token)
+            _debug_sampled.reset(sample_token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        id_token, sample_token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_id.reset(id_token)
+            _debug_sampled.reset(sample_token)
+        response['X-Request-ID'] = request.request_id
+        return response
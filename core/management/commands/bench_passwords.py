@@ -0,0 +1,41 @@
+import os
+import time
+
+import bcrypt
+from django.core.management.base import BaseCommand, CommandError
+
+from core import passwords
+
+
+class Command(BaseCommand):
+    help = 'Measure bcrypt password checks (logins) per second per core at each cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--costs', default='10,11,12,13', help='Comma separated bcrypt costs')
+        parser.add_argument('--seconds', type=float, default=2.0, help='Time spent on each cost')
+
+    def handle(self, *args, **options):
+        try:
+            costs = [int(c) for c in options['costs'].split(',')]
+        except ValueError:
+            raise CommandError('--costs must be comma separated integers')
+        cores = os.cpu_count() or 1
+        password = b'correct horse battery staple'
+
+        self.stdout.write(f'{cores} cores, {passwords.WORKERS} hashing workers, BCRYPT_ROUNDS={passwords.ROUNDS}')
+        for cost in costs:
+            hashed = bcrypt.hashpw(password, bcrypt.gensalt(cost))
+            # One process = one core: checkpw is what a login costs
+            count, started = 0, time.perf_counter()
+            while True:
+                bcrypt.checkpw(password, hashed)
+                count += 1
+                elapsed = time.perf_counter() - started
+                if elapsed >= options['seconds']:
+                    break
+            per_core = count / elapsed
+            current = '  <- current' if cost == passwords.ROUNDS else ''
+            self.stdout.write(
+                f'cost {cost:2d}: {1000 * elapsed / count:8.1f} ms/login  {per_core:8.1f} logins/s per core'
+                f'  ~{per_core * min(passwords.WORKERS or 1, cores):8.1f} logins/s with the pool{current}'
+            )
@@ -0,0 +1,45 @@
+import datetime
+import time
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import tokens
+from core.utils import TTLCache
+
+
+class Command(BaseCommand):
+    help = 'Measure JWT verifications/sec: plain jwt.decode vs core.tokens (cold and cached)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on each variant')
+
+    def rate(self, func, seconds):
+        count, started = 0, time.perf_counter()
+        while True:
+            func(count)
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= seconds:
+                return count / elapsed
+
+    def handle(self, *args, **options):
+        payload = {'id': '0' * 24, 'username': 'bench', 'email': 'bench@example.com', 'role': 'student',
+                   'ver': 0, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}
+        legacy = jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
+        token = tokens.issue(payload)
+        # Two tokens alternating through a one-entry cache: every verification misses
+        cold = [tokens.issue({**payload, 'n': n}) for n in range(2)]
+
+        self.stdout.write(f"{'before: jwt.decode':28} "
+                          f"{self.rate(lambda n: jwt.decode(legacy, settings.SECRET_KEY, algorithms=['HS256']), options['seconds']):12,.0f} verifications/s")
+        cache = tokens.verified_cache
+        try:
+            tokens.verified_cache = TTLCache(maxsize=1, ttl=cache.ttl)
+            miss = self.rate(lambda n: tokens.verify(cold[n % 2]), options['seconds'])
+        finally:
+            tokens.verified_cache = cache
+        self.stdout.write(f"{'tokens.verify, cache miss':28} {miss:12,.0f} verifications/s")
+        hit = self.rate(lambda n: tokens.verify(token), options['seconds'])
+        self.stdout.write(f"{'tokens.verify, cached':28} {hit:12,.0f} verifications/s")
@@ -0,0 +1,105 @@
+import contextlib
+import json
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from mongoengine import connect, disconnect
+
+from core import bench
+from core.mongo import connect_default
+from core.utils import user_cache
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic LMS dataset into a separate database and benchmark every endpoint '
+            '(p50/p95/p99, throughput, Mongo commands, RSS growth), optionally against a saved baseline. '
+            'With --url the requests go over HTTP to a server started with MONGO_DB set to --db.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default='lms_bench', help='Database to seed (dropped first)')
+        parser.add_argument('--mongomock', action='store_true', help='Seed and run in memory, no MongoDB needed')
+        parser.add_argument('--students', type=int, default=500)
+        parser.add_argument('--teachers', type=int, default=20)
+        parser.add_argument('--courses', type=int, default=100)
+        parser.add_argument('--enrollments', type=int, default=5, help='Courses per student')
+        parser.add_argument('--assignments', type=int, default=3, help='Assignments per course')
+        parser.add_argument('--submissions', type=float, default=0.5,
+                            help='Share of enrolled students that submitted each assignment')
+        parser.add_argument('--videos', type=int, default=5)
+        parser.add_argument('--video-size', type=int, default=1024 * 1024)
+        parser.add_argument('--seed', type=int, default=1, help='Random seed of the dataset')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--url', help='Base URL of a running server, default is the in-process test client')
+        parser.add_argument('--endpoints', help='Comma separated scenario names (default: all)')
+        parser.add_argument('--baseline', help='JSON file from --save-baseline to compare against')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 slowdown vs the baseline')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if not options['mongomock'] and options['db'] == settings.MONGO_DB:
+            raise CommandError(f"--db must not be the application database ({settings.MONGO_DB}), it is dropped")
+        names = options['endpoints'].split(',') if options['endpoints'] else list(bench.SCENARIOS)
+        unknown = [name for name in names if name not in bench.SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(unknown)}")
+        if options['mongomock'] and options['url']:
+            raise CommandError('--mongomock only works with the in-process test client')
+
+        disconnect()
+        if options['mongomock']:
+            import mongomock  # requirements-dev.txt
+            import mongomock.gridfs
+            mongomock.gridfs.enable_gridfs_integration()
+            connect(options['db'], mongo_client_class=mongomock.MongoClient)
+            tracing = bench.trace_mongomock()
+        else:
+            connect_default(options['db'])
+            tracing = contextlib.nullcontext()
+        cache.clear()
+        user_cache.clear()
+
+        with tracing:
+            ctx, results = self.run(names, options)
+        self.stdout.write(f'Process peak RSS {bench.peak_rss_mb():.1f} MB '
+                          f'(rss +MB: how much each endpoint raised it)')
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'dataset': ctx['counts'], 'requests': options['requests'],
+                           'concurrency': options['concurrency'], 'results': results}, f, indent=2)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = bench.compare(results, baseline['results'], options['threshold'])
+            for line in regressions:
+                self.stdout.write(self.style.WARNING(f'REGRESSION {line}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run(self, names, options):
+        ctx = bench.seed(random.Random(options['seed']), options['students'], options['teachers'],
+                         options['courses'], options['enrollments'], options['assignments'],
+                         options['submissions'], options['videos'], options['video_size'])
+        self.stdout.write('Seeded ' + ', '.join(f'{count} {name}' for name, count in ctx['counts'].items()))
+
+        sender = bench.HttpSender(options['url']) if options['url'] else bench.TestClientSender()
+        results = {}
+        # The test client sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            self.stdout.write(f"{'endpoint':24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} "
+                              f"{'mongo':>6} {'errors':>6} {'rss +MB':>7}")
+            for name in names:
+                result = results[name] = bench.run_scenario(name, ctx, sender, options['requests'],
+                                                            options['concurrency'])
+                mongo = '-' if result['mongo_commands'] is None else result['mongo_commands']
+                self.stdout.write(f"{name:24} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+                                  f"{result['p99_ms']:9.2f} {result['throughput_rps']:8.1f} {mongo:>6} "
+                                  f"{result['errors']:6d} {result['rss_growth_mb']:7.1f}")
+        return ctx, results
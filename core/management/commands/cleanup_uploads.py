@@ -0,0 +1,61 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from mongoengine.queryset.visitor import Q
+
+from core.models import Course, UploadSession
+from core.uploads import FINALIZE_TIMEOUT, discard_upload, gridfs_collections
+
+
+class Command(BaseCommand):
+    help = 'Delete stale partial video uploads and the GridFS chunks they left behind'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=24,
+                            help='Uploads without progress for this long are discarded')
+        parser.add_argument('--orphans', action='store_true',
+                            help='Also delete GridFS chunks that belong to no file and no active upload')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=options['max_age_hours'])
+        # A finalizing session whose request died can be taken over by a retried
+        # complete request for FINALIZE_TIMEOUT, give it that long on top
+        finalize_cutoff = cutoff - FINALIZE_TIMEOUT
+        stale = UploadSession.objects(Q(status=UploadSession.UPLOADING, updated_at__lt=cutoff) |
+                                      Q(status=UploadSession.FINALIZING, updated_at__lt=finalize_cutoff))
+
+        discarded = completed = 0
+        for session in stale:
+            # The request may have died after saving the course: its video is in use
+            course = Course.objects(video_id=session.file_id).first() \
+                if session.status == UploadSession.FINALIZING else None
+            if course is not None:
+                self.stdout.write(f'Upload {session.id} already created course {course.id}, marking it complete')
+                if not options['dry_run']:
+                    session.update(set__status=UploadSession.COMPLETE, set__course=course,
+                                   set__updated_at=datetime.datetime.utcnow())
+                completed += 1
+                continue
+            self.stdout.write(f'Stale upload {session.id}: {session.offset}/{session.size} bytes of {session.filename}')
+            if not options['dry_run']:
+                discard_upload(session)
+            discarded += 1
+        self.stdout.write(self.style.SUCCESS(f'Discarded {discarded} stale uploads, completed {completed}'))
+
+        if options['orphans']:
+            self.delete_orphans(finalize_cutoff, options['dry_run'])
+
+    def delete_orphans(self, finalize_cutoff, dry_run):
+        # Chunks left by uploads that failed before the fs.files document was written
+        files, chunks = gridfs_collections()
+        active = set(UploadSession.objects(Q(status=UploadSession.UPLOADING) |
+                                           Q(status=UploadSession.FINALIZING, updated_at__gte=finalize_cutoff))
+                     .distinct('file_id'))
+        orphans = [files_id for files_id in chunks.distinct('files_id')
+                   if files_id not in active and not files.count_documents({'_id': files_id}, limit=1)]
+        for files_id in orphans:
+            self.stdout.write(f'Orphaned chunks of {files_id}')
+            if not dry_run:
+                chunks.delete_many({'files_id': files_id})
+        self.stdout.write(self.style.SUCCESS(f'Found {len(orphans)} orphaned files'))
@@ -0,0 +1,161 @@
+import inspect
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from mongoengine import Document
+from pymongo.errors import OperationFailure
+
+from core import models
+from core.http_cache import bump
+from core.models import Assignment, Course, Enrollment, Submission
+
+# The query shapes our views actually send, explained with --explain
+QUERY_SHAPES = {
+    'get_courses page': lambda: Course.objects.order_by('id'),
+    'search words': lambda: Course.objects(search_terms__all=['intro', 'python']),
+    'search prefix': lambda: Course.objects(search_terms__startswith='pyt'),
+    'search by teacher': lambda: Course.objects(created_by=ObjectId(), search_terms__all=['python']),
+    'teacher_dashboard courses': lambda: Course.objects(created_by=ObjectId()).order_by('id'),
+    'analytics top course': lambda: Course.objects(enrollment_count__gt=0).order_by('-enrollment_count', 'id'),
+    'enroll duplicate check': lambda: Enrollment.objects(student=ObjectId(), course=ObjectId()),
+    'my_courses page': lambda: Enrollment.objects(student=ObjectId()).order_by('id'),
+    'enrollments per course': lambda: Enrollment.objects(course=ObjectId()),
+    'list_assignments page': lambda: Assignment.objects(course=ObjectId()).order_by('id'),
+    'submission duplicate check': lambda: Submission.objects(assignment=ObjectId(), student=ObjectId()),
+    'view_submissions page': lambda: Submission.objects(assignment=ObjectId()).order_by('id'),
+}
+
+# Stages that mean the query is not served by an index
+BAD_STAGES = {'COLLSCAN', 'SORT'}
+
+
+def all_models():
+    return [obj for obj in vars(models).values()
+            if inspect.isclass(obj) and issubclass(obj, Document) and obj is not Document
+            and not obj._meta.get('abstract')]
+
+
+def plan_stages(plan):
+    stages = [plan.get('stage')]
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            stages += plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+class Command(BaseCommand):
+    help = 'Build, compare and explain the MongoDB indexes declared on core.models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dedupe', action='store_true',
+                            help='Delete documents that violate a declared unique index (keeps the oldest). '
+                                 'Required once with --build when upgrading a database, see README')
+        parser.add_argument('--build', action='store_true', help='Create every declared index')
+        parser.add_argument('--explain', action='store_true', help='Explain the query shapes used by the views')
+        parser.add_argument('--slow-ms', type=int, default=None,
+                            help='Explain queries slower than this from system.profile (profiling must be on)')
+
+    def handle(self, *args, **options):
+        documents = all_models()
+
+        if options['dedupe']:
+            for document in documents:
+                self.dedupe(document)
+
+        if options['build']:
+            for document in documents:
+                document.ensure_indexes()
+                self.stdout.write(f'Built indexes for {document.__name__}')
+
+        for document in documents:
+            self.report(document)
+
+        if options['explain']:
+            self.explain_shapes()
+
+        if options['slow_ms'] is not None:
+            self.explain_profile(options['slow_ms'])
+
+    def dedupe(self, document):
+        # Raw collection: Document._get_collection() would try to build the unique
+        # indexes first and fail on the very duplicates we are removing
+        collection = document._get_db()[document._get_collection_name()]
+        for spec in document._meta['index_specs']:
+            if not spec.get('unique'):
+                continue
+            fields = [field for field, _ in spec['fields']]
+            duplicates = collection.aggregate([
+                {'$group': {'_id': {field: f'${field}' for field in fields},
+                            'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+                {'$match': {'count': {'$gt': 1}}},
+            ], allowDiskUse=True)
+            extra = [doc_id for group in duplicates for doc_id in sorted(group['ids'])[1:]]
+            if extra:
+                if document is Enrollment:
+                    students = collection.distinct('student', {'_id': {'$in': extra}})
+                collection.delete_many({'_id': {'$in': extra}})
+                if document is Enrollment:
+                    bump('courses', 'enrollments', *(f'student:{student}' for student in students))
+            self.stdout.write(f"{document.__name__}: removed {len(extra)} duplicates of {', '.join(fields)}")
+            if extra and document is Enrollment:
+                self.stdout.write(self.style.WARNING(
+                    'Run reconcile_enrollment_counts and refresh_analytics: the removed enrollments were counted'))
+
+    def report(self, document):
+        diff = document.compare_indexes()
+        name = document.__name__
+        for index in diff['missing']:
+            self.stdout.write(self.style.WARNING(f'{name}: missing index {index}'))
+        for index in diff['extra']:
+            self.stdout.write(f'{name}: index {index} exists but is not declared')
+
+        try:
+            stats = list(document._get_collection().aggregate([{'$indexStats': {}}]))
+        except (OperationFailure, NotImplementedError):
+            return
+        for stat in stats:
+            if stat['name'] != '_id_' and not stat['accesses']['ops']:
+                since = stat['accesses'].get('since')
+                self.stdout.write(f"{name}: index {stat['name']} unused since {since}")
+
+    def explain_shapes(self):
+        for label, build in QUERY_SHAPES.items():
+            try:
+                explain = build().explain()
+            except (OperationFailure, NotImplementedError, AttributeError) as e:  # mongomock has no explain
+                self.stdout.write(f'{label}: cannot explain ({e})')
+                continue
+            self.print_plan(label, explain)
+
+    def explain_profile(self, slow_ms):
+        db = Course._get_db()
+        slow = db['system.profile'].find({'millis': {'$gte': slow_ms}, 'command': {'$exists': True}})
+        seen = set()
+        for entry in slow.sort('millis', -1):
+            command = dict(entry['command'])
+            if not {'find', 'aggregate', 'count'} & set(command):
+                continue
+            command.pop('lsid', None)
+            command.pop('$db', None)
+            shape = (entry['ns'], str(sorted(command.get('filter', {}))))
+            if shape in seen:
+                continue
+            seen.add(shape)
+            try:
+                explain = db.command({'explain': command, 'verbosity': 'executionStats'})
+            except OperationFailure as e:
+                self.stdout.write(f"{entry['ns']} ({entry['millis']} ms): cannot explain ({e})")
+                continue
+            self.print_plan(f"{entry['ns']} ({entry['millis']} ms)", explain)
+
+    def print_plan(self, label, explain):
+        planner = explain.get('queryPlanner', {})
+        stages = plan_stages(planner.get('winningPlan', {}))
+        stats = explain.get('executionStats', {})
+        line = (f"{label}: {' <- '.join(stages)}"
+                f" | examined {stats.get('totalDocsExamined', '?')} docs,"
+                f" returned {stats.get('nReturned', '?')}, {stats.get('executionTimeMillis', '?')} ms")
+        if BAD_STAGES & set(stages):
+            self.stdout.write(self.style.WARNING(line))
+        else:
+            self.stdout.write(line)
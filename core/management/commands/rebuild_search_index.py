@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+from core.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Recompute the search terms of every course (after changing the tokenizer, or for courses created before search)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        batch = []
+        for course_id in Course.objects.scalar('id').batch_size(batch_size):
+            batch.append(course_id)
+            if len(batch) >= batch_size:
+                updated += search.rebuild(batch)
+                batch = []
+        if batch:
+            updated += search.rebuild(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {updated} courses'))
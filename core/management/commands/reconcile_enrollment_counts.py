@@ -0,0 +1,53 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from core.http_cache import bump
+from core.models import Course
+from core.utils import enrollment_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute Course.enrollment_count from the Enrollment collection and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report courses whose counter is wrong')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = fixed = 0
+        batch = []
+
+        courses = Course.objects.only('id', 'enrollment_count').as_pymongo()
+        for course in courses.batch_size(batch_size):
+            batch.append(course)
+            if len(batch) >= batch_size:
+                fixed += self.reconcile(batch, options['dry_run'])
+                checked += len(batch)
+                batch = []
+        if batch:
+            fixed += self.reconcile(batch, options['dry_run'])
+            checked += len(batch)
+
+        if fixed and not options['dry_run']:
+            # Cached course lists and catalogs carry the counts
+            bump('courses', 'enrollments')
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} courses, {verb} {fixed}'))
+
+    def reconcile(self, courses, dry_run):
+        # One $group per batch, then only touch the courses that drifted
+        counts = enrollment_counts(course['_id'] for course in courses)
+        fixed = 0
+        for course in courses:
+            actual = counts.get(course['_id'], 0)
+            stored = course.get('enrollment_count', 0)
+            if actual == stored:
+                continue
+            fixed += 1
+            self.stdout.write(f"Course {course['_id']}: stored {stored}, actual {actual}")
+            if not dry_run:
+                Course.objects(id=course['_id']).update_one(set__enrollment_count=actual,
+                                                            set__updated_at=datetime.datetime.utcnow())
+        return fixed
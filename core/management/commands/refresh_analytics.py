@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.analytics import rebuild_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the admin analytics snapshot (run from cron, or keep running with --interval)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and rebuild every N seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            snapshot = rebuild_snapshot()
+            if snapshot is None:
+                self.stdout.write('Analytics kept changing during the rebuild, retrying on the next run')
+            else:
+                self.stdout.write(
+                    f'Analytics refreshed at {snapshot.refreshed_at:%Y-%m-%d %H:%M:%S}: '
+                    f'{snapshot.total_users} users, {snapshot.total_courses} courses, '
+                    f'{snapshot.total_enrollments} enrollments'
+                )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
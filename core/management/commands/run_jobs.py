@@ -0,0 +1,47 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import run_worker
+
+
+def worker_process(poll_interval, stop):
+    # Fresh interpreter (spawn): set Django up again, the Mongo client is not fork-safe anyway
+    import django
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(poll_interval=poll_interval, stop=stop)
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers (video post-processing)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--once', action='store_true', help='Drain the queue in this process and exit')
+
+    def handle(self, *args, **options):
+        if options['once'] or options['processes'] == 1:
+            try:
+                run_worker(poll_interval=options['poll_interval'], once=options['once'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        workers = [context.Process(target=worker_process, args=(options['poll_interval'], stop), daemon=True)
+                   for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} job workers")
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Let running jobs finish, the lease would re-queue them otherwise
+            stop.set()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,187 @@
+# core/media.py
+# Minimal container inspection for uploaded videos, pure Python so workers
+# need no ffmpeg: sniff the real content type, read the MP4 duration and
+# move the moov atom in front of mdat ("faststart") so playback can start
+# before the whole file is downloaded.
+#
+# Everything works on seekable file objects (GridOut / GridIn): only the
+# box headers and the moov atom are read into memory, media data is copied
+# through in fixed-size pieces.
+import struct
+
+# moov is normally a few MB, anything bigger is not worth holding in memory
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+COPY_SIZE = 255 * 1024
+
+# Boxes we descend into to find mvhd / stco / co64
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class MediaError(Exception):
+    pass
+
+
+class Box:
+    def __init__(self, kind, offset, size, header_size):
+        self.kind = kind
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+def sniff_content_type(head):
+    """Guess the container from the first bytes of the file."""
+    if head[4:8] == b'ftyp':
+        return 'video/quicktime' if head[8:12] == b'qt  ' else 'video/mp4'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'video/webm' if b'webm' in head[:64] else 'video/x-matroska'
+    if head[:4] == b'OggS':
+        return 'video/ogg'
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'video/x-msvideo'
+    return 'application/octet-stream'
+
+
+def parse_box_header(data, offset, end):
+    size, kind = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset  # box runs to the end of its parent
+    if size < header_size or offset + size > end:
+        raise MediaError(f'Corrupt {kind!r} box')
+    return Box(kind, offset, size, header_size)
+
+
+def top_level_boxes(file, length):
+    offset = 0
+    while offset + 8 <= length:
+        file.seek(offset)
+        header = file.read(16)
+        box = parse_box_header(header, 0, length - offset)
+        box.offset = offset
+        yield box
+        offset = box.end
+
+
+def child_boxes(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        box = parse_box_header(data, offset, end)
+        yield box
+        offset = box.end
+
+
+def find_box(data, start, end, kind):
+    for box in child_boxes(data, start, end):
+        if box.kind == kind:
+            return box
+    return None
+
+
+def mvhd_duration(moov):
+    mvhd = find_box(moov, 8, len(moov), b'mvhd')
+    if mvhd is None:
+        return None
+    payload = mvhd.offset + mvhd.header_size
+    version = moov[payload]
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', moov, payload + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', moov, payload + 12)
+    return round(duration / timescale, 3) if timescale else None
+
+
+def shift_chunk_offsets(moov, delta, moved, start=8, end=None):
+    """
+    Add `delta` to every stco / co64 entry of the (mutable) moov bytes that
+    points into the `moved` (lo, hi) byte range of the original file.
+    """
+    end = len(moov) if end is None else end
+    lo, hi = moved
+    for box in child_boxes(moov, start, end):
+        payload = box.offset + box.header_size
+        if box.kind in CONTAINER_BOXES:
+            shift_chunk_offsets(moov, delta, moved, payload, box.end)
+        elif box.kind in (b'stco', b'co64'):
+            fmt = '>I' if box.kind == b'stco' else '>Q'
+            width = struct.calcsize(fmt)
+            count = struct.unpack_from('>I', moov, payload + 4)[0]
+            for i in range(count):
+                at = payload + 8 + i * width
+                value = struct.unpack_from(fmt, moov, at)[0]
+                if not lo <= value < hi:
+                    continue
+                value += delta
+                if box.kind == b'stco' and value > 0xFFFFFFFF:
+                    raise MediaError('Chunk offset overflows stco, cannot remux')
+                struct.pack_into(fmt, moov, at, value)
+
+
+class Probe:
+    def __init__(self, content_type, duration=None, boxes=None, moov=None):
+        self.content_type = content_type
+        self.duration = duration
+        self.boxes = boxes or []
+        self.moov = moov
+
+    @property
+    def needs_faststart(self):
+        kinds = [box.kind for box in self.boxes]
+        return b'moov' in kinds and b'mdat' in kinds and kinds.index(b'moov') > kinds.index(b'mdat')
+
+
+def probe(file, length):
+    file.seek(0)
+    content_type = sniff_content_type(file.read(64))
+    if content_type not in ('video/mp4', 'video/quicktime'):
+        return Probe(content_type)
+
+    boxes = list(top_level_boxes(file, length))
+    moov_box = next((box for box in boxes if box.kind == b'moov'), None)
+    if moov_box is None:
+        raise MediaError('No moov atom, the upload is incomplete or not an MP4')
+    if moov_box.size > MAX_MOOV_SIZE:
+        raise MediaError('moov atom too large')
+    if moov_box.header_size != 8:
+        raise MediaError('64-bit moov header not supported')
+
+    file.seek(moov_box.offset)
+    moov = file.read(moov_box.size)
+    return Probe(content_type, mvhd_duration(moov), boxes, moov)
+
+
+def copy_range(src, dst, start, size):
+    src.seek(start)
+    remaining = size
+    while remaining:
+        data = src.read(min(COPY_SIZE, remaining))
+        if not data:
+            raise MediaError('Unexpected end of file')
+        dst.write(data)
+        remaining -= len(data)
+
+
+def faststart(src, dst, info):
+    """
+    Write `src` to `dst` with moov moved right after ftyp. Everything between
+    ftyp and the old moov position moves forward by the size of moov, so the
+    stco/co64 entries pointing there are patched accordingly.
+    """
+    leading = [box for box in info.boxes if box.kind == b'ftyp']
+    moov_box = next(box for box in info.boxes if box.kind == b'moov')
+    moov = bytearray(info.moov)
+    shift_chunk_offsets(moov, len(moov), (leading[-1].end if leading else 0, moov_box.offset))
+
+    rest = [box for box in info.boxes if box.kind not in (b'ftyp', b'moov')]
+    for box in leading:
+        copy_range(src, dst, box.offset, box.size)
+    dst.write(bytes(moov))
+    for box in rest:
+        copy_range(src, dst, box.offset, box.size)
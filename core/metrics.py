@@ -0,0 +1,202 @@
+# core/metrics.py
+# Per-request performance numbers.
+#
+# MetricsMiddleware times every request; a pymongo CommandListener (registered
+# on the shared client in core/mongo.py) adds each Mongo command the request
+# runs. For every request we get the view name, wall time, Mongo command
+# count, Mongo time and, with METRICS_REPLY_BYTES, reply bytes, which are
+#
+#   - sent back as a Server-Timing header (visible in the browser devtools),
+#   - logged on the 'core.metrics' logger,
+#   - aggregated per view into histograms, served to admins at
+#     /admin-dashboard/metrics/ (counters of the process that answers).
+#
+# For streaming responses (videos) the wall time stops when the response
+# starts, not when the last byte is sent.
+#
+# pymongo hands listeners the decoded reply, so its size means encoding it
+# again (about 75us for a page of 50 courses): off by default, turn it on to
+# find the endpoints that pull the most data.
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from bson import encode
+from django.conf import settings
+from pymongo import monitoring
+
+logger = logging.getLogger('core.metrics')
+
+# Upper bounds of the histogram buckets, the last bucket is everything above
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COMMAND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+REPLY_BYTES = getattr(settings, 'METRICS_REPLY_BYTES', False)
+
+
+class RequestStats:
+    def __init__(self):
+        self.commands = 0
+        self.mongo_ms = 0.0
+        self.bytes = 0
+
+    def record(self, duration_micros, reply_bytes):
+        self.commands += 1
+        self.mongo_ms += duration_micros / 1000
+        self.bytes += reply_bytes
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def record_command(duration_micros, reply_bytes=0):
+    """Count one Mongo command against the current request, if any."""
+    stats = _current.get()
+    if stats is not None:
+        stats.record(duration_micros, reply_bytes)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Adds every Mongo command to the stats of the request that runs it."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if _current.get() is not None:
+            record_command(event.duration_micros, len(encode(event.reply)) if REPLY_BYTES else 0)
+
+    def failed(self, event):
+        record_command(event.duration_micros)
+
+
+command_timer = CommandTimer()
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.total += value
+
+    def as_dict(self):
+        labels = [f'le_{bound}' for bound in self.bounds] + ['inf']
+        return {'buckets': dict(zip(labels, self.counts)), 'sum': round(self.total, 3)}
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0  # 5xx
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.mongo_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.mongo_commands = Histogram(COMMAND_BUCKETS)
+        self.bytes = 0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency_ms': self.latency_ms.as_dict(),
+            'mongo_ms': self.mongo_ms.as_dict(),
+            'mongo_commands': self.mongo_commands.as_dict(),
+            'mongo_bytes': self.bytes,
+        }
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def observe(view, status, wall_ms, stats):
+    with _endpoints_lock:
+        metrics = _endpoints.setdefault(view, EndpointMetrics())
+        metrics.requests += 1
+        metrics.errors += status >= 500
+        metrics.latency_ms.observe(wall_ms)
+        metrics.mongo_ms.observe(stats.mongo_ms)
+        metrics.mongo_commands.observe(stats.commands)
+        metrics.bytes += stats.bytes
+
+
+def snapshot():
+    with _endpoints_lock:
+        return {view: metrics.as_dict() for view, metrics in sorted(_endpoints.items())}
+
+
+def reset():
+    with _endpoints_lock:
+        _endpoints.clear()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.url_name or match.func.__name__
+
+
+def server_timing(wall_ms, stats):
+    desc = f'{stats.commands} commands, {stats.bytes} bytes' if REPLY_BYTES else f'{stats.commands} commands'
+    return f'app;dur={wall_ms:.1f}, mongo;dur={stats.mongo_ms:.1f};desc="{desc}"'
+
+
+class MetricsMiddleware:
+    """
+    Put it first in MIDDLEWARE so the wall time covers the whole stack. Works
+    under WSGI and ASGI: in an async stack it stays async, so the async views
+    (serve_video_async, teacher_events) are not pushed onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, started, stats)
+
+    async def __acall__(self, request):
+        # Sync views run in a thread with a copy of this context, their
+        # Mongo commands still land in `stats`
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, started, stats)
+
+    def finish(self, request, response, started, stats):
+        wall_ms = (time.perf_counter() - started) * 1000
+        view = view_name(request)
+        observe(view, response.status_code, wall_ms, stats)
+        response['Server-Timing'] = server_timing(wall_ms, stats)
+        logger.info('%s %s %s %.1fms mongo=%d/%.1fms', request.method, request.path, response.status_code,
+                    wall_ms, stats.commands, stats.mongo_ms, extra={
+                        'view': view,
+                        'status': response.status_code,
+                        'wall_ms': round(wall_ms, 3),
+                        'mongo_commands': stats.commands,
+                        'mongo_ms': round(stats.mongo_ms, 3),
+                        'mongo_bytes': stats.bytes,
+                    })
+        return response
@@ -1,5 +1,5 @@
 
-from mongoengine import Document, StringField, ReferenceField, DateTimeField,ListField,EmailField,CASCADE,FileField
+from mongoengine import Document, StringField, ReferenceField, DateTimeField,ListField,EmailField,CASCADE,FileField,IntField,DictField,FloatField,BooleanField
 import datetime
 from bson import ObjectId
 from mongoengine import ObjectIdField
@@ -12,6 +12,30 @@ class User(Document):
     password = StringField(required=True)  # store hashed passwords
     role = StringField(choices=ROLE_CHOICES, default='student')
     enrolled_courses = ListField(ReferenceField('Course'))
+    # Embedded in tokens as `ver`; bumped on role / credential changes to revoke old tokens
+    token_version = IntField(default=0)
+
+    def save(self, *args, **kwargs):
+        from .utils import invalidate_user
+        if self.pk and {'role', 'password', 'email'} & set(self._get_changed_fields()):
+            self.token_version = (self.token_version or 0) + 1
+        result = super().save(*args, **kwargs)
+        invalidate_user(self.pk)
+        return result
+
+    def delete(self, *args, **kwargs):
+        # Through Enrollment.delete / Course.delete rather than the reverse_delete_rule
+        # cascades, which would skip the counters, analytics, tombstones and cache versions
+        from .analytics import record_user_deleted
+        from .utils import invalidate_user
+        for enrollment in Enrollment.objects(student=self.pk).only('id', 'student', 'course'):
+            enrollment.delete()
+        for course in Course.objects(created_by=self.pk):
+            course.delete()
+        result = super().delete(*args, **kwargs)
+        record_user_deleted(self)
+        invalidate_user(self.pk)
+        return result
 
 class Course(Document):
     title = StringField(required=True)
@@ -20,18 +44,83 @@ class Course(Document):
     created_at = DateTimeField(default=datetime.datetime.utcnow)
     youtube_link = StringField(null=True)
     video_id = ObjectIdField(null=True)  # GridFS video
+    # Denormalized, kept up to date with atomic $inc on enroll / unenroll.
+    # `python manage.py reconcile_enrollment_counts` repairs any drift.
+    enrollment_count = IntField(default=0)
+    # Filled in by the process_video job (core/tasks.py)
+    video_content_type = StringField(null=True)
+    video_duration = FloatField(null=True)  # seconds
+    video_segmented = BooleanField(default=False)  # a VideoRendition (HLS) exists for video_id
+    # Normalized words for /search/, see core/search.py
+    title_terms = ListField(StringField())
+    assignment_terms = ListField(StringField())
+    search_terms = ListField(StringField())  # title + description + assignment words
+    # Last change of a field /sync/ sends (video, counters), every update sets it
+    updated_at = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {
+        'indexes': [
+            ('created_by', 'id'),  # teacher_dashboard, paginated by _id
+            ('-enrollment_count', 'id'),  # top course for the analytics snapshot
+            'search_terms',  # multikey: search words and prefixes
+            ('created_by', 'search_terms'),  # search within one teacher's courses
+            'updated_at',  # /sync/ deltas
+        ]
+    }
+
+    def clean(self):
+        from .search import course_terms
+        course_terms(self)
+        self.updated_at = datetime.datetime.utcnow()
 
     def delete(self, *args, **kwargs):
         # Automatically delete enrollments when course is deleted
         from .models import Enrollment  # or adjust import to avoid circular import
+        from .analytics import record_course_deleted
+        from .http_cache import bump
+        from .sync import record_deleted
+        enrollments = list(Enrollment.objects(course=self).only('id', 'student').as_pymongo())
         Enrollment.objects(course=self).delete()
-        return super().delete(*args, **kwargs)
+        result = super().delete(*args, **kwargs)
+        record_course_deleted(self)
+        record_deleted('course', [{'doc_id': self.pk, 'course': self.pk}] + [
+            {'doc_id': e['_id'], 'course': self.pk, 'student': e.get('student')} for e in enrollments
+        ])
+        bump('courses', 'enrollments', f'course:{self.pk}')
+        return result
 
 class Enrollment(Document):
     student = ReferenceField(User, reverse_delete_rule=CASCADE)
     course = ReferenceField(Course, reverse_delete_rule=CASCADE)
     enrolled_at = DateTimeField(default=datetime.datetime.utcnow)
 
+    meta = {
+        'indexes': [
+            {'fields': ('student', 'course'), 'unique': True},  # one enrollment per student
+            ('student', 'id'),  # my_courses, paginated by _id
+            ('course', 'student'),  # counts and rosters per course
+        ],
+        # Existing data may hold duplicates: the unique index is built by
+        # `manage.py mongo_indexes --dedupe --build` (README), not on first access
+        'auto_create_index': False,
+    }
+
+    def delete(self, *args, **kwargs):
+        # Unenroll: keep Course.enrollment_count in sync (course may still be an unloaded DBRef)
+        course = self._data.get('course')
+        student = self._data.get('student')
+        result = super().delete(*args, **kwargs)
+        if course is not None:
+            from .analytics import record_unenrollment
+            from .http_cache import bump
+            from .sync import record_deleted
+            Course.objects(id=course.id).update_one(dec__enrollment_count=1, set__updated_at=datetime.datetime.utcnow())
+            record_unenrollment(course.id)
+            record_deleted('enrollment', [{'doc_id': self.pk, 'course': course.id,
+                                           'student': student.id if student is not None else None}])
+            bump('enrollments', *([f'student:{student.id}'] if student is not None else []))
+        return result
+
 #Done with /register /login /dashboard /upload-course /courses /enroll
 
 class Assignment(Document):
@@ -41,11 +130,131 @@ class Assignment(Document):
     created_by = ReferenceField(User, required=True)
     created_at = DateTimeField(default=datetime.datetime.utcnow)
 
+    meta = {
+        'indexes': [
+            ('course', 'id'),  # list_assignments, paginated by _id
+        ]
+    }
+
 class Submission(Document):
     assignment = ReferenceField(Assignment, required=True)
     student = ReferenceField(User, required=True)
     content = StringField()  # this could be a text answer or file link
     submitted_at = DateTimeField(default=datetime.datetime.utcnow)
 
+    meta = {
+        'indexes': [
+            {'fields': ('assignment', 'student'), 'unique': True},  # one submission per student
+            ('assignment', 'id'),  # view_submissions, paginated by _id
+        ],
+        'auto_create_index': False,  # see Enrollment
+    }
+
 #Done with /upload-assignment /list-assignments /submit-assignment /view-submissions
 
+
+
+class AnalyticsSnapshot(Document):
+    # Precomputed admin dashboard numbers, maintained by core/analytics.py
+    key = StringField(primary_key=True)
+    total_users = IntField(default=0)  # excluding admins
+    total_courses = IntField(default=0)
+    total_enrollments = IntField(default=0)
+    top_course_id = ObjectIdField(null=True)
+    top_course_title = StringField(null=True)
+    top_course_created_by = ObjectIdField(null=True)
+    top_course_enrollments = IntField(default=0)
+    refreshed_at = DateTimeField(null=True)  # last full rebuild, None = stale
+    updated_at = DateTimeField()  # last incremental update
+
+
+class CacheVersion(Document):
+    # Version counter behind the ETags of the read endpoints, see core/http_cache.py
+    key = StringField(primary_key=True)  # e.g. 'courses', 'student:<id>'
+    version = IntField(default=0)
+    updated_at = DateTimeField()
+
+
+class Tombstone(Document):
+    # A deleted course / enrollment, so /sync/ clients can drop it from their local copy (core/sync.py)
+    RETENTION_DAYS = 30  # a client watermark older than this gets a full reload
+
+    kind = StringField(required=True)  # 'course', 'enrollment'
+    doc_id = ObjectIdField(required=True)
+    course = ObjectIdField(null=True)  # who may see it: every student of / the teacher of this course
+    student = ObjectIdField(null=True)
+    deleted_at = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {
+        'indexes': [
+            {'fields': ['deleted_at'], 'expireAfterSeconds': RETENTION_DAYS * 24 * 3600},
+        ]
+    }
+
+
+class UploadSession(Document):
+    # Resumable video upload in progress, see core/uploads.py
+    UPLOADING = 'uploading'
+    FINALIZING = 'finalizing'  # claimed by one complete request, see claim_finalize
+    COMPLETE = 'complete'
+
+    teacher = ReferenceField(User, required=True, reverse_delete_rule=CASCADE)
+    title = StringField(required=True)
+    description = StringField()
+    youtube_link = StringField(null=True)
+    filename = StringField(required=True)
+    size = IntField(required=True, min_value=1)
+    chunk_size = IntField(required=True)
+    file_id = ObjectIdField(required=True, default=ObjectId)  # GridFS file the chunks belong to
+    offset = IntField(default=0)  # bytes received so far
+    sha256 = StringField(null=True)  # optional checksum of the whole file, each append is then verified
+    verified = IntField(default=0)  # bytes received with a matching Upload-Checksum
+    status = StringField(choices=(UPLOADING, FINALIZING, COMPLETE), default=UPLOADING)
+    course = ReferenceField(Course, null=True)
+    created_at = DateTimeField(default=datetime.datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {
+        'indexes': [
+            ('status', 'updated_at'),  # cleanup_uploads
+        ]
+    }
+
+
+class Job(Document):
+    # Background job, see core/jobs.py
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    kind = StringField(required=True)
+    payload = DictField()
+    status = StringField(choices=(QUEUED, RUNNING, DONE, FAILED), default=QUEUED)
+    attempts = IntField(default=0)
+    max_attempts = IntField(default=3)
+    run_after = DateTimeField(default=datetime.datetime.utcnow)
+    locked_by = StringField(null=True)
+    locked_until = DateTimeField(null=True)  # lease, expired = worker died
+    error = StringField(null=True)
+    result = DictField()
+    created_at = DateTimeField(default=datetime.datetime.utcnow)
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+
+    meta = {
+        'indexes': [
+            ('status', 'run_after'),  # claim
+            ('status', 'locked_until'),  # expired leases
+        ]
+    }
+
+
+class VideoRendition(Document):
+    # HLS segments of one GridFS video, built by the segment_video job (core/hls.py)
+    video_id = ObjectIdField(required=True, unique=True)
+    segment_seconds = IntField()
+    init_id = ObjectIdField(null=True)  # fMP4 init segment
+    segment_ids = ListField(ObjectIdField())  # GridFS file per segment, by index
+    durations = ListField(FloatField())
+    created_at = DateTimeField(default=datetime.datetime.utcnow)
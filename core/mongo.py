@@ -0,0 +1,126 @@
+# core/mongo.py
+# The single MongoDB connection of the app.
+#
+# mongoengine's default connection is opened here (from CoreConfig.ready)
+# with the pool / timeout / compression settings below, and GridFS reuses
+# the same client, so documents, uploads and video reads share one pool
+# and one database (MONGO_DB).
+#
+# A pool listener keeps live counters per server so the pool can be sized
+# against the number of worker processes and threads: if `waiting` or
+# `checkout_failed` grow, MONGO_MAX_POOL_SIZE is too small for the load.
+import threading
+
+import gridfs
+from django.conf import settings
+from mongoengine import connect
+from mongoengine.connection import get_db
+from pymongo import monitoring
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+
+from core.metrics import command_timer
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters per server address."""
+
+    COUNTERS = ('open', 'in_use', 'peak_in_use', 'waiting', 'created', 'closed',
+                'checked_out', 'checkout_failed', 'cleared')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _update(self, address, **deltas):
+        key = '%s:%s' % address
+        with self._lock:
+            pool = self._pools.setdefault(key, dict.fromkeys(self.COUNTERS, 0))
+            for name, delta in deltas.items():
+                pool[name] += delta
+            pool['peak_in_use'] = max(pool['peak_in_use'], pool['in_use'])
+
+    def snapshot(self):
+        with self._lock:
+            return {address: dict(pool) for address, pool in self._pools.items()}
+
+    def pool_created(self, event):
+        self._update(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event.address, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event.address, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._update(event.address, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1, checkout_failed=1)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, waiting=-1, in_use=1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, in_use=-1)
+
+
+pool_stats = PoolStats()
+
+
+def client_options():
+    options = {
+        'maxPoolSize': settings.MONGO_MAX_POOL_SIZE,
+        'minPoolSize': settings.MONGO_MIN_POOL_SIZE,
+        'maxIdleTimeMS': settings.MONGO_MAX_IDLE_TIME_MS,
+        'waitQueueTimeoutMS': settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        'connectTimeoutMS': settings.MONGO_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'socketTimeoutMS': settings.MONGO_SOCKET_TIMEOUT_MS,
+        'appname': 'lms_backend',
+    }
+    if settings.MONGO_COMPRESSORS:
+        options['compressors'] = settings.MONGO_COMPRESSORS
+    return options
+
+
+def connect_default(db=None):
+    """Open the default mongoengine connection (called once per process)."""
+    return connect(db=db or settings.MONGO_DB, host=settings.MONGO_URI,
+                   event_listeners=[pool_stats, command_timer], **client_options())
+
+
+def get_fs():
+    """GridFS on the shared connection, for writes and anything that must see them immediately."""
+    return gridfs.GridFS(get_db())
+
+
+def video_fs():
+    """
+    GridFS for playback reads, with MONGO_VIDEO_READ_PREFERENCE (e.g.
+    'secondaryPreferred' to move video traffic off the primary). Same client
+    and pool as everything else.
+    """
+    mode = read_pref_mode_from_name(settings.MONGO_VIDEO_READ_PREFERENCE)
+    return gridfs.GridFS(get_db().with_options(read_preference=make_read_preference(mode, None)))
+
+
+def pool_summary():
+    return {
+        'max_pool_size': settings.MONGO_MAX_POOL_SIZE,
+        'min_pool_size': settings.MONGO_MIN_POOL_SIZE,
+        'wait_queue_timeout_ms': settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        'servers': pool_stats.snapshot(),
+    }
@@ -0,0 +1,95 @@
+# core/pagination.py
+# Shared keyset pagination + field projection for listing endpoints.
+#
+#   ?limit=50           page size (capped at PAGE_MAX_LIMIT)
+#   ?cursor=<id>        opaque cursor from the previous page's `next_cursor`
+#   ?fields=id,title    only return (and only load from Mongo) these keys
+#
+# Pages are ordered by _id, which also orders by creation time, so the next
+# page is just `_id > cursor` on the index instead of an ever-growing skip().
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.http import JsonResponse
+
+DEFAULT_LIMIT = getattr(settings, 'PAGE_DEFAULT_LIMIT', 50)
+MAX_LIMIT = getattr(settings, 'PAGE_MAX_LIMIT', 200)
+
+
+class PaginationError(ValueError):
+    pass
+
+
+class Page:
+    def __init__(self, items, fields, next_cursor):
+        self.items = items
+        self.fields = fields
+        self.next_cursor = next_cursor
+
+    def row(self, builders):
+        # builders: output key -> zero-arg callable, only the requested keys are evaluated
+        return {key: build() for key, build in builders.items() if key in self.fields}
+
+    def payload(self, key, rows):
+        return {key: rows, 'next_cursor': self.next_cursor}
+
+    def response(self, key, rows, **extra):
+        return JsonResponse({**self.payload(key, rows), **extra})
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be positive')
+    return min(limit, MAX_LIMIT)
+
+
+def parse_cursor(value):
+    if not value:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise PaginationError('Invalid cursor')
+
+
+def parse_fields(value, field_map):
+    if not value:
+        return list(field_map)
+    requested = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in field_map]
+    if unknown:
+        raise PaginationError(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def paginate(request, queryset, field_map, prefix=''):
+    """
+    Return one keyset page of `queryset`.
+
+    field_map maps each output key to the document fields it needs, so that
+    `fields=` turns into a mongoengine .only() projection. `prefix` lets one
+    endpoint paginate several lists (e.g. ?users_cursor=...&courses_cursor=...).
+    Raises PaginationError on bad parameters.
+    """
+    params = request.GET
+    limit = parse_limit(params.get(f'{prefix}limit'))
+    cursor = parse_cursor(params.get(f'{prefix}cursor'))
+    fields = parse_fields(params.get(f'{prefix}fields'), field_map)
+
+    only = {'id'}
+    for key in fields:
+        only.update(field_map[key])
+    queryset = queryset.only(*only).order_by('id')
+    if cursor:
+        queryset = queryset.filter(id__gt=cursor)
+
+    # Fetch one extra row to know whether there is a next page
+    items = list(queryset.limit(limit + 1))
+    next_cursor = str(items[limit - 1].id) if len(items) > limit else None
+    return Page(items[:limit], set(fields), next_cursor)
@@ -0,0 +1,107 @@
+# core/passwords.py
+# bcrypt off the request thread.
+#
+# Hashing and checking run in a small process pool (PASSWORD_HASH_WORKERS),
+# so a login storm costs CPU in the pool instead of stalling every other
+# request on the worker. At most PASSWORD_HASH_MAX_PENDING operations may be
+# queued or running; beyond that PoolBusy is raised and the view answers 503
+# with Retry-After instead of piling up requests.
+#
+# The cost (BCRYPT_ROUNDS) is read back from each stored hash, so changing
+# it never breaks existing passwords: a successful login with an old cost
+# stores a new hash (rehash_if_needed).
+import bcrypt
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+ROUNDS = getattr(settings, 'BCRYPT_ROUNDS', 12)
+WORKERS = getattr(settings, 'PASSWORD_HASH_WORKERS', 2)  # 0 = hash inline (tests, scripts)
+MAX_PENDING = getattr(settings, 'PASSWORD_HASH_MAX_PENDING', 32)
+TIMEOUT = getattr(settings, 'PASSWORD_HASH_TIMEOUT', 10)  # seconds
+
+RETRY_AFTER = 1  # seconds, sent with the 503
+
+
+class PoolBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode()
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: the parent holds Mongo client threads, forking it is not safe
+            _executor = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def run(func, *args):
+    """Run func in the pool, raise PoolBusy when MAX_PENDING operations are already in flight."""
+    if not WORKERS:
+        return func(*args)
+    if not _pending.acquire(blocking=False):
+        raise PoolBusy()
+    try:
+        future = get_executor().submit(func, *args)
+    except Exception:
+        _pending.release()
+        raise
+    # Release when the work is really done, not when we stop waiting for it
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        return future.result(timeout=TIMEOUT)
+    except FutureTimeout:
+        raise PoolBusy()
+
+
+def hash_password(password):
+    return run(_hashpw, password.encode('utf-8'), ROUNDS)
+
+
+def check_password(password, hashed):
+    return run(_checkpw, password.encode('utf-8'), hashed.encode())
+
+
+def hash_rounds(hashed):
+    # $2b$12$<salt+hash>
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    return hash_rounds(hashed) != ROUNDS
+
+
+def rehash_if_needed(user, password):
+    """
+    After a successful login, store a hash with the current cost. Written with
+    a conditional update instead of user.save(): a new hash of the same
+    password must not bump token_version and log the user out elsewhere.
+    """
+    if not needs_rehash(user.password):
+        return False
+    try:
+        hashed = hash_password(password)
+    except PoolBusy:
+        return False  # try again on a later login
+    updated = type(user).objects(id=user.id, password=user.password).update_one(set__password=hashed)
+    return bool(updated)
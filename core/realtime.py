@@ -0,0 +1,326 @@
+# core/realtime.py
+# New enrollments and submissions pushed to teachers as Server-Sent Events.
+#
+# One Hub per process tails the MongoDB change stream of the enrollment and
+# submission collections in a daemon thread. Where change streams are not
+# available (standalone mongod, mongomock) it polls both collections by _id
+# every REALTIME_POLL_SECONDS instead. Each insert is handed only to the
+# connections of the teacher who owns the course.
+#
+# A connection is an asyncio queue plus a suspended generator in the ASGI
+# event loop: no thread per client, so one process holds thousands of idle
+# teachers. Connections send a comment every REALTIME_HEARTBEAT_SECONDS (so
+# proxies keep them open) and are closed after REALTIME_MAX_CONNECTION_SECONDS
+# or when the client falls REALTIME_QUEUE_SIZE events behind. EventSource
+# then reconnects with Last-Event-ID and the missed events are replayed from
+# the collections, so nothing is lost across reconnects.
+import asyncio
+import collections
+import json
+import logging
+import threading
+import time
+
+import jwt
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from mongoengine.connection import get_db
+from pymongo.errors import OperationFailure, PyMongoError
+
+from core import tokens
+from core.models import Assignment, Course, Enrollment, Submission, User
+from core.sync import OVERLAP
+from core.utils import TTLCache, load_user
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = getattr(settings, 'REALTIME_POLL_SECONDS', 2)
+HEARTBEAT_SECONDS = getattr(settings, 'REALTIME_HEARTBEAT_SECONDS', 20)
+MAX_CONNECTION_SECONDS = getattr(settings, 'REALTIME_MAX_CONNECTION_SECONDS', 15 * 60)
+MAX_CONNECTIONS = getattr(settings, 'REALTIME_MAX_CONNECTIONS', 5000)
+QUEUE_SIZE = getattr(settings, 'REALTIME_QUEUE_SIZE', 100)
+REPLAY_LIMIT = getattr(settings, 'REALTIME_REPLAY_LIMIT', 500)
+
+RETRY_MS = 3000  # EventSource reconnect delay, sent to the client
+ENROLLMENTS = Enrollment._get_collection_name()
+SUBMISSIONS = Submission._get_collection_name()
+
+
+def stamp(value):
+    return value.strftime('%Y-%m-%d %H:%M') if value else None
+
+
+class RealtimeError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class Subscription:
+    def __init__(self, teacher_id, loop):
+        self.teacher_id = teacher_id
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def offer(self, event):
+        # Runs in the subscriber's event loop. A client that cannot keep up is
+        # disconnected (None) and catches up with Last-Event-ID on reconnect.
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+        else:
+            self.queue.put_nowait(event)
+
+
+class Hub:
+    """Tails new enrollments / submissions and fans them out to the subscribed teachers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # teacher id -> set of Subscription
+        self._thread = None
+        self._owners = TTLCache(maxsize=10000, ttl=600)  # course id -> teacher id
+        self._courses = TTLCache(maxsize=10000, ttl=600)  # assignment id -> course id
+        self._seen = collections.OrderedDict()  # recently polled _ids, the poll windows overlap
+        self._last_poll = {}
+        self.mode = None  # 'change_stream' or 'polling' once started
+
+    # Subscriptions (event loop side)
+
+    def subscribe(self, teacher_id):
+        subscription = Subscription(str(teacher_id), asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(subscription.teacher_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.teacher_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.teacher_id, None)
+
+    def connections(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def stats(self):
+        with self._lock:
+            return {'mode': self.mode, 'teachers': len(self._subscribers),
+                    'connections': sum(len(s) for s in self._subscribers.values())}
+
+    # Events (tailing thread side)
+
+    def owner_of(self, course_id):
+        owner = self._owners.get(course_id)
+        if owner is None:
+            course = Course.objects(id=course_id).only('created_by').no_dereference().first()
+            if course is None:
+                return None
+            owner = str(course.created_by.id)
+            self._owners.set(course_id, owner)
+        return owner
+
+    def course_of(self, assignment_id):
+        course_id = self._courses.get(assignment_id)
+        if course_id is None:
+            assignment = Assignment.objects(id=assignment_id).only('course').no_dereference().first()
+            if assignment is None:
+                return None
+            course_id = assignment.course.id
+            self._courses.set(assignment_id, course_id)
+        return course_id
+
+    def build_event(self, collection, doc):
+        """(owner teacher id, event dict) for an inserted enrollment / submission document."""
+        if collection == ENROLLMENTS:
+            course_id = doc.get('course')
+            event = {'type': 'enrollment', 'course_id': str(course_id), 'enrolled_at': stamp(doc.get('enrolled_at'))}
+        else:
+            course_id = self.course_of(doc.get('assignment'))
+            event = {'type': 'submission', 'course_id': str(course_id), 'assignment_id': str(doc.get('assignment')),
+                     'submitted_at': stamp(doc.get('submitted_at'))}
+        owner = self.owner_of(course_id) if course_id else None
+        student = User.objects(id=doc.get('student')).only('username').as_pymongo().first() or {}
+        event.update(id=str(doc['_id']), student=student.get('username'))
+        return owner, event
+
+    def disconnect_all(self):
+        # Events may have been missed: end every stream, the clients reconnect
+        # with Last-Event-ID and replay from the collections
+        with self._lock:
+            subscriptions = [s for group in self._subscribers.values() for s in group]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, None)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+    def publish(self, collection, doc):
+        with self._lock:
+            if not self._subscribers:
+                return  # nobody listening, skip the lookups
+        owner, event = self.build_event(collection, doc)
+        with self._lock:
+            subscriptions = list(self._subscribers.get(owner, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:  # its event loop is gone
+                self.unsubscribe(subscription)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='realtime-hub', daemon=True)
+                self._thread.start()
+
+    def run(self):
+        try:
+            self.watch()
+        except Exception as e:  # watch() only gives up when the server (or mongomock) has no change streams
+            logger.info("Change streams unavailable (%s), polling every %ss", e, POLL_SECONDS)
+        self.mode = 'polling'
+        while True:
+            try:
+                self.poll_once()
+            except PyMongoError:
+                logger.exception("Realtime poll failed")
+            time.sleep(POLL_SECONDS)
+
+    def watch(self):
+        pipeline = [{'$match': {'operationType': 'insert', 'ns.coll': {'$in': [ENROLLMENTS, SUBMISSIONS]}}}]
+        resume_token = None
+        while True:
+            try:
+                with get_db().watch(pipeline, resume_after=resume_token) as stream:
+                    self.mode = 'change_stream'
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        self.publish(change['ns']['coll'], change['fullDocument'])
+            except OperationFailure:
+                if self.mode is None:
+                    raise  # not a replica set: fall back to polling
+                # The server refused to resume (e.g. ChangeStreamHistoryLost, the
+                # oplog rolled past the token): retrying the same token never
+                # succeeds, start a new stream and let the clients replay
+                logger.exception("Change stream cannot resume, restarting it")
+                resume_token = None
+                self.disconnect_all()
+                time.sleep(1)
+            except PyMongoError:
+                logger.exception("Change stream failed, resuming")
+                time.sleep(1)
+
+    def poll_once(self):
+        """One polling round: publish what was inserted since the previous round."""
+        db = get_db()
+        now = ObjectId()
+        for collection in (ENROLLMENTS, SUBMISSIONS):
+            last = self._last_poll.get(collection, now)
+            since = ObjectId.from_datetime(last.generation_time - OVERLAP)
+            for doc in db[collection].find({'_id': {'$gte': since}}).sort('_id', 1):
+                if doc['_id'] in self._seen:
+                    continue
+                self._seen[doc['_id']] = None
+                self.publish(collection, doc)
+            self._last_poll[collection] = now
+        while len(self._seen) > 10000:
+            self._seen.popitem(last=False)
+
+
+hub = Hub()
+
+
+def replay(teacher_id, last_event_id):
+    """Events of `teacher_id`'s courses inserted after `last_event_id` (the client missed them)."""
+    course_ids = list(Course.objects(created_by=teacher_id).scalar('id'))
+    assignment_ids = list(Assignment.objects(course__in=course_ids).scalar('id'))
+    db = get_db()
+    docs = [(ENROLLMENTS, doc) for doc in db[ENROLLMENTS].find(
+        {'course': {'$in': course_ids}, '_id': {'$gt': last_event_id}}).sort('_id', 1).limit(REPLAY_LIMIT)]
+    docs += [(SUBMISSIONS, doc) for doc in db[SUBMISSIONS].find(
+        {'assignment': {'$in': assignment_ids}, '_id': {'$gt': last_event_id}}).sort('_id', 1).limit(REPLAY_LIMIT)]
+    docs.sort(key=lambda item: item[1]['_id'])
+    return [hub.build_event(collection, doc)[1] for collection, doc in docs[:REPLAY_LIMIT]]
+
+
+def authenticate(request):
+    """The teacher behind the Authorization header or ?token= (EventSource cannot send headers)."""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '') or request.GET.get('token')
+    if not token:
+        raise RealtimeError('No token provided', 401)
+    try:
+        user = load_user(tokens.verify(token))
+    except jwt.ExpiredSignatureError:
+        raise RealtimeError('Token expired', 401)
+    except jwt.InvalidTokenError:
+        raise RealtimeError('Invalid token', 401)
+    if not user:
+        raise RealtimeError('User not found', 404)
+    if user.role != 'teacher':
+        raise RealtimeError('Only teachers can subscribe to events', 403)
+    return user
+
+
+def parse_last_event_id(value):
+    if not value:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise RealtimeError('Invalid Last-Event-ID', 400)
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def open_stream(request):
+    """Authenticate, subscribe and return the event generator, or raise RealtimeError."""
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the event loop of the request is thrown away with it
+        raise RealtimeError('Server-Sent Events need the ASGI server (lms_backend.asgi)', 501)
+    user = await sync_to_async(authenticate)(request)
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    if hub.connections() >= MAX_CONNECTIONS:
+        raise RealtimeError('Too many connections', 503)
+    hub.start()
+
+    # Subscribe before replaying, so nothing falls between the two
+    subscription = hub.subscribe(user.id)
+    try:
+        backlog = await sync_to_async(replay)(user.id, last_event_id) if last_event_id else []
+    except Exception:
+        hub.unsubscribe(subscription)
+        raise
+    return event_stream(subscription, backlog)
+
+
+async def event_stream(subscription, backlog):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MAX_CONNECTION_SECONDS
+    sent = {event['id'] for event in backlog}
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for event in backlog:
+            yield format_event(event)
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), min(HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if event is None:
+                return  # fell behind, the client reconnects with Last-Event-ID
+            if event['id'] not in sent:
+                yield format_event(event)
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,200 @@
+# core/search.py
+# Course search over precomputed terms.
+#
+# Every course stores the normalized words of its title (`title_terms`), of
+# its assignments' titles (`assignment_terms`), and the union of those with
+# its description (`search_terms`, multikey indexed). Course.clean() fills
+# them on save, upload_assignment adds to them, and
+# `python manage.py rebuild_search_index` recomputes them for existing data.
+#
+# GET /search/?q=intro pyth
+#   - every complete word must be a term of the course (index lookup),
+#   - the last word, unless followed by a space, is a prefix (autocomplete):
+#     an anchored regex, an index range scan on the same multikey index,
+#   - ranked by matches: a title word counts TITLE_WEIGHT, an assignment
+#     word ASSIGNMENT_WEIGHT, any other word 1; newest first on ties,
+#   - ?teacher=<id or username> restricts to one teacher's courses,
+#   - paginated with ?limit= and the `next_cursor` of the previous page.
+#
+# Only the first SEARCH_MAX_CANDIDATES matches (in index order) are scored and
+# sorted, so a short prefix like "in" costs the same on every page however
+# much of the catalog it matches; typing more narrows it down.
+import re
+import unicodedata
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+from core.models import Assignment, Course, User
+from core.pagination import PaginationError, parse_limit
+
+TITLE_WEIGHT = 3
+ASSIGNMENT_WEIGHT = 2
+MAX_QUERY_TERMS = 8
+MIN_PREFIX_LENGTH = 2  # a single letter would match a large part of the catalog
+MAX_CANDIDATES = getattr(settings, 'SEARCH_MAX_CANDIDATES', 1000)
+
+WORD_RE = re.compile(r'\w+')
+STOPWORDS = frozenset('a an and are as at be by for from in into is it of on or the to with'.split())
+
+
+class SearchError(ValueError):
+    pass
+
+
+def normalize(text):
+    # Case and accents do not matter: "Économie" and "economie" are the same term
+    text = unicodedata.normalize('NFKD', (text or '').casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(normalize(text)) if word not in STOPWORDS]
+
+
+def terms(*texts):
+    return sorted({term for text in texts for term in tokenize(text)})
+
+
+def document_terms(title, description, assignment_titles=()):
+    """The search fields of a course document."""
+    assignment_terms = terms(*assignment_titles)
+    return {
+        'title_terms': terms(title),
+        'assignment_terms': assignment_terms,
+        'search_terms': sorted(set(terms(title, description)) | set(assignment_terms)),
+    }
+
+
+def course_terms(course):
+    """Refresh the search fields of a Course from its own fields, keeping its assignment terms (Course.clean)."""
+    course.title_terms = terms(course.title)
+    course.search_terms = sorted(set(terms(course.title, course.description)) | set(course.assignment_terms or []))
+
+
+def add_assignment(course_id, title):
+    """Make a course findable by the title of a new assignment, one update."""
+    new_terms = terms(title)
+    if new_terms:
+        Course.objects(id=course_id).update_one(add_to_set__assignment_terms=new_terms,
+                                                add_to_set__search_terms=new_terms)
+
+
+def rebuild(course_ids=None):
+    """Recompute the search fields of the given courses (all when None). Returns how many were updated."""
+    query = {'id__in': list(course_ids)} if course_ids is not None else {}
+    courses = Course.objects(**query).only('id', 'title', 'description').as_pymongo()
+    titles = {}
+    pipeline = [{'$group': {'_id': '$course', 'titles': {'$push': '$title'}}}]
+    if course_ids is not None:
+        pipeline.insert(0, {'$match': {'course': {'$in': query['id__in']}}})
+    for row in Assignment.objects.aggregate(pipeline):
+        titles[row['_id']] = row['titles']
+
+    updated = 0
+    for course in courses:
+        fields = document_terms(course.get('title'), course.get('description'), titles.get(course['_id'], []))
+        Course.objects(id=course['_id']).update_one(**{f'set__{key}': value for key, value in fields.items()})
+        updated += 1
+    return updated
+
+
+def parse_query(q):
+    """(complete terms, prefix or None) of a search box value."""
+    words = WORD_RE.findall(normalize(q))
+    if len(words) > MAX_QUERY_TERMS:
+        raise SearchError(f'At most {MAX_QUERY_TERMS} words')
+    prefix = None
+    if words and not q[-1:].isspace():
+        # Still being typed, even a stopword: "the" may become "theory"
+        last = words.pop()
+        if len(last) >= MIN_PREFIX_LENGTH:
+            prefix = last
+        elif last not in STOPWORDS:
+            words.append(last)
+    complete = [word for word in words if word not in STOPWORDS]
+    if not complete and not prefix:
+        raise SearchError('Query is required')
+    return complete, prefix
+
+
+def resolve_teacher(value):
+    if not value:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        user = User.objects(username=value, role='teacher').only('id').first()
+        if user is None:
+            raise SearchError('Teacher not found')
+        return user.id
+
+
+def parse_cursor(value):
+    # "<score>:<id>" of the last result of the previous page
+    if not value:
+        return None
+    try:
+        score, last_id = value.split(':')
+        return int(score), ObjectId(last_id)
+    except (ValueError, InvalidId, TypeError):
+        raise PaginationError('Invalid cursor')
+
+
+def matching_terms(field, complete, prefix):
+    # Aggregation expression: how many terms of `field` are query words or start with the prefix
+    conditions = []
+    if complete:
+        conditions.append({'$in': ['$$term', complete]})
+    if prefix:
+        conditions.append({'$regexMatch': {'input': '$$term', 'regex': '^' + re.escape(prefix)}})
+    return {'$size': {'$filter': {'input': {'$ifNull': [f'${field}', []]}, 'as': 'term',
+                                  'cond': {'$or': conditions}}}}
+
+
+def search(q, teacher=None, limit=None, cursor=None):
+    """
+    One page of ranked courses: (list of course dicts from Mongo, each with
+    `score`, next_cursor or None). Raises SearchError / PaginationError.
+    """
+    complete, prefix = parse_query(q)
+    limit = parse_limit(limit)
+    after = parse_cursor(cursor)
+    teacher_id = resolve_teacher(teacher)
+
+    conditions = []
+    if complete:
+        conditions.append({'search_terms': {'$all': complete}})
+    if prefix:
+        conditions.append({'search_terms': {'$regex': '^' + re.escape(prefix)}})
+    match = {'$and': conditions}
+    if teacher_id:
+        match['created_by'] = teacher_id
+
+    # search_terms holds the title and assignment words too, so a title
+    # match scores 1 + (TITLE_WEIGHT - 1)
+    pipeline = [
+        {'$match': match},
+        {'$limit': MAX_CANDIDATES},
+        {'$addFields': {'score': {'$add': [
+            matching_terms('search_terms', complete, prefix),
+            {'$multiply': [TITLE_WEIGHT - 1, matching_terms('title_terms', complete, prefix)]},
+            {'$multiply': [ASSIGNMENT_WEIGHT - 1, matching_terms('assignment_terms', complete, prefix)]},
+        ]}}},
+    ]
+    if after:
+        score, last_id = after
+        pipeline.append({'$match': {'$or': [{'score': {'$lt': score}}, {'score': score, '_id': {'$lt': last_id}}]}})
+    pipeline += [
+        {'$sort': {'score': -1, '_id': -1}},
+        {'$limit': limit + 1},
+        {'$project': {'title': 1, 'description': 1, 'created_by': 1, 'created_at': 1, 'youtube_link': 1,
+                      'video_id': 1, 'video_segmented': 1, 'enrollment_count': 1, 'score': 1}},
+    ]
+    rows = list(Course.objects.aggregate(pipeline))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['score']}:{rows[-1]['_id']}"
+    return rows, next_cursor
@@ -0,0 +1,121 @@
+# core/sync.py
+# Delta sync for the student and teacher dashboards.
+#
+# GET /sync/?since=<watermark> returns the courses, enrollments, assignments
+# and submissions the user can see that were created after the watermark,
+# plus tombstones (ids) of what was deleted since, and a new watermark for
+# the next call. Without `since`, or with a watermark older than the
+# tombstone retention, everything is returned with `full: true` and the
+# client replaces its local copy.
+#
+# Records are selected on _id, which starts with its creation time, so a
+# delta is an index range scan per collection. Courses also change after
+# creation (video processed, enrollment count), every such update sets
+# Course.updated_at and changed courses are selected on it too. The lower
+# bound is moved back by SYNC_OVERLAP_SECONDS to tolerate clock skew between
+# app servers: a record can be sent twice, clients upsert by id.
+import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from mongoengine.queryset.visitor import Q
+
+from core.models import Assignment, Course, Enrollment, Submission, Tombstone
+
+OVERLAP = datetime.timedelta(seconds=getattr(settings, 'SYNC_OVERLAP_SECONDS', 5))
+RETENTION = datetime.timedelta(days=Tombstone.RETENTION_DAYS)
+
+
+class WatermarkError(ValueError):
+    pass
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def parse_watermark(value):
+    """ObjectId hex, epoch seconds or ISO 8601 UTC timestamp -> naive UTC datetime (None if empty)."""
+    if not value:
+        return None
+    try:
+        return ObjectId(value).generation_time.replace(tzinfo=None)
+    except (InvalidId, TypeError):
+        pass
+    try:
+        return datetime.datetime.utcfromtimestamp(float(value))
+    except (ValueError, OverflowError, OSError):
+        pass
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise WatermarkError('Invalid watermark')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def record_deleted(kind, tombstones):
+    """Store tombstones for deleted documents: dicts with doc_id and optionally course / student."""
+    if not tombstones:
+        return
+    now = _now()
+    Tombstone._get_collection().insert_many([
+        {'kind': kind, 'deleted_at': now, **{key: value for key, value in t.items() if value is not None}}
+        for t in tombstones
+    ])
+
+
+class Changes:
+    def __init__(self, full, watermark):
+        self.full = full
+        self.watermark = watermark  # ObjectId, give it back as `since` next time
+        self.courses = []
+        self.enrollments = []
+        self.assignments = []
+        self.submissions = []
+        self.deleted = {}  # kind -> [doc ids]
+
+
+def changes_for(user, since):
+    """
+    What changed for `user` (a student or a teacher) since the naive UTC
+    datetime `since`. Constant number of queries, whatever the delta size.
+    """
+    now = _now()
+    full = since is None or since < now - RETENTION
+    changes = Changes(full, ObjectId.from_datetime(now))
+    newer = {} if full else {'id__gte': ObjectId.from_datetime(since - OVERLAP)}
+
+    # Everybody sees the whole catalog (the dashboards list /courses/ too)
+    changed = Q() if full else Q(**newer) | Q(updated_at__gte=since - OVERLAP)
+    changes.courses = list(Course.objects(changed).no_dereference().order_by('id'))
+
+    if user.role == 'teacher':
+        course_ids = list(Course.objects(created_by=user.id).scalar('id'))
+        changes.enrollments = list(Enrollment.objects(course__in=course_ids, **newer).no_dereference().order_by('id'))
+        changes.assignments = list(Assignment.objects(course__in=course_ids, **newer).no_dereference().order_by('id'))
+        assignment_ids = list(Assignment.objects(course__in=course_ids).scalar('id'))
+        changes.submissions = list(Submission.objects(assignment__in=assignment_ids, **newer)
+                                   .no_dereference().order_by('id'))
+        visible = Q(course__in=course_ids)
+    else:
+        enrollments = list(Enrollment.objects(student=user.id).only('id', 'course', 'enrolled_at')
+                           .no_dereference().order_by('id'))
+        threshold = newer.get('id__gte')
+        changes.enrollments = [e for e in enrollments if threshold is None or e.id >= threshold]
+        # Assignments of a course enrolled in since the watermark are all new to this client
+        new_ids = {e.id for e in changes.enrollments}
+        known = [e.course.id for e in enrollments if e.id not in new_ids]
+        joined = [e.course.id for e in changes.enrollments]
+        changes.assignments = list(Assignment.objects(Q(course__in=known, **newer) | Q(course__in=joined))
+                                   .no_dereference().order_by('id'))
+        changes.submissions = list(Submission.objects(student=user.id, **newer).no_dereference().order_by('id'))
+        visible = Q(student=user.id)
+
+    if not full:
+        tombstones = Tombstone.objects(Q(kind='course') | visible, **newer).only('kind', 'doc_id').order_by('id')
+        for tombstone in tombstones:
+            changes.deleted.setdefault(tombstone.kind, []).append(tombstone.doc_id)
+    return changes
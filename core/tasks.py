@@ -0,0 +1,110 @@
+# core/tasks.py
+# Job handlers, run by `python manage.py run_jobs` (see core/jobs.py).
+import datetime
+
+from bson import ObjectId
+from django.conf import settings
+from mongoengine.connection import get_db
+from mongoengine.errors import NotUniqueError
+
+from core import hls
+from core.http_cache import bump
+from core.jobs import enqueue, handler
+from core.media import probe, faststart
+from core.mongo import get_fs
+from core.models import Course, VideoRendition
+
+REPLACED_GRACE = datetime.timedelta(seconds=getattr(settings, 'VIDEO_REPLACED_GRACE_SECONDS', 24 * 60 * 60))
+
+
+@handler('process_video')
+def process_video(course_id):
+    """
+    Detect the real content type and duration of a course video and, for MP4s
+    with the moov atom at the end, store a faststart copy in its place.
+
+    Safe to run again (a retry, or a second worker after a lost lease): the
+    final file is marked `processed` and is only copied to the course.
+    """
+    course = Course.objects(id=course_id).only('video_id', 'video_content_type', 'video_segmented').first()
+    if not course or not course.video_id:
+        return {'skipped': 'no video'}
+
+    fs = get_fs()
+    source = fs.get(course.video_id)
+    metadata = source.metadata or {}
+    video_id = source._id
+    needs_faststart = False
+    if metadata.get('processed'):
+        content_type, duration = metadata.get('contentType'), metadata.get('duration')
+        if course.video_content_type == content_type:
+            return {'skipped': 'already processed'}
+    else:
+        info = probe(source, source.length)
+        content_type, duration, needs_faststart = info.content_type, info.duration, info.needs_faststart
+        metadata = {**metadata, 'contentType': content_type, 'duration': duration, 'processed': True}
+        if needs_faststart:
+            with fs.new_file(filename=source.filename, chunk_size=source.chunk_size, metadata=metadata) as target:
+                faststart(source, target, info)
+            video_id = target._id
+            # Only swap if the course still points at the file we processed
+            if not Course.objects(id=course_id, video_id=source._id).update_one(set__video_id=video_id,
+                                                                                set__updated_at=datetime.datetime.utcnow()):
+                fs.delete(video_id)
+                return {'skipped': 'video replaced meanwhile'}
+            # Pages and players may still hold /serve_video/<old id> links
+            enqueue('delete_replaced_video', delay=REPLACED_GRACE, video_id=str(source._id))
+        else:
+            get_db()['fs.files'].update_one({'_id': source._id}, {'$set': {'metadata': metadata}})
+
+    Course.objects(id=course_id, video_id=video_id).update_one(
+        set__video_content_type=content_type,
+        set__video_duration=duration,
+        set__updated_at=datetime.datetime.utcnow(),
+    )
+    bump('courses')
+    # Segment the final file (after faststart), only where ffmpeg is installed
+    if hls.ffmpeg_available() and not course.video_segmented:
+        enqueue('segment_video', course_id=course_id)
+    return {'video_id': str(video_id), 'content_type': content_type,
+            'duration': duration, 'faststart': needs_faststart}
+
+
+@handler('delete_replaced_video')
+def delete_replaced_video(video_id):
+    """Delete a video file replaced by process_video, once cached links to it have expired."""
+    video_id = ObjectId(video_id)
+    if Course.objects(video_id=video_id).only('id').first():
+        return {'skipped': 'still in use'}
+    get_fs().delete(video_id)
+    return {'deleted': str(video_id)}
+
+
+@handler('segment_video')
+def segment_video(course_id):
+    """Cut a course video into HLS segments, each stored as its own GridFS file."""
+    if not hls.ffmpeg_available():
+        return {'skipped': 'ffmpeg not installed'}
+
+    course = Course.objects(id=course_id).only('video_id').first()
+    if not course or not course.video_id:
+        return {'skipped': 'no video'}
+    if VideoRendition.objects(video_id=course.video_id).first():
+        return {'skipped': 'already segmented'}
+
+    fs = get_fs()
+    rendition = VideoRendition(video_id=course.video_id, segment_seconds=hls.SEGMENT_SECONDS,
+                               **hls.build_rendition(fs, fs.get(course.video_id), course.video_id))
+    try:
+        rendition.save(force_insert=True)
+    except NotUniqueError:
+        # Another worker finished first, drop our copy
+        for file_id in [rendition.init_id] + rendition.segment_ids:
+            if file_id:
+                fs.delete(file_id)
+        return {'skipped': 'already segmented'}
+
+    Course.objects(id=course_id, video_id=course.video_id).update_one(set__video_segmented=True,
+                                                                      set__updated_at=datetime.datetime.utcnow())
+    bump('courses')
+    return {'segments': len(rendition.segment_ids)}
@@ -1,3 +1,1138 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import logging
+import os
+import struct
+from contextlib import contextmanager
+from unittest import mock
 
-# Create your tests here.
+import gridfs
+import hashlib
+import threading
+import jwt
+import mongomock
+from asgiref.sync import iscoroutinefunction
+import mongomock.gridfs
+from bson import ObjectId
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, override_settings
+from django.urls import path
+from mongoengine import connect, disconnect
+from mongoengine.connection import get_db
+from mongomock.collection import Collection
+
+from core import analytics, catalog_cache, checks, jobs, log, metrics, passwords, realtime, search, sync, tasks, tokens, views
+from core.http_cache import bump
+from core.hls import parse_playlist
+from core.media import probe
+from core.mongo import PoolStats
+from core.models import User, Course, Enrollment, Assignment, Submission, AnalyticsSnapshot, UploadSession, Job, \
+    VideoRendition, CacheVersion, Tombstone
+from core.utils import user_cache
+from core.uploads import gridfs_collections
+from core.video import RangeNotSatisfiable, chunk_plan, parse_range_header
+
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class MongoTestCase(SimpleTestCase):
+    """Runs against an in-memory mongomock database instead of the real server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        disconnect()
+        connect('lms_test', mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+        super().tearDownClass()
+
+    def setUp(self):
+        for model in (User, Course, Enrollment, Assignment, Submission, AnalyticsSnapshot, UploadSession, Job,
+                      VideoRendition, CacheVersion, Tombstone):
+            model.drop_collection()
+        # Built by `mongo_indexes --build` in deployments, not on first access
+        for model in (Enrollment, Submission):
+            model.ensure_indexes()
+        user_cache.clear()
+        tokens.verified_cache.clear()
+        cache.clear()
+
+    def make_user(self, username, role='student'):
+        return User(username=username, email=f'{username}@example.com', password='x', role=role).save()
+
+    def auth(self, user):
+        token = jwt.encode({
+            'id': str(user.id),
+            'username': user.username,
+            'role': user.role,
+            'ver': user.token_version,
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        }, settings.SECRET_KEY, algorithm='HS256')
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    @contextmanager
+    def count_queries(self):
+        """Counts read round trips (find / aggregate / count) sent to mongomock."""
+        counter = {'queries': 0}
+
+        def counting(method):
+            def wrapper(collection, *args, **kwargs):
+                counter['queries'] += 1
+                return method(collection, *args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(Collection, 'find', counting(Collection.find)), \
+                mock.patch.object(Collection, 'aggregate', counting(Collection.aggregate)), \
+                mock.patch.object(Collection, 'count_documents', counting(Collection.count_documents)):
+            yield counter
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_open_ended_range_is_capped(self):
+        self.assertEqual(parse_range_header('bytes=0-', 100, max_open_range=10), [(0, 9)])
+
+    def test_suffix_and_multi_range(self):
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=0-9, 50-59', 100), [(0, 9), (50, 59)])
+        # Overlapping ranges are merged
+        self.assertEqual(parse_range_header('bytes=0-9,5-20', 100), [(0, 20)])
+
+    def test_invalid_ranges(self):
+        self.assertIsNone(parse_range_header('items=0-1', 100))
+        self.assertIsNone(parse_range_header('bytes=5-1', 100))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=200-', 100)
+
+    def test_chunk_plan_is_aligned(self):
+        self.assertEqual(list(chunk_plan(5, 25, 10)), [(5, 5), (10, 10), (20, 6)])
+
+
+class GetCoursesQueryCountTests(MongoTestCase):
+    def seed(self, teachers, courses_per_teacher):
+        student = self.make_user('student')
+        for t in range(teachers):
+            teacher = self.make_user(f'teacher{t}', role='teacher')
+            for c in range(courses_per_teacher):
+                course = Course(title=f'course {t}-{c}', created_by=teacher).save()
+                Enrollment(student=student, course=course).save()
+        call_command('reconcile_enrollment_counts', stdout=io.StringIO())
+        return student
+
+    def fetch_courses(self, user):
+        with self.count_queries() as counter:
+            response = self.client.get('/courses/', **self.auth(user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['courses'], counter['queries']
+
+    def test_query_count_does_not_grow_with_courses(self):
+        student = self.seed(teachers=2, courses_per_teacher=2)
+        courses, few = self.fetch_courses(student)
+        self.assertEqual(len(courses), 4)
+        self.assertEqual({c['enrollments'] for c in courses}, {1})
+        self.assertEqual({c['created_by'] for c in courses}, {'teacher0', 'teacher1'})
+
+        for t in range(2, 6):
+            teacher = self.make_user(f'teacher{t}', role='teacher')
+            for c in range(5):
+                Course(title=f'course {t}-{c}', created_by=teacher).save()
+        bump('courses')
+        courses, many = self.fetch_courses(student)
+        self.assertEqual(len(courses), 24)
+        self.assertEqual(few, many)
+
+
+class EnrollmentCounterTests(MongoTestCase):
+    def test_enroll_and_unenroll_maintain_counter(self):
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='Algorithms', created_by=teacher).save()
+
+        response = self.client.post('/enroll/', {'course_id': str(course.id)},
+                                    content_type='application/json', **self.auth(student))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Course.objects.get(id=course.id).enrollment_count, 1)
+
+        Enrollment.objects.get(course=course).delete()
+        self.assertEqual(Course.objects.get(id=course.id).enrollment_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        teacher = self.make_user('teacher', role='teacher')
+        course = Course(title='Algorithms', created_by=teacher, enrollment_count=7).save()
+        Enrollment(student=self.make_user('student'), course=course).save()
+        etag = self.client.get('/courses/', **self.auth(teacher))['ETag']
+
+        call_command('reconcile_enrollment_counts', stdout=io.StringIO())
+        self.assertEqual(Course.objects.get(id=course.id).enrollment_count, 1)
+        # Cached course lists carried the wrong count
+        response = self.client.get('/courses/', HTTP_IF_NONE_MATCH=etag, **self.auth(teacher))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['courses'][0]['enrollments'], 1)
+
+    def test_deleting_a_user_unenrolls_through_the_enrollment_path(self):
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='Algorithms', created_by=teacher).save()
+        self.client.post('/enroll/', {'course_id': str(course.id)}, content_type='application/json',
+                         **self.auth(student))
+        analytics.rebuild_snapshot()
+
+        student.delete()
+        self.assertEqual(Course.objects.get(id=course.id).enrollment_count, 0)
+        self.assertEqual(Tombstone.objects.get(kind='enrollment').course, course.id)
+        snapshot = AnalyticsSnapshot.objects.get(key=analytics.SNAPSHOT_KEY)
+        self.assertEqual((snapshot.total_users, snapshot.total_enrollments), (1, 0))
+
+        # A teacher's courses go through Course.delete
+        teacher.delete()
+        self.assertEqual(Tombstone.objects.get(kind='course').doc_id, course.id)
+        self.assertEqual(AnalyticsSnapshot.objects.get(key=analytics.SNAPSHOT_KEY).total_courses, 0)
+
+
+class PaginationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = self.make_user('teacher', role='teacher')
+        for i in range(5):
+            Course(title=f'course {i}', description='long text', created_by=self.teacher).save()
+
+    def get(self, url):
+        response = self.client.get(url, **self.auth(self.teacher))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_walks_all_pages(self):
+        titles, cursor = [], ''
+        while True:
+            data = self.get(f'/courses/?limit=2&cursor={cursor}')
+            self.assertLessEqual(len(data['courses']), 2)
+            titles += [c['title'] for c in data['courses']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(titles, [f'course {i}' for i in range(5)])
+
+    def test_fields_projection(self):
+        data = self.get('/courses/?fields=id,title&limit=1')
+        self.assertEqual(set(data['courses'][0]), {'id', 'title'})
+
+    def test_bad_parameters(self):
+        response = self.client.get('/courses/?fields=password', **self.auth(self.teacher))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/courses/?cursor=nope', **self.auth(self.teacher))
+        self.assertEqual(response.status_code, 400)
+
+
+class AnalyticsSnapshotTests(MongoTestCase):
+    def test_snapshot_follows_write_events(self):
+        admin = self.make_user('admin', role='admin')
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        first = Course(title='First', created_by=teacher).save()
+        second = Course(title='Second', created_by=teacher).save()
+        analytics.rebuild_snapshot()
+
+        for course in (second, first):
+            self.client.post('/enroll/', {'course_id': str(course.id)},
+                             content_type='application/json', **self.auth(student))
+
+        data = self.client.get('/admin-dashboard/', **self.auth(admin)).json()
+        self.assertEqual((data['total_users'], data['total_courses'], data['total_enrollments']), (2, 2, 2))
+        self.assertEqual(data['top_course'], {'title': 'Second', 'enrollments': 1, 'created_by': 'teacher'})
+
+        # Deleting the top course leaves the snapshot marked stale for a rebuild
+        Course.objects.get(id=second.id).delete()
+        snapshot = AnalyticsSnapshot.objects.get(key=analytics.SNAPSHOT_KEY)
+        self.assertEqual((snapshot.total_courses, snapshot.total_enrollments), (1, 1))
+        self.assertIsNone(snapshot.refreshed_at)
+        self.assertEqual(analytics.rebuild_snapshot().top_course_title, 'First')
+
+    def test_rebuild_does_not_overwrite_concurrent_updates(self):
+        analytics.rebuild_snapshot()
+        count, calls = analytics._count, []
+
+        def count_while_a_user_registers():
+            fields = count()
+            if not calls:
+                analytics.record_registration(self.make_user('late'))
+            calls.append(fields)
+            return fields
+
+        with mock.patch.object(analytics, '_count', count_while_a_user_registers):
+            snapshot = analytics.rebuild_snapshot()
+        self.assertEqual([fields['total_users'] for fields in calls], [0, 1])
+        self.assertEqual(snapshot.total_users, 1)
+
+
+class UserCacheTests(MongoTestCase):
+    def test_repeat_requests_hit_the_cache(self):
+        student = self.make_user('student')
+        for _ in range(3):
+            self.assertEqual(self.client.get('/my-courses/', **self.auth(student)).status_code, 200)
+        self.assertEqual(user_cache.stats(), {'hits': 2, 'misses': 1, 'size': 1})
+
+    def test_role_change_revokes_old_tokens(self):
+        student = self.make_user('student')
+        headers = self.auth(student)
+        self.assertEqual(self.client.get('/my-courses/', **headers).status_code, 200)
+
+        student.role = 'teacher'
+        student.save()
+        self.assertEqual(self.client.get('/my-courses/', **headers).status_code, 401)
+        self.assertEqual(self.client.get('/my-courses/', **self.auth(student)).status_code, 200)
+
+    def test_claims_only_endpoint_skips_the_database(self):
+        student = self.make_user('student')
+        with self.count_queries() as counter:
+            response = self.client.get('/dashboard/', **self.auth(student))
+        self.assertEqual(response.json()['role'], 'student')
+        self.assertEqual(counter['queries'], 0)
+
+
+class DuplicateWriteTests(MongoTestCase):
+    def post(self, url, data, user):
+        return self.client.post(url, data, content_type='application/json', **self.auth(user))
+
+    def test_second_enrollment_is_rejected_by_the_index(self):
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='Algorithms', created_by=teacher).save()
+
+        self.assertEqual(self.post('/enroll/', {'course_id': str(course.id)}, student).status_code, 200)
+        response = self.post('/enroll/', {'course_id': str(course.id)}, student)
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Already enrolled'}))
+        self.assertEqual(Enrollment.objects.count(), 1)
+        self.assertEqual(Course.objects.get(id=course.id).enrollment_count, 1)
+
+    def test_enrolling_in_a_course_deleted_meanwhile(self):
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='Algorithms', created_by=teacher).save()
+        save = Enrollment.save
+
+        def save_then_delete_course(enrollment, *args, **kwargs):
+            result = save(enrollment, *args, **kwargs)
+            Course._get_collection().delete_one({'_id': course.id})
+            return result
+
+        with mock.patch.object(Enrollment, 'save', save_then_delete_course):
+            response = self.post('/enroll/', {'course_id': str(course.id)}, student)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Enrollment.objects.count(), 0)
+
+    def test_second_submission_is_rejected_by_the_index(self):
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='Algorithms', created_by=teacher).save()
+        assignment = Assignment(title='Sorting', course=course, created_by=teacher).save()
+
+        data = {'assignment_id': str(assignment.id), 'content': 'answer'}
+        self.assertEqual(self.post('/submit-assignment/', data, student).status_code, 200)
+        self.assertEqual(self.post('/submit-assignment/', data, student).status_code, 400)
+        self.assertEqual(Submission.objects.count(), 1)
+
+    def test_dedupe_removes_existing_duplicates_before_the_unique_index(self):
+        # Data written before the unique index existed, straight to the collection
+        Enrollment.drop_collection()
+        self.assertIn("Enrollment is missing index [('student', 1), ('course', 1)]",
+                      [error.msg for error in checks.declared_indexes()])
+        student, course = ObjectId(), ObjectId()
+        collection = get_db()[Enrollment._get_collection_name()]
+        first = collection.insert_one({'student': student, 'course': course}).inserted_id
+        collection.insert_many([{'student': student, 'course': course} for _ in range(2)])
+        collection.insert_one({'student': ObjectId(), 'course': course})
+
+        out = io.StringIO()
+        call_command('mongo_indexes', dedupe=True, build=True, stdout=out)
+        self.assertIn('Enrollment: removed 2 duplicates of student, course', out.getvalue())
+        self.assertEqual(list(Enrollment.objects(student=student).scalar('id')), [first])
+        self.assertEqual(Enrollment.objects.count(), 2)
+        self.assertEqual(CacheVersion.objects.get(key=f'student:{student}').version, 1)
+        self.assertEqual(checks.declared_indexes(), [])
+
+
+class BulkEnrollTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = self.make_user('teacher', role='teacher')
+        self.course = Course(title='Algorithms', created_by=self.teacher).save()
+        self.students = [self.make_user(f'student{i}') for i in range(3)]
+        Enrollment(student=self.students[0], course=self.course).save()
+
+    def test_json_body_reports_per_student_results(self):
+        payload = {
+            'course_id': str(self.course.id),
+            'students': ['student0', str(self.students[1].id), 'student2', 'student2', 'nobody'],
+        }
+        response = self.client.post('/bulk-enroll/', payload, content_type='application/json',
+                                    **self.auth(self.teacher))
+        data = response.json()
+        self.assertEqual(data['enrolled'], 2)
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['already_enrolled', 'enrolled', 'enrolled', 'duplicate_in_request', 'not_found'])
+        self.assertEqual(Enrollment.objects(course=self.course).count(), 3)
+
+    def test_csv_upload(self):
+        upload = io.BytesIO(b'username\nstudent1\nstudent2\n')
+        upload.name = 'cohort.csv'
+        response = self.client.post('/bulk-enroll/', {'course_id': str(self.course.id), 'file': upload},
+                                    **self.auth(self.teacher))
+        self.assertEqual(response.json()['enrolled'], 2)
+
+    def test_csv_header_is_only_skipped_on_the_first_row(self):
+        self.make_user('id')
+        upload = io.BytesIO(b'student1\nid\n\nnobody\n')
+        upload.name = 'cohort.csv'
+        response = self.client.post('/bulk-enroll/', {'course_id': str(self.course.id), 'file': upload},
+                                    **self.auth(self.teacher))
+        self.assertEqual([(r['student'], r['status']) for r in response.json()['results']],
+                         [('student1', 'enrolled'), ('id', 'enrolled'), ('', 'not_found'), ('nobody', 'not_found')])
+
+    def test_students_and_other_teachers_are_rejected(self):
+        other = self.make_user('other', role='teacher')
+        payload = {'course_id': str(self.course.id), 'students': ['student1']}
+        for user in (self.students[1], other):
+            response = self.client.post('/bulk-enroll/', payload, content_type='application/json',
+                                        **self.auth(user))
+            self.assertEqual(response.status_code, 403)
+
+
+class ResumableUploadTests(MongoTestCase):
+    def test_chunked_upload_resumes_and_creates_course(self):
+        teacher = self.make_user('teacher', role='teacher')
+        headers = self.auth(teacher)
+        video = bytes(range(256)) * 1100  # a bit more than one GridFS chunk
+        response = self.client.post('/upload-course/init/', {
+            'title': 'Lecture 1', 'filename': 'lecture1.mp4', 'size': len(video),
+            'sha256': hashlib.sha256(video).hexdigest(),
+        }, content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 201)
+        upload = response.json()
+        url, chunk = f"/upload-course/{upload['upload_id']}/", upload['chunk_size']
+
+        def put(offset, data, **extra):
+            return self.client.put(url, data, content_type='application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET=str(offset), **headers, **extra)
+
+        def checksum(data):
+            return {'HTTP_UPLOAD_CHECKSUM': hashlib.sha256(data).hexdigest()}
+
+        # The upload declared a sha256, so every append is verified
+        self.assertEqual(put(0, video[:chunk]).status_code, 400)
+        self.assertEqual(put(0, video[:chunk], **checksum(video[:chunk])).json()['offset'], chunk)
+        # A retry at a stale offset is refused with the offset to resume from
+        response = put(0, video[:chunk], **checksum(video[:chunk]))
+        self.assertEqual((response.status_code, response.json()['offset']), (409, chunk))
+        # A corrupted chunk is rejected and leaves the offset unchanged
+        response = put(chunk, video[chunk:], HTTP_UPLOAD_CHECKSUM='0' * 64)
+        self.assertEqual((response.status_code, response.json()['offset']), (400, chunk))
+        # Completing too early fails, no course is created
+        self.assertEqual(self.client.post(url + 'complete/', **headers).status_code, 400)
+        self.assertEqual(Course.objects.count(), 0)
+
+        self.assertEqual(self.client.get(url, **headers).json()['offset'], chunk)
+        rest = video[chunk:]
+        self.assertEqual(put(chunk, rest, **checksum(rest)).status_code, 200)
+        response = self.client.post(url + 'complete/', **headers)
+        self.assertEqual(response.status_code, 200)
+
+        course = Course.objects.get(id=response.json()['course_id'])
+        self.assertEqual(gridfs.GridFS(get_db()).get(course.video_id).read(), video)
+
+    def test_only_one_complete_request_creates_the_course(self):
+        teacher = self.make_user('teacher', role='teacher')
+        headers = self.auth(teacher)
+        upload = self.client.post('/upload-course/init/', {'title': 'Lecture 1', 'filename': 'l.mp4', 'size': 10},
+                                  content_type='application/json', **headers).json()
+        url = f"/upload-course/{upload['upload_id']}/"
+        self.client.put(url, b'0123456789', content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0',
+                        **headers)
+
+        # Another request holds the claim: no second course, no more appends
+        UploadSession.objects(id=upload['upload_id']).update_one(set__status=UploadSession.FINALIZING)
+        self.assertEqual(self.client.post(url + 'complete/', **headers).status_code, 409)
+        self.assertEqual(Course.objects.count(), 0)
+
+        # Its request died: a retry takes over once the claim is stale
+        UploadSession.objects(id=upload['upload_id']).update_one(
+            set__updated_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+        first = self.client.post(url + 'complete/', **headers)
+        second = self.client.post(url + 'complete/', **headers)
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(first.json()['course_id'], second.json()['course_id'])
+        self.assertEqual(Course.objects.count(), 1)
+
+    def test_cleanup_expires_abandoned_finalizing_sessions(self):
+        teacher = self.make_user('teacher', role='teacher')
+        files, chunks = gridfs_collections()
+        old = datetime.datetime.utcnow() - datetime.timedelta(hours=25)
+        sessions = [UploadSession(teacher=teacher, title=title, filename='l.mp4', size=10, chunk_size=10,
+                                  status=UploadSession.FINALIZING, updated_at=updated_at).save()
+                    for title, updated_at in (('abandoned', old), ('saved its course', old),
+                                              ('in progress', datetime.datetime.utcnow()))]
+        for session in sessions:
+            chunks.insert_one({'files_id': session.file_id, 'n': 0, 'data': b'0123456789'})
+        course = Course(title='saved its course', created_by=teacher, video_id=sessions[1].file_id).save()
+        files.insert_one({'_id': sessions[1].file_id, 'length': 10, 'chunkSize': 10})
+
+        call_command('cleanup_uploads', '--orphans', stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects(id=sessions[0].id).count())
+        self.assertEqual(UploadSession.objects.get(id=sessions[1].id).course.id, course.id)
+        self.assertEqual(UploadSession.objects.get(id=sessions[2].id).status, UploadSession.FINALIZING)
+        remaining = set(chunks.distinct('files_id'))
+        self.assertEqual([session.file_id in remaining for session in sessions], [False, True, True])
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def sample_mp4(media=b'frame-data' * 100):
+    """ftyp + mdat + moov (moov last, like most cameras write it), one chunk pointing into mdat."""
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2')
+    mdat = box(b'mdat', media)
+    chunk_offset = len(ftyp) + 8
+    mvhd = box(b'mvhd', b'\x00' * 12 + struct.pack('>II', 1000, 90500) + b'\x00' * 80)
+    stco = box(b'stco', struct.pack('>III', 0, 1, chunk_offset))
+    trak = box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', stco))))
+    return ftyp + mdat + box(b'moov', mvhd + trak)
+
+
+class VideoJobTests(MongoTestCase):
+    def test_process_video_remuxes_to_faststart(self):
+        teacher = self.make_user('teacher', role='teacher')
+        video = sample_mp4()
+        fs = gridfs.GridFS(get_db())
+        course = Course(title='Lecture', created_by=teacher, video_id=fs.put(video, filename='l.mp4')).save()
+        jobs.enqueue('process_video', course_id=str(course.id))
+
+        jobs.run_worker(once=True)
+
+        job = Job.objects.get(kind='process_video')
+        self.assertEqual(job.status, Job.DONE, job.error)
+        course.reload()
+        self.assertEqual((course.video_content_type, course.video_duration), ('video/mp4', 90.5))
+        remuxed = fs.get(course.video_id)
+        self.assertEqual(remuxed.metadata['contentType'], 'video/mp4')
+        data = remuxed.read()
+        self.assertEqual(len(data), len(video))
+
+        info = probe(io.BytesIO(data), len(data))
+        self.assertFalse(info.needs_faststart)
+        self.assertEqual([b.kind for b in info.boxes], [b'ftyp', b'moov', b'mdat'])
+        # The chunk offset still points at the media data
+        offset = struct.unpack('>I', info.moov[-4:])[0]
+        self.assertEqual(data[offset:offset + 10], b'frame-data')
+
+        # Running it again (a retry after a lost lease) changes nothing
+        self.assertEqual(tasks.process_video(str(course.id)), {'skipped': 'already processed'})
+        self.assertEqual(Course.objects.get(id=course.id).video_id, course.video_id)
+
+        # The original keeps serving cached links until its delayed deletion
+        original = Course._get_collection().database['fs.files'].find_one({'_id': {'$ne': course.video_id}})['_id']
+        self.assertEqual(self.client.get(f'/serve_video/{original}').status_code, 200)
+        cleanup = Job.objects.get(kind='delete_replaced_video')
+        self.assertGreater(cleanup.run_after, datetime.datetime.utcnow() + datetime.timedelta(hours=23))
+        Job.objects(id=cleanup.id).update_one(set__run_after=cleanup.created_at)
+        jobs.run_worker(once=True)
+        self.assertEqual(Job.objects.get(id=cleanup.id).result, {'deleted': str(original)})
+        self.assertEqual(self.client.get(f'/serve_video/{original}').status_code, 404)
+
+    def test_only_the_lease_holder_records_the_outcome(self):
+        job = jobs.enqueue('process_video', course_id=str(ObjectId()))
+        stale = jobs.claim('worker-1')
+        # worker-1 stalled past its lease and worker-2 took the job over
+        Job.objects(id=job.id).update_one(set__locked_until=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+        current = jobs.claim('worker-2')
+        self.assertEqual((current.id, current.locked_by), (job.id, 'worker-2'))
+
+        self.assertFalse(jobs.run_job(stale))
+        job.reload()
+        self.assertEqual((job.status, job.locked_by), (Job.RUNNING, 'worker-2'))
+        self.assertTrue(jobs.run_job(current))
+        self.assertEqual(Job.objects.get(id=job.id).result, {'skipped': 'no video'})
+
+    def test_expired_lease_on_the_last_attempt_fails_the_job(self):
+        job = jobs.enqueue('process_video', max_attempts=1, course_id=str(ObjectId()))
+        jobs.claim('worker-1')
+        Job.objects(id=job.id).update_one(set__locked_until=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+        self.assertIsNone(jobs.claim('worker-2'))
+        job.reload()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.FAILED, 1, 'worker-1'))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failing_job_is_retried_then_failed(self):
+        job = jobs.enqueue('process_video', max_attempts=2, course_id='not-an-id')
+        jobs.run_worker(once=True)
+        job.reload()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+
+        Job.objects(id=job.id).update_one(set__run_after=job.created_at)
+        jobs.run_worker(once=True)
+        job.reload()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+
+class HlsPlaybackTests(MongoTestCase):
+    def test_playlist_and_segments(self):
+        fs = gridfs.GridFS(get_db())
+        video_id = fs.put(b'full video')
+        init_id = fs.put(b'init', metadata={'contentType': 'video/mp4'})
+        segment_ids = [fs.put(b'segment-%d' % i, metadata={'contentType': 'video/iso.segment'}) for i in range(2)]
+        VideoRendition(video_id=video_id, segment_seconds=6, init_id=init_id,
+                       segment_ids=segment_ids, durations=[6.0, 2.5]).save()
+
+        response = self.client.get(f'/videos/{video_id}/playlist.m3u8')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        init, segments = parse_playlist(response.content.decode())
+        self.assertEqual(init, 'init.mp4')
+        self.assertEqual(segments, [('segments/0.m4s', 6.0), ('segments/1.m4s', 2.5)])
+
+        response = self.client.get(f'/videos/{video_id}/segments/1.m4s', HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'segm')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        self.assertEqual(self.client.get(f'/videos/{video_id}/init.mp4').status_code, 200)
+        self.assertEqual(self.client.get(f'/videos/{video_id}/segments/2.m4s').status_code, 404)
+
+
+# serve_video_async is only routed with VIDEO_ASYNC_SERVING, AsyncVideoTests use this URLconf
+urlpatterns = [path('serve_video/<str:video_id>', views.serve_video_async)]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncVideoTests(MongoTestCase):
+    def get(self, video_id, headers=None):
+        async def fetch():
+            response = await AsyncClient().get(f'/serve_video/{video_id}', headers=headers)
+            body = b''
+            if response.streaming:
+                body = b''.join([chunk async for chunk in response.streaming_content])
+            return response, body
+        return asyncio.run(fetch())
+
+    def setUp(self):
+        super().setUp()
+        self.video = bytes(range(256)) * 4
+        self.video_id = gridfs.GridFS(get_db()).put(self.video, metadata={'contentType': 'video/mp4'})
+
+    def test_full_and_ranged_responses(self):
+        response, body = self.get(self.video_id)
+        self.assertEqual((response.status_code, body), (200, self.video))
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+
+        response, body = self.get(self.video_id, {'Range': 'bytes=10-19'})
+        self.assertEqual((response.status_code, body), (206, self.video[10:20]))
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.video)}')
+
+        response, body = self.get(self.video_id, {'Range': 'bytes=0-1,100-101'})
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(len(body), int(response['Content-Length']))
+
+        response, _ = self.get(self.video_id, {'Range': 'bytes=5000-'})
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.video)}'))
+
+    def test_if_range_and_not_modified(self):
+        etag = self.get(self.video_id)[0]['ETag']
+        response, body = self.get(self.video_id, {'Range': 'bytes=0-3', 'If-Range': etag})
+        self.assertEqual((response.status_code, body), (206, self.video[:4]))
+        # A stale If-Range gets the whole file instead of a range of a different one
+        response, body = self.get(self.video_id, {'Range': 'bytes=0-3', 'If-Range': '"stale"'})
+        self.assertEqual((response.status_code, body), (200, self.video))
+
+        response, body = self.get(self.video_id, {'If-None-Match': etag})
+        self.assertEqual((response.status_code, body), (304, b''))
+        self.assertEqual(self.get(ObjectId())[0].status_code, 404)
+
+
+class ConditionalGetTests(MongoTestCase):
+    def test_courses_revalidate_until_something_changes(self):
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='course', created_by=teacher).save()
+
+        response = self.client.get('/courses/', **self.auth(student))
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        with self.count_queries() as counter:
+            response = self.client.get('/courses/', HTTP_IF_NONE_MATCH=etag, **self.auth(student))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(counter['queries'], 1)  # only the version lookup
+
+        self.client.post('/enroll/', {'course_id': str(course.id)}, content_type='application/json',
+                         **self.auth(student))
+        response = self.client.get('/courses/', HTTP_IF_NONE_MATCH=etag, **self.auth(student))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_video_not_modified(self):
+        video_id = gridfs.GridFS(get_db()).put(b'video bytes')
+        response = self.client.get(f'/serve_video/{video_id}')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get(f'/serve_video/{video_id}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+
+class CatalogCacheTests(MongoTestCase):
+    def test_catalog_is_served_from_cache_until_invalidated(self):
+        catalog_cache.reset_stats()
+        teacher = self.make_user('teacher', role='teacher')
+        student = self.make_user('student')
+        course = Course(title='course', created_by=teacher).save()
+        bump('courses')
+
+        self.assertEqual(self.client.get('/courses/', **self.auth(student)).json()['courses'][0]['enrollments'], 0)
+        with self.count_queries() as counter:
+            response = self.client.get('/courses/', **self.auth(teacher))
+        self.assertEqual(response.json()['courses'][0]['title'], 'course')
+        self.assertEqual(counter['queries'], 1)  # version lookup only
+
+        self.client.post('/enroll/', {'course_id': str(course.id)}, content_type='application/json',
+                         **self.auth(student))
+        self.assertEqual(self.client.get('/courses/', **self.auth(student)).json()['courses'][0]['enrollments'], 1)
+        self.assertEqual(catalog_cache.stats()['hits'], 1)
+        self.assertEqual(catalog_cache.stats()['misses'], 2)
+
+
+class MongoPoolTests(MongoTestCase):
+    def test_pool_counters(self):
+        stats = PoolStats()
+        event = mock.Mock(address=('db', 27017))
+        stats.connection_created(event)
+        stats.connection_check_out_started(event)
+        stats.connection_checked_out(event)
+        stats.connection_check_out_started(event)
+        pool = stats.snapshot()['db:27017']
+        self.assertEqual((pool['open'], pool['in_use'], pool['waiting']), (1, 1, 1))
+        stats.connection_check_out_failed(event)
+        stats.connection_checked_in(event)
+        pool = stats.snapshot()['db:27017']
+        self.assertEqual((pool['in_use'], pool['waiting'], pool['checkout_failed'], pool['peak_in_use']), (0, 0, 1, 1))
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get('/admin-dashboard/mongo-pool/', **self.auth(self.make_user('s'))).status_code, 403)
+        admin = self.make_user('a', role='admin')
+        headers = self.auth(admin)
+        response = self.client.get('/admin-dashboard/mongo-pool/', **headers)
+        self.assertEqual(response.json()['max_pool_size'], settings.MONGO_MAX_POOL_SIZE)
+
+        # Demoting the admin revokes the old token at once
+        admin.role = 'teacher'
+        admin.save()
+        for url in ('/admin-dashboard/mongo-pool/', '/admin-dashboard/metrics/'):
+            self.assertEqual(self.client.get(url, **headers).status_code, 401)
+
+
+@mock.patch.object(passwords, 'ROUNDS', 4)
+class PasswordHashingTests(MongoTestCase):
+    def register_and_login(self):
+        self.client.post('/register/', {'username': 'u', 'password': 'pw', 'email': 'u@example.com',
+                                        'role': 'student'}, content_type='application/json')
+        return self.client.post('/login-password/', {'username': 'u', 'password': 'pw'},
+                                content_type='application/json')
+
+    def test_hashing_runs_in_the_pool(self):
+        response = self.register_and_login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(passwords.hash_rounds(User.objects.get(username='u').password), 4)
+
+    @mock.patch.object(passwords, 'WORKERS', 0)
+    def test_login_rehashes_old_cost_without_revoking_tokens(self):
+        self.register_and_login()
+        with mock.patch.object(passwords, 'ROUNDS', 5):
+            response = self.client.post('/login-password/', {'username': 'u', 'password': 'pw'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(username='u')
+        self.assertEqual((passwords.hash_rounds(user.password), user.token_version), (5, 0))
+
+    @mock.patch.object(passwords, '_pending', threading.BoundedSemaphore(1))
+    def test_saturated_pool_answers_503(self):
+        passwords._pending.acquire()
+        response = self.client.post('/register/', {'username': 'u', 'password': 'pw', 'email': 'u@example.com',
+                                                   'role': 'student'}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(passwords.RETRY_AFTER))
+
+
+class TeacherDashboardQueryCountTests(MongoTestCase):
+    def fetch(self, teacher):
+        with self.count_queries() as counter:
+            response = self.client.get('/teacher-dashboard/', **self.auth(teacher))
+        self.assertEqual(response.status_code, 200)
+        return response.json(), counter['queries']
+
+    def test_roster_queries_do_not_grow_with_students(self):
+        teacher = self.make_user('teacher', role='teacher')
+        courses = [Course(title=f'course {i}', created_by=teacher).save() for i in range(2)]
+        Enrollment(student=self.make_user('s0'), course=courses[0]).save()
+        self.fetch(teacher)  # warm the user cache
+        data, few = self.fetch(teacher)
+        self.assertEqual([c['students'] for c in data['enrolled_students']], [['s0'], []])
+
+        for i in range(1, 20):
+            student = self.make_user(f's{i}')
+            for course in courses:
+                Enrollment(student=student, course=course).save()
+        bump('enrollments')
+        data, many = self.fetch(teacher)
+        self.assertEqual([len(c['students']) for c in data['enrolled_students']], [20, 19])
+        self.assertEqual(few, many)
+
+
+class MetricsTests(MongoTestCase):
+    def test_command_timer_counts_per_request(self):
+        stats = metrics.RequestStats()
+        token = metrics._current.set(stats)
+        try:
+            metrics.command_timer.succeeded(mock.Mock(duration_micros=1500, reply={'ok': 1}))
+            metrics.command_timer.failed(mock.Mock(duration_micros=500))
+        finally:
+            metrics._current.reset(token)
+        metrics.command_timer.succeeded(mock.Mock(duration_micros=1000, reply={'ok': 1}))  # outside a request
+        self.assertEqual((stats.commands, stats.mongo_ms, stats.bytes), (2, 2.0, 0))
+
+    def test_reply_bytes_are_opt_in(self):
+        stats = metrics.RequestStats()
+        token = metrics._current.set(stats)
+        try:
+            with mock.patch.object(metrics, 'REPLY_BYTES', True):
+                metrics.command_timer.succeeded(mock.Mock(duration_micros=1500, reply={'ok': 1}))
+                self.assertIn('1 commands, 13 bytes', metrics.server_timing(2.0, stats))
+        finally:
+            metrics._current.reset(token)
+
+    def test_server_timing_and_endpoint_histograms(self):
+        metrics.reset()
+        student = self.make_user('student')
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            response = self.client.get('/courses/', **self.auth(student))
+        self.assertIn('app;dur=', response['Server-Timing'])
+        self.assertIn('mongo;dur=', response['Server-Timing'])
+        self.assertEqual(logs.records[0].view, 'get_courses')
+
+        admin = self.make_user('admin', role='admin')
+        data = self.client.get('/admin-dashboard/metrics/', **self.auth(admin)).json()
+        endpoints = data['endpoints']
+        self.assertEqual(endpoints['get_courses']['requests'], 1)
+        self.assertEqual(set(data['caches']), {'catalog', 'users', 'tokens'})
+        self.assertEqual(data['caches']['users'], user_cache.stats())
+        self.assertEqual(sum(endpoints['get_courses']['latency_ms']['buckets'].values()), 1)
+
+    def test_middleware_stays_async_in_an_async_stack(self):
+        async def view(request):
+            metrics.record_command(2000)
+            return HttpResponse('ok')
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/anywhere/')))
+        self.assertIn('mongo;dur=2.0;desc="1 commands', response['Server-Timing'])
+        self.assertFalse(iscoroutinefunction(metrics.MetricsMiddleware(lambda request: HttpResponse('ok'))))
+
+
+class StructuredLoggingTests(MongoTestCase):
+    def test_request_id_reaches_json_log_lines(self):
+        stream = io.StringIO()
+        handler = log.BackgroundHandler(stream=stream)
+        logger = logging.getLogger('core.test_log')
+        logger.addHandler(handler)
+        try:
+            with mock.patch('core.views.logger', logger):
+                response = self.client.post('/send-magic-link/', {'email': 'nobody@example.com'},
+                                            content_type='application/json', HTTP_X_REQUEST_ID='abc-123')
+                self.make_user('u')
+                self.client.post('/send-magic-link/', {'email': 'u@example.com'},
+                                 content_type='application/json', HTTP_X_REQUEST_ID='abc-456')
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        entry = json.loads(stream.getvalue().splitlines()[0])
+        self.assertEqual((entry['request_id'], entry['level']), ('abc-456', 'INFO'))
+        self.assertIn('u@example.com', entry['message'])
+
+    def test_request_id_middleware_in_an_async_stack(self):
+        async def view(request):
+            return HttpResponse(log.get_request_id())
+
+        middleware = log.RequestIdMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/anywhere/', HTTP_X_REQUEST_ID='abc-789')))
+        self.assertEqual((response['X-Request-ID'], response.content), ('abc-789', b'abc-789'))
+
+    def test_debug_is_sampled_per_request(self):
+        record = logging.LogRecord('core', logging.DEBUG, '', 0, 'x', None, None)
+        with mock.patch.object(log, 'debug_sample_rate', return_value=0):
+            self.assertFalse(log.SampleDebugFilter().filter(record))
+        with mock.patch.object(log, 'debug_sample_rate', return_value=1):
+            self.assertTrue(log.SampleDebugFilter().filter(record))
+
+
+class TokenTests(MongoTestCase):
+    def claims(self, minutes=60):
+        return {'id': 'x', 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes)}
+
+    def test_rotation_keeps_old_kids_and_legacy_tokens_valid(self):
+        keys = {'k1': 'old-key', 'k2': 'new-key'}
+        with mock.patch.multiple(tokens, SIGNING_KEYS=keys, ACTIVE_KID='k1'):
+            old = tokens.issue(self.claims())
+        with mock.patch.multiple(tokens, SIGNING_KEYS=keys, ACTIVE_KID='k2'):
+            new = tokens.issue(self.claims())
+            self.assertEqual(jwt.get_unverified_header(new)['kid'], 'k2')
+            self.assertEqual(tokens.verify(old)['id'], 'x')
+            self.assertEqual(tokens.verify(new)['id'], 'x')
+            legacy = jwt.encode(self.claims(), settings.SECRET_KEY, algorithm='HS256')
+            self.assertEqual(tokens.verify(legacy)['id'], 'x')
+        with mock.patch.multiple(tokens, SIGNING_KEYS={'k2': 'new-key'}, ACTIVE_KID='k2', ACCEPT_UNVERSIONED=False):
+            tokens.verified_cache.clear()
+            with self.assertRaises(jwt.InvalidTokenError):
+                tokens.verify(old)
+            with self.assertRaises(jwt.InvalidTokenError):
+                tokens.verify(legacy)
+
+    def test_cached_token_is_not_decoded_again_and_expires(self):
+        token = tokens.issue(self.claims())
+        tokens.verify(token)
+        with mock.patch('core.tokens.jwt.decode') as decode:
+            self.assertEqual(tokens.verify(token)['id'], 'x')
+        decode.assert_not_called()
+
+        expired = tokens.issue(self.claims(minutes=-1))
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            tokens.verify(expired)
+        self.assertIsNone(tokens.verified_cache.get(expired))
+
+
+class SyncTests(MongoTestCase):
+    def old_id(self):
+        # An _id created ten minutes ago, well before any watermark of the test
+        past = datetime.datetime.utcnow() - datetime.timedelta(minutes=10)
+        return ObjectId(ObjectId.from_datetime(past).binary[:4] + ObjectId().binary[4:])
+
+    def sync(self, user, since=''):
+        return self.client.get('/sync/', {'since': since}, **self.auth(user)).json()
+
+    def old_course(self, **fields):
+        course = Course(id=self.old_id(), **fields).save()
+        Course.objects(id=course.id).update_one(set__updated_at=course.id.generation_time.replace(tzinfo=None))
+        return course
+
+    def test_second_sync_returns_only_the_delta_and_tombstones(self):
+        teacher, student = self.make_user('t', role='teacher'), self.make_user('s')
+        enrolled = self.old_course(title='Enrolled', created_by=teacher)
+        other = self.old_course(title='Other', created_by=teacher)
+        enrollment = Enrollment(id=self.old_id(), student=student, course=enrolled).save()
+        Assignment(id=self.old_id(), title='A1', course=enrolled, created_by=teacher).save()
+        Assignment(id=self.old_id(), title='A2', course=other, created_by=teacher).save()
+
+        first = self.sync(student)
+        self.assertTrue(first['full'])
+        self.assertEqual((len(first['courses']), len(first['enrollments'])), (2, 1))
+        self.assertEqual([a['title'] for a in first['assignments']], ['A1'])
+        teacher_first = self.sync(teacher)
+
+        new_course = Course(title='New', created_by=teacher).save()
+        Enrollment(student=student, course=other).save()
+        enrollment.delete()
+
+        delta = self.sync(student, first['watermark'])
+        self.assertFalse(delta['full'])
+        # The unenrollment changed the enrollment count of the other one
+        self.assertEqual([c['id'] for c in delta['courses']], [str(enrolled.id), str(new_course.id)])
+        self.assertEqual([e['course_id'] for e in delta['enrollments']], [str(other.id)])
+        # Joined a course since the last sync: its older assignments are new to this client
+        self.assertEqual([a['title'] for a in delta['assignments']], ['A2'])
+        self.assertEqual(delta['deleted'], {'enrollments': [str(enrollment.id)]})
+
+        enrolled.delete()
+        delta = self.sync(teacher, teacher_first['watermark'])
+        self.assertEqual([e['student'] for e in delta['enrollments']], ['s'])
+        self.assertEqual(delta['deleted']['courses'], [str(enrolled.id)])
+
+    def test_course_updates_are_synced(self):
+        teacher, student = self.make_user('t', role='teacher'), self.make_user('s')
+        course = self.old_course(title='Course', created_by=teacher)
+        self.old_course(title='Untouched', created_by=teacher)
+        watermark = self.sync(teacher)['watermark']
+
+        self.client.post('/enroll/', {'course_id': str(course.id)}, content_type='application/json',
+                         **self.auth(student))
+        delta = self.sync(teacher, watermark)
+        self.assertEqual([(c['id'], c['enrollments']) for c in delta['courses']], [(str(course.id), 1)])
+
+        # The processed video reaches the client too
+        watermark = delta['watermark']
+        Course.objects(id=course.id).update_one(set__updated_at=course.id.generation_time.replace(tzinfo=None))
+        self.assertEqual(self.sync(teacher, watermark)['courses'], [])
+        video_id = gridfs.GridFS(get_db()).put(b'video')
+        Course.objects(id=course.id).update_one(set__video_id=video_id)
+        with mock.patch('core.hls.ffmpeg_available', return_value=False):
+            tasks.process_video(str(course.id))
+        self.assertEqual([c['video_url'] is not None for c in self.sync(teacher, watermark)['courses']], [True])
+
+    def test_watermarks(self):
+        student = self.make_user('s')
+        expired = (datetime.datetime.utcnow() - datetime.timedelta(days=Tombstone.RETENTION_DAYS + 1)).isoformat()
+        self.assertTrue(self.sync(student, expired)['full'])
+        self.assertEqual(sync.parse_watermark('1700000000'), datetime.datetime(2023, 11, 14, 22, 13, 20))
+        response = self.client.get('/sync/', {'since': 'yesterday'}, **self.auth(student))
+        self.assertEqual(response.status_code, 400)
+
+
+class RealtimeTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher, self.other = self.make_user('t', role='teacher'), self.make_user('o', role='teacher')
+        self.student = self.make_user('s')
+        self.course = Course(title='C', created_by=self.teacher).save()
+        self.assignment = Assignment(title='A', course=self.course, created_by=self.teacher).save()
+
+    def test_polling_fans_out_to_the_course_owner_only(self):
+        async def scenario():
+            hub = realtime.Hub()
+            mine, theirs = hub.subscribe(self.teacher.id), hub.subscribe(self.other.id)
+            Enrollment(student=self.student, course=self.course).save()
+            Submission(assignment=self.assignment, student=self.student, content='x').save()
+            hub.poll_once()
+            hub.poll_once()  # overlapping window, nothing sent twice
+            await asyncio.sleep(0)
+            return [mine.queue.get_nowait() for _ in range(mine.queue.qsize())], theirs.queue.qsize()
+
+        events, others = asyncio.run(scenario())
+        self.assertEqual([(e['type'], e['student'], e['course_id']) for e in events],
+                         [('enrollment', 's', str(self.course.id)), ('submission', 's', str(self.course.id))])
+        self.assertEqual(others, 0)
+
+    def test_stream_replays_events_after_last_event_id(self):
+        last_seen = ObjectId()
+        Enrollment(student=self.student, course=self.course).save()
+        token = self.auth(self.teacher)['HTTP_AUTHORIZATION'].split()[1]
+
+        async def read():
+            response = await AsyncClient().get('/teacher-events/', {'token': token},
+                                               headers={'Last-Event-ID': str(last_seen)})
+            chunks = response.streaming_content
+            first, second = await anext(chunks), await anext(chunks)
+            await chunks.aclose()
+            return response, second
+
+        with mock.patch.object(realtime.hub, 'start'):
+            response, event = asyncio.run(read())
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn(b'event: enrollment', event)
+        self.assertEqual(realtime.hub.connections(), 0)
+
+        student_token = self.auth(self.student)['HTTP_AUTHORIZATION'].split()[1]
+        response = asyncio.run(AsyncClient().get('/teacher-events/', {'token': student_token}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_stream_needs_asgi(self):
+        token = self.auth(self.teacher)['HTTP_AUTHORIZATION'].split()[1]
+        response = self.client.get('/teacher-events/', {'token': token})
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(realtime.hub.connections(), 0)
+
+    def test_watch_restarts_without_the_token_when_history_is_lost(self):
+        stream = mock.MagicMock(resume_token={'_data': 'a'})
+        stream.__enter__.return_value = stream
+        stream.__iter__.return_value = [{'ns': {'coll': 'enrollment'}, 'fullDocument': {}}]
+        db = mock.Mock()
+        db.watch.side_effect = [stream, realtime.OperationFailure('history lost', code=286), RuntimeError('stop')]
+
+        async def scenario():
+            hub = realtime.Hub()
+            subscription = hub.subscribe(self.teacher.id)
+            with mock.patch.object(realtime, 'get_db', return_value=db), \
+                    mock.patch.object(hub, 'publish'), mock.patch.object(realtime.time, 'sleep'):
+                with self.assertRaises(RuntimeError):
+                    hub.watch()
+            return await asyncio.wait_for(subscription.queue.get(), 1)
+
+        self.assertIsNone(asyncio.run(scenario()))
+        self.assertEqual([c.kwargs['resume_after'] for c in db.watch.call_args_list], [None, {'_data': 'a'}, None])
+
+
+class SearchTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher, self.other = self.make_user('t', role='teacher'), self.make_user('o', role='teacher')
+        self.student = self.make_user('s')
+
+    def search(self, **params):
+        response = self.client.get('/search/', params, **self.auth(self.student))
+        return response.status_code, response.json()
+
+    def test_ranked_prefix_and_teacher_filter(self):
+        in_description = Course(title='Data basics', description='Uses Python notebooks', created_by=self.teacher).save()
+        in_title = Course(title='Intro to Python', created_by=self.other).save()
+        Course(title='Pottery', created_by=self.teacher).save()
+        Assignment(title='Python quiz', course=in_description, created_by=self.teacher).save()
+        self.client.post('/upload-assignment/', {'title': 'Écrire un parseur', 'course_id': str(in_title.id)},
+                         content_type='application/json', **self.auth(self.other))
+
+        status, body = self.search(q='python ')
+        self.assertEqual([c['title'] for c in body['courses']], ['Intro to Python', 'Data basics'])
+        self.assertEqual(body['courses'][0]['created_by'], 'o')
+
+        # Last word still being typed: prefix match; accents do not matter
+        self.assertEqual([c['title'] for c in self.search(q='pyth')[1]['courses']], ['Intro to Python', 'Data basics'])
+        self.assertEqual([c['title'] for c in self.search(q='intro ecri')[1]['courses']], ['Intro to Python'])
+        self.assertEqual([c['title'] for c in self.search(q='python', teacher='t')[1]['courses']], ['Data basics'])
+        self.assertEqual(self.search(q='the ')[0], 400)
+
+    def test_pagination_and_rebuild(self):
+        for i in range(5):
+            Course(title=f'Algebra {i}', created_by=self.teacher).save()
+        Course.objects.update(set__search_terms=[], set__title_terms=[])
+        self.assertEqual(self.search(q='algebra')[1]['courses'], [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+
+        status, first = self.search(q='algebra', limit=3)
+        status, second = self.search(q='algebra', limit=3, cursor=first['next_cursor'])
+        titles = [c['title'] for c in first['courses'] + second['courses']]
+        self.assertEqual(titles, [f'Algebra {i}' for i in reversed(range(5))])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_only_the_first_candidates_are_ranked(self):
+        for i in range(5):
+            Course(title=f'Algebra {i}', created_by=self.teacher).save()
+        with mock.patch.object(search, 'MAX_CANDIDATES', 3):
+            courses, next_cursor = search.search('alg')
+        self.assertEqual((len(courses), next_cursor), (3, None))
+
+
+class BenchmarkCommandTests(MongoTestCase):
+    def test_seed_run_and_compare(self):
+        # The command connects to its own database, put the test connection back afterwards
+        self.addCleanup(lambda: (disconnect(), connect('lms_test', mongo_client_class=mongomock.MongoClient)))
+        baseline = f'{settings.BASE_DIR}/.bench-test-baseline.json'
+        self.addCleanup(lambda: os.path.exists(baseline) and os.remove(baseline))
+        options = dict(mongomock=True, students=10, teachers=2, courses=4, videos=1, video_size=4096, requests=2,
+                       endpoints='get_courses,my_courses,teacher_dashboard,sync_changes,search_courses,serve_video,hls_segment')
+        out = io.StringIO()
+        find = Collection.find
+        call_command('benchmark', save_baseline=baseline, stdout=out, **options)
+        self.assertIn('Seeded 13 users, 4 courses', out.getvalue())
+        self.assertIs(Collection.find, find)  # mongomock tracing is undone
+        with open(baseline) as f:
+            results = json.load(f)['results']
+        self.assertEqual(set(results), set(options['endpoints'].split(',')))
+        self.assertEqual(sum(r['errors'] for r in results.values()), 0)
+        self.assertIsNotNone(results['teacher_dashboard']['mongo_commands'])
+
+        call_command('benchmark', baseline=baseline, threshold=1000, stdout=out, **options)
+        self.assertIn('No regressions', out.getvalue())
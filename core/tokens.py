@@ -0,0 +1,64 @@
+# core/tokens.py
+# Issuing and verifying JWTs.
+#
+# Tokens are signed with the active key of JWT_SIGNING_KEYS and carry its id
+# in the `kid` header, so the key can be rotated without logging everybody
+# out: add a new kid, make it JWT_ACTIVE_KID, and drop the old one once its
+# tokens have expired. Tokens without a kid (issued before rotation
+# existed) are checked against SECRET_KEY while JWT_ACCEPT_UNVERSIONED is on.
+#
+# Verified tokens are kept in a bounded cache keyed by the exact token
+# string, until their `exp` (at most TOKEN_CACHE_TTL): a repeated token
+# costs a dict lookup instead of an HMAC + JSON decode.
+import time
+
+import jwt
+from django.conf import settings
+
+from core.utils import TTLCache
+
+ALGORITHM = 'HS256'
+SIGNING_KEYS = getattr(settings, 'JWT_SIGNING_KEYS', None) or {'default': settings.SECRET_KEY}
+ACTIVE_KID = getattr(settings, 'JWT_ACTIVE_KID', None) or next(iter(SIGNING_KEYS))
+ACCEPT_UNVERSIONED = getattr(settings, 'JWT_ACCEPT_UNVERSIONED', True)
+
+verified_cache = TTLCache(
+    maxsize=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 300),
+)
+
+
+def issue(payload):
+    return jwt.encode(payload, SIGNING_KEYS[ACTIVE_KID], algorithm=ALGORITHM, headers={'kid': ACTIVE_KID})
+
+
+def signing_key(token):
+    kid = jwt.get_unverified_header(token).get('kid')
+    if kid is None:
+        if not ACCEPT_UNVERSIONED:
+            raise jwt.InvalidTokenError('Token has no key id')
+        return settings.SECRET_KEY
+    if kid not in SIGNING_KEYS:
+        raise jwt.InvalidTokenError('Unknown key id')
+    return SIGNING_KEYS[kid]
+
+
+def verify(token):
+    """
+    Return the claims of a valid token, raise jwt.InvalidTokenError (or
+    ExpiredSignatureError) otherwise. The returned dict is shared with the
+    cache, do not modify it.
+    """
+    payload = verified_cache.get(token)
+    if payload is not None:
+        if payload.get('exp') is None or payload['exp'] > time.time():
+            return payload
+        verified_cache.pop(token)  # expired: decode again for the proper error
+
+    payload = jwt.decode(token, signing_key(token), algorithms=[ALGORITHM])
+    ttl = verified_cache.ttl
+    if payload.get('exp') is not None:
+        ttl = min(ttl, payload['exp'] - time.time())
+    if ttl > 0:
+        verified_cache.set(token, payload, ttl=ttl)
+    return payload
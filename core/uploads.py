@@ -0,0 +1,147 @@
+# core/uploads.py
+# Resumable, chunked video uploads straight into GridFS.
+#
+# A GridFS upload stream only lives inside one request, so instead we write
+# GridFS's own layout ourselves: each append stores fs.chunks documents
+# {files_id, n, data} for a pre-allocated file id, and `complete` writes the
+# fs.files document that makes the file visible. Until then nothing points at
+# the chunks, and `python manage.py cleanup_uploads` removes stale ones.
+#
+# Integrity is checked per append: a sha256 digest cannot be carried from one
+# request to the next, so instead of hashing the whole file again on
+# complete, an upload that declares a sha256 must send an Upload-Checksum
+# with every append, and completes once all of its bytes were verified.
+import datetime
+import hashlib
+
+from bson import Binary
+from django.conf import settings
+from mongoengine.connection import get_db
+from mongoengine.queryset.visitor import Q
+
+from core.models import UploadSession
+
+GRIDFS_CHUNK_SIZE = 255 * 1024
+FINALIZE_TIMEOUT = datetime.timedelta(seconds=getattr(settings, 'UPLOAD_FINALIZE_TIMEOUT', 10 * 60))
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def gridfs_collections(bucket='fs'):
+    db = get_db()
+    return db[f'{bucket}.files'], db[f'{bucket}.chunks']
+
+
+def read_exactly(stream, size):
+    # WSGI streams may return short reads, keep reading until size bytes or EOF
+    parts, remaining = [], size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def check_append(session, offset, length, expected_sha256=None):
+    if session.status == UploadSession.FINALIZING:
+        raise UploadError('Upload is being completed', status=409)
+    if session.status != UploadSession.UPLOADING:
+        raise UploadError('Upload already completed', status=409)
+    if offset != session.offset:
+        raise UploadError(f'Offset mismatch, resume from {session.offset}', status=409)
+    if length <= 0 or offset + length > session.size:
+        raise UploadError('Chunk exceeds declared upload size')
+    if session.sha256 and not expected_sha256:
+        raise UploadError('Upload-Checksum is required, the upload declared a sha256')
+    # Only the final append may end in the middle of a GridFS chunk
+    if (offset + length) % session.chunk_size and offset + length != session.size:
+        raise UploadError(f'Chunks must be a multiple of {session.chunk_size} bytes')
+
+
+def append_chunks(session, stream, offset, length, expected_sha256=None):
+    """
+    Stream `length` bytes from `stream` into fs.chunks at `offset`, one GridFS
+    chunk in memory at a time. Returns the new offset.
+    """
+    check_append(session, offset, length, expected_sha256)
+    _, chunks = gridfs_collections()
+    digest = hashlib.sha256()
+    first_n = n = offset // session.chunk_size
+    remaining = length
+
+    while remaining:
+        data = read_exactly(stream, min(session.chunk_size, remaining))
+        if not data:
+            break
+        digest.update(data)
+        # Upsert keeps retries of the same append idempotent
+        chunks.replace_one({'files_id': session.file_id, 'n': n},
+                           {'files_id': session.file_id, 'n': n, 'data': Binary(data)}, upsert=True)
+        remaining -= len(data)
+        n += 1
+
+    if remaining or (expected_sha256 and digest.hexdigest() != expected_sha256.lower()):
+        chunks.delete_many({'files_id': session.file_id, 'n': {'$gte': first_n}})
+        raise UploadError('Incomplete chunk' if remaining else 'Chunk checksum mismatch')
+
+    # Conditional on the old offset, so two concurrent appends cannot both win
+    new_offset = offset + length
+    updated = UploadSession.objects(id=session.id, offset=offset).update_one(
+        set__offset=new_offset, inc__verified=length if expected_sha256 else 0,
+        set__updated_at=datetime.datetime.utcnow())
+    if not updated:
+        raise UploadError('Concurrent append, retry from the current offset', status=409)
+    return new_offset
+
+
+def claim_finalize(session):
+    """
+    Atomically move the session from uploading to finalizing, so of concurrent
+    complete requests only one creates the course. A finalizing session whose
+    request died is taken over after FINALIZE_TIMEOUT. Returns the session as
+    it was before the claim (its status tells a takeover), or None.
+    """
+    now = datetime.datetime.utcnow()
+    claimable = Q(status=UploadSession.UPLOADING) | Q(status=UploadSession.FINALIZING,
+                                                      updated_at__lt=now - FINALIZE_TIMEOUT)
+    return UploadSession.objects(Q(id=session.id) & claimable).modify(
+        set__status=UploadSession.FINALIZING, set__updated_at=now, new=False)
+
+
+def release_finalize(session):
+    # Finalizing failed (incomplete upload, bad checksum): appends may continue
+    UploadSession.objects(id=session.id, status=UploadSession.FINALIZING).update_one(
+        set__status=UploadSession.UPLOADING, set__updated_at=datetime.datetime.utcnow())
+
+
+def finalize_file(session):
+    """Write the fs.files document that turns the uploaded chunks into a GridFS file."""
+    if session.offset != session.size:
+        raise UploadError(f'Upload incomplete: {session.offset} of {session.size} bytes')
+    # Every byte was checked on append, no need to read the file back
+    if session.sha256 and session.verified != session.size:
+        raise UploadError(f'Only {session.verified} of {session.size} bytes were verified')
+
+    files, _ = gridfs_collections()
+    files.replace_one({'_id': session.file_id}, {
+        '_id': session.file_id,
+        'length': session.size,
+        'chunkSize': session.chunk_size,
+        'uploadDate': datetime.datetime.utcnow(),
+        'filename': session.filename,
+        'metadata': {'sha256': session.sha256} if session.sha256 else {},
+    }, upsert=True)
+    return session.file_id
+
+
+def discard_upload(session):
+    files, chunks = gridfs_collections()
+    chunks.delete_many({'files_id': session.file_id})
+    files.delete_one({'_id': session.file_id})  # written if it died while finalizing
+    session.delete()
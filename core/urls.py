@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from core.views import *
 
@@ -8,14 +9,28 @@ urlpatterns = [
      path('login-password/', login_with_password),
     path('dashboard/', dashboard),
     path('upload-course/', upload_course),
+    path('upload-course/init/', upload_course_init),
+    path('upload-course/<str:upload_id>/', upload_course_chunk),
+    path('upload-course/<str:upload_id>/complete/', upload_course_complete),
     path('teacher-dashboard/', teacher_dashboard),
     path('courses/', get_courses),
+    path('search/', search_courses),
     path('enroll/', enroll_course),
+    path('bulk-enroll/', bulk_enroll),
     path('my-courses/', my_courses),
     path('upload-assignment/', upload_assignment),
     path('list-assignments/', list_assignments),
     path('submit-assignment/', submit_assignment),
     path('view-submissions/', view_submissions),
+    path('sync/', sync_changes),
+    path('teacher-events/', teacher_events),
     path('admin-dashboard/', admin_dashboard),
-    path('serve_video/<str:video_id>', serve_video, name='serve_video'),
+    path('admin-dashboard/mongo-pool/', mongo_pool),
+    path('admin-dashboard/metrics/', performance_metrics),
+    path('serve_video/<str:video_id>',
+         serve_video_async if settings.VIDEO_ASYNC_SERVING else serve_video,
+         name='serve_video'),
+    path('videos/<str:video_id>/playlist.m3u8', hls_playlist),
+    path('videos/<str:video_id>/init.mp4', hls_init_segment),
+    path('videos/<str:video_id>/segments/<int:index>.m4s', hls_segment),
 ]
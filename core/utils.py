@@ -1,24 +1,143 @@
 # core/utils.py
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
 import jwt
 from django.conf import settings
 from django.http import JsonResponse
-from core.models import User
+from core.models import User, Enrollment
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        # ttl overrides the cache default for this entry
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+# Authenticated users by id, so most requests skip the User lookup.
+# Entries are checked against the token's `ver` claim; bumping User.token_version
+# revokes old tokens everywhere once the (short) TTL of other processes runs out.
+user_cache = TTLCache(
+    maxsize=getattr(settings, 'USER_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'USER_CACHE_TTL', 60),
+)
+
+
+def invalidate_user(user_id):
+    user_cache.pop(str(user_id))
 
-def jwt_auth(view_func):
+
+class TokenUser:
+    """Principal built from token claims only, for views that need just id / username / role."""
+
+    def __init__(self, payload):
+        self.id = payload['id']
+        self.pk = payload['id']
+        self.username = payload.get('username')
+        self.email = payload.get('email')
+        self.role = payload['role']
+
+
+def load_user(payload):
+    user_id = str(payload['id'])
+    version = payload.get('ver', 0)
+
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.objects(id=user_id).first()
+        if not user:
+            return None
+        user_cache.set(user_id, user)
+    if user.token_version != version:
+        raise jwt.InvalidTokenError('Token revoked')
+    return user
+
+
+def jwt_auth(view_func=None, claims_only=False):
+    """
+    Authenticate the request from its Bearer token and set request.user.
+
+    @jwt_auth(claims_only=True) skips the database entirely when the token carries
+    a role: request.user is then a TokenUser, not a User document. Not for views
+    gated on a role, a demoted user's token would keep its old role until expiry.
+    """
+    if view_func is None:
+        return lambda func: jwt_auth(func, claims_only=claims_only)
+
+    @wraps(view_func)
     def wrapper(request, *args, **kwargs):
         token = request.headers.get('Authorization')
         if not token:
             return JsonResponse({'error': 'No token provided'}, status=401)
         try:
+            from core import tokens  # core.tokens imports this module
             token = token.replace('Bearer ', '')
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            user = User.objects(id=payload['id']).first()
+            payload = tokens.verify(token)
+            if claims_only and 'role' in payload:
+                user = TokenUser(payload)
+            else:
+                user = load_user(payload)
             if not user:
                 return JsonResponse({'error': 'User not found'}, status=404)
             request.user = user
-            return view_func(request, *args, **kwargs)
         except jwt.ExpiredSignatureError:
             return JsonResponse({'error': 'Token expired'}, status=401)
         except jwt.InvalidTokenError:
             return JsonResponse({'error': 'Invalid token'}, status=401)
+        return view_func(request, *args, **kwargs)
     return wrapper
+
+# Batched lookups, used instead of per-row queries / dereferencing in listing views
+def enrollment_counts(course_ids):
+    # One $group over Enrollment instead of a count() per course
+    pipeline = [
+        {'$match': {'course': {'$in': list(course_ids)}}},
+        {'$group': {'_id': '$course', 'count': {'$sum': 1}}},
+    ]
+    return {row['_id']: row['count'] for row in Enrollment.objects.aggregate(pipeline)}
+
+
+def usernames_by_id(user_ids):
+    # One $in query instead of dereferencing every ReferenceField
+    users = User.objects(id__in=list(set(user_ids))).only('username').as_pymongo()
+    return {user['_id']: user['username'] for user in users}
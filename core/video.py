@@ -0,0 +1,271 @@
+# core/video.py
+# Helpers for streaming GridFS videos with HTTP range support.
+# Memory per request stays bounded by the GridFS chunk size: we never read
+# more than one chunk at a time, whatever range the client asks for.
+# The async variants offload each chunk read to a worker thread, so under
+# ASGI a viewer only holds a thread while a chunk is being fetched.
+import re
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+# Open-ended requests like "bytes=0-" are answered with at most this many bytes,
+# the player simply asks for the next range when it needs more.
+MAX_OPEN_RANGE = getattr(settings, 'VIDEO_MAX_OPEN_RANGE', 8 * 1024 * 1024)
+# More ranges than this in one request is almost always abuse, serve the whole file instead
+MAX_RANGES = getattr(settings, 'VIDEO_MAX_RANGES', 16)
+DEFAULT_CONTENT_TYPE = 'video/mp4'
+# A GridFS file id always names the same bytes (a re-upload or remux gets a new id),
+# so browsers and proxies may keep video content for good without revalidating.
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def video_etag(file):
+    # GridFS files are immutable, so id + length + upload time identifies the content
+    md5 = getattr(file, '_file', {}).get('md5')
+    if md5:
+        return f'"{file._id}-{md5}"'
+    return f'"{file._id}-{file.length}-{int(file.upload_date.timestamp())}"'
+
+
+def video_content_type(file):
+    metadata = getattr(file, 'metadata', None) or {}
+    return metadata.get('contentType') or DEFAULT_CONTENT_TYPE
+
+
+def parse_range_header(header, length, max_open_range=MAX_OPEN_RANGE):
+    """
+    Parse a "Range: bytes=..." header into a list of inclusive (start, end) pairs.
+    Returns None when the header should be ignored (malformed or unsupported unit),
+    raises RangeNotSatisfiable when no range overlaps the file.
+    """
+    if not header or not header.strip().startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header.strip()[len('bytes='):].split(','):
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start, end = max(length - suffix, 0), length - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= length:
+                continue
+            if last:
+                end = min(int(last), length - 1)
+            else:
+                end = min(start + max_open_range, length) - 1
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges = coalesce_ranges(ranges)
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def coalesce_ranges(ranges):
+    # Merge overlapping or adjacent ranges so we never send the same bytes twice
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Only strong validators may be used with If-Range
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(last_modified) <= since
+
+
+def chunk_plan(start, end, chunk_size):
+    """Yield (offset, size) pieces covering [start, end], aligned to GridFS chunk boundaries."""
+    offset = start
+    while offset <= end:
+        size = min(chunk_size - offset % chunk_size, end - offset + 1)
+        yield offset, size
+        offset += size
+
+
+def iter_range(file, start, end):
+    file.seek(start)
+    for _, size in chunk_plan(start, end, file.chunk_size):
+        data = file.read(size)
+        if not data:
+            break
+        yield data
+
+
+def part_header(boundary, content_type, start, end, length):
+    return (
+        f'--{boundary}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Range: bytes {start}-{end}/{length}\r\n\r\n'
+    ).encode()
+
+
+def closing_boundary(boundary):
+    return f'--{boundary}--\r\n'.encode()
+
+
+def iter_multipart(file, ranges, boundary, content_type):
+    for start, end in ranges:
+        yield part_header(boundary, content_type, start, end, file.length)
+        yield from iter_range(file, start, end)
+        yield b'\r\n'
+    yield closing_boundary(boundary)
+
+
+def multipart_length(file, ranges, boundary, content_type):
+    total = len(closing_boundary(boundary))
+    for start, end in ranges:
+        total += len(part_header(boundary, content_type, start, end, file.length))
+        total += end - start + 1 + 2
+    return total
+
+
+class VideoPlan:
+    """What to send for a video request: status, headers and the byte ranges of the body."""
+
+    def __init__(self, status, headers, ranges=None, boundary=None):
+        self.status = status
+        self.headers = headers
+        self.ranges = ranges or []
+        self.boundary = boundary
+
+
+def plan_video_response(request, file):
+    length = file.length
+    content_type = video_content_type(file)
+    last_modified = file.upload_date.timestamp()
+    etag = video_etag(file)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': IMMUTABLE_CACHE,
+    }
+
+    # If-None-Match / If-Modified-Since: 304 before touching any chunk
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if not_modified is not None:
+        return VideoPlan(not_modified.status_code, headers)
+
+    range_header = request.headers.get('Range')
+    ranges = None
+    if range_header and if_range_matches(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(range_header, length)
+        except RangeNotSatisfiable:
+            headers['Content-Range'] = f'bytes */{length}'
+            return VideoPlan(416, headers)
+
+    if not ranges:
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(length)
+        return VideoPlan(200, headers, [(0, length - 1)] if length else [])
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(end - start + 1)
+        headers['Content-Range'] = f'bytes {start}-{end}/{length}'
+        return VideoPlan(206, headers, ranges)
+
+    boundary = uuid.uuid4().hex
+    headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    headers['Content-Length'] = str(multipart_length(file, ranges, boundary, content_type))
+    return VideoPlan(206, headers, ranges, boundary)
+
+
+def video_body(file, plan):
+    if plan.boundary:
+        return iter_multipart(file, plan.ranges, plan.boundary, video_content_type(file))
+    return (data for start, end in plan.ranges for data in iter_range(file, start, end))
+
+
+def video_response(request, file, body=video_body):
+    plan = plan_video_response(request, file)
+    if plan.status not in (200, 206) or request.method == 'HEAD':
+        response = HttpResponse(status=plan.status)
+    else:
+        response = StreamingHttpResponse(body(file, plan), status=plan.status)
+    for header, value in plan.headers.items():
+        response[header] = value
+    return response
+
+
+# Async (ASGI) delivery
+
+def _run_blocking(func, *args):
+    # thread_sensitive=False: chunk reads go to the shared executor instead of
+    # queueing behind every other request on the single sync thread
+    return sync_to_async(func, thread_sensitive=False)(*args)
+
+
+async def aiter_range(file, start, end):
+    await _run_blocking(file.seek, start)
+    for _, size in chunk_plan(start, end, file.chunk_size):
+        data = await _run_blocking(file.read, size)
+        if not data:
+            break
+        yield data
+
+
+async def aiter_multipart(file, ranges, boundary, content_type):
+    for start, end in ranges:
+        yield part_header(boundary, content_type, start, end, file.length)
+        async for data in aiter_range(file, start, end):
+            yield data
+        yield b'\r\n'
+    yield closing_boundary(boundary)
+
+
+async def aiter_video_body(file, plan):
+    if plan.boundary:
+        async for data in aiter_multipart(file, plan.ranges, plan.boundary, video_content_type(file)):
+            yield data
+        return
+    for start, end in plan.ranges:
+        async for data in aiter_range(file, start, end):
+            yield data
+
+
+async def async_open_video(fs, file_id):
+    return await _run_blocking(fs.get, file_id)
+
+
+def async_video_response(request, file):
+    return video_response(request, file, body=aiter_video_body)
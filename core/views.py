@@ -1,23 +1,38 @@
 import jwt
 import datetime
-import bcrypt
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from core.models import *
 import json
+import csv
+import logging
+import io
 from django.conf import settings
-from core.utils import jwt_auth
+from core.utils import jwt_auth, user_cache, usernames_by_id
+from core.pagination import paginate, PaginationError
+from core import analytics, catalog_cache, jobs, log, metrics, passwords, realtime, search, sync, tokens
+from core.http_cache import bump, conditional
+from core.uploads import GRIDFS_CHUNK_SIZE, UploadError, append_chunks, claim_finalize, finalize_file, release_finalize
+from mongoengine.errors import NotUniqueError
+from mongoengine.queryset.visitor import Q
+from pymongo.errors import BulkWriteError
+from core.video import IMMUTABLE_CACHE, video_response, async_open_video, async_video_response
+from core.hls import PLAYLIST_CONTENT_TYPE, render_playlist
 from django.http import FileResponse
-from pymongo import MongoClient
-import gridfs
+from core.mongo import get_fs, video_fs, pool_summary
 from bson import ObjectId
 from django.http import StreamingHttpResponse, HttpResponseNotFound
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from gridfs import GridFS
-from mongoengine.connection import get_db
 
 
-SECRET_KEY = settings.SECRET_KEY  # use env variable later
+logger = logging.getLogger(__name__)
+
+
+def password_pool_busy():
+    # bcrypt pool saturated (core/passwords.py): shed load instead of queueing
+    response = JsonResponse({'error': 'Server busy, please retry'}, status=503)
+    response['Retry-After'] = str(passwords.RETRY_AFTER)
+    return response
 
 
 @csrf_exempt
@@ -38,9 +53,13 @@ def register(request):
         if User.objects(email=email).first() or User.objects(username=username).first():
             return JsonResponse({'error': 'Email or Username already exists'}, status=400)
 
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        user = User(username=username, email=email, password=hashed_pw.decode(), role=role)
+        try:
+            hashed_pw = passwords.hash_password(password)
+        except passwords.PoolBusy:
+            return password_pool_busy()
+        user = User(username=username, email=email, password=hashed_pw, role=role)
         user.save()
+        analytics.record_registration(user)
 
         return JsonResponse({'message': 'User registered successfully'})
 
@@ -55,14 +74,14 @@ def send_magic_link(request):
         if not user:
             return JsonResponse({'error': 'User not found'}, status=404)
 
-        token = jwt.encode({
+        token = tokens.issue({
             'id': str(user.id),
             'email': user.email,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
-        }, SECRET_KEY, algorithm='HS256')
+        })
 
         magic_link = f"http://localhost:8000/verify-token/?token={token}"
-        print(f"✨ Magic login link for {email}: {magic_link}")  # ✅ Console log
+        logger.info("Magic login link for %s: %s", email, magic_link)  # ✅ Console log
 
         return JsonResponse({'message': 'Magic link sent (check console)'})
 
@@ -74,7 +93,7 @@ def verify_token(request):
         return JsonResponse({'error': 'Token missing'}, status=400)
 
     try:
-        decoded = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        decoded = tokens.verify(token)
         email = decoded.get('email')
 
         user = User.objects(email=email).first()
@@ -87,9 +106,10 @@ def verify_token(request):
             'email': user.email,
             'username': user.username,
             'role': user.role,
+            'ver': user.token_version,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
         }
-        new_token = jwt.encode(new_payload, SECRET_KEY, algorithm='HS256')
+        new_token = tokens.issue(new_payload)
 
         return JsonResponse({'token': new_token})
 
@@ -108,22 +128,29 @@ def login_with_password(request):
 
         user = User.objects(username=username).first()  # ✅ not email
 
-        if user and bcrypt.checkpw(password.encode(), user.password.encode()):
+        try:
+            valid = user is not None and passwords.check_password(password, user.password)
+        except passwords.PoolBusy:
+            return password_pool_busy()
+
+        if valid:
+            passwords.rehash_if_needed(user, password)  # BCRYPT_ROUNDS changed since this hash
             payload = {
                 'id': str(user.id),
                 'username': user.username,
                 'email': user.email,
                 'role': user.role,
+                'ver': user.token_version,
                 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
             }
-            token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+            token = tokens.issue(payload)
             return JsonResponse({'token': token})
         else:
             return JsonResponse({'error': 'Invalid username or password'}, status=401)
 
 
 @csrf_exempt
-@jwt_auth
+@jwt_auth(claims_only=True)
 def dashboard(request):
     user = request.user
     return JsonResponse({
@@ -151,9 +178,7 @@ def upload_course(request):
         try:
             video_id = None
             if video_file:
-                db = get_db()
-                fs = GridFS(db)
-                video_id = fs.put(video_file, filename=video_file.name)
+                video_id = get_fs().put(video_file, filename=video_file.name)
 
             course = Course(
                 title=title,
@@ -163,41 +188,178 @@ def upload_course(request):
                 video_id=video_id if video_id else None
             )
             course.save()
+            analytics.record_course_created(course)
+            bump('courses')
+            if video_id:
+                jobs.enqueue('process_video', course_id=str(course.id))
             return JsonResponse({'message': 'Course uploaded successfully'})
 
         except Exception as e:
-            print("UPLOAD ERROR:", str(e))
+            logger.exception("Course upload failed")
             return JsonResponse({'error': str(e)}, status=500)
 
 
+#CHUNKED, RESUMABLE VIDEO UPLOAD FOR LARGE RECORDINGS: init -> append (repeat) -> complete
+UPLOAD_MAX_SIZE = getattr(settings, 'UPLOAD_MAX_SIZE', 20 * 1024 ** 3)
+
+
+def get_upload_session(request, upload_id):
+    if not ObjectId.is_valid(upload_id):
+        return None
+    return UploadSession.objects(id=upload_id, teacher=request.user.id).first()
+
+
+def upload_status(session):
+    return {
+        'upload_id': str(session.id),
+        'offset': session.offset,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'status': session.status,
+    }
+
+
+@csrf_exempt
+@jwt_auth
+def upload_course_init(request):
+    if request.method == 'POST':
+        if request.user.role != 'teacher':
+            return JsonResponse({'error': 'Only teachers can upload courses'}, status=403)
+
+        data = json.loads(request.body)
+        title = data.get('title')
+        filename = data.get('filename')
+        size = data.get('size')
+
+        if not title:
+            return JsonResponse({'error': 'Title is required'}, status=400)
+        if not filename or not isinstance(size, int) or not 0 < size <= UPLOAD_MAX_SIZE:
+            return JsonResponse({'error': 'filename and a valid size are required'}, status=400)
+
+        session = UploadSession(
+            teacher=request.user,
+            title=title,
+            description=data.get('description'),
+            youtube_link=data.get('youtube_link') or None,
+            filename=filename,
+            size=size,
+            chunk_size=GRIDFS_CHUNK_SIZE,
+            sha256=data.get('sha256') or None
+        )
+        session.save()
+        return JsonResponse(upload_status(session), status=201)
+
+
+# GET: current offset (to resume). PUT: raw bytes at the offset given in the Upload-Offset
+# header, optionally verified against an Upload-Checksum (sha256 hex) header.
+@csrf_exempt
+@jwt_auth
+def upload_course_chunk(request, upload_id):
+    session = get_upload_session(request, upload_id)
+    if not session:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+
+    if request.method == 'GET':
+        return JsonResponse(upload_status(session))
+
+    if request.method in ('PUT', 'POST'):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Upload-Offset and Content-Length headers are required'}, status=400)
+
+        try:
+            session.offset = append_chunks(session, request, offset, length,
+                                           request.headers.get('Upload-Checksum'))
+        except UploadError as e:
+            session.reload()
+            return JsonResponse({'error': str(e), **upload_status(session)}, status=e.status)
+        return JsonResponse(upload_status(session))
+
+
 @csrf_exempt
 @jwt_auth
+def upload_course_complete(request, upload_id):
+    if request.method == 'POST':
+        session = get_upload_session(request, upload_id)
+        if not session:
+            return JsonResponse({'error': 'Upload not found'}, status=404)
+        if session.status == UploadSession.COMPLETE:
+            return JsonResponse({'message': 'Course uploaded successfully', 'course_id': str(session.course.id)})
+
+        # Only one of concurrent (or retried) complete requests gets past the claim
+        claimed = claim_finalize(session)
+        if claimed is None:
+            session.reload()
+            if session.status == UploadSession.COMPLETE:
+                return JsonResponse({'message': 'Course uploaded successfully', 'course_id': str(session.course.id)})
+            return JsonResponse({'error': 'Upload is being completed, retry shortly', **upload_status(session)},
+                                status=409)
+
+        try:
+            video_id = finalize_file(session)
+        except UploadError as e:
+            release_finalize(session)
+            return JsonResponse({'error': str(e), **upload_status(session)}, status=e.status)
+
+        # The Course only appears once the whole video is in GridFS. A request
+        # that took over a stale claim reuses the course its predecessor saved.
+        course = None
+        if claimed.status == UploadSession.FINALIZING:
+            course = Course.objects(created_by=request.user.id, video_id=video_id).first()
+        if course is None:
+            course = Course(
+                title=session.title,
+                description=session.description,
+                created_by=request.user,
+                youtube_link=session.youtube_link,
+                video_id=video_id
+            )
+            course.save()
+        session.update(set__status=UploadSession.COMPLETE, set__course=course,
+                       set__updated_at=datetime.datetime.utcnow())
+        analytics.record_course_created(course)
+        bump('courses')
+        jobs.enqueue('process_video', course_id=str(course.id))
+        return JsonResponse({'message': 'Course uploaded successfully', 'course_id': str(course.id)})
+
+
+@csrf_exempt
+@jwt_auth
+@conditional(lambda request: ['courses', 'enrollments'])
 def teacher_dashboard(request):
     if request.method == 'GET':
         teacher = request.user
         teacher_id = teacher.id
 
         # Get courses created by the logged-in teacher
-        courses = Course.objects(created_by=teacher)
+        courses = list(Course.objects(created_by=teacher).no_dereference())
+
+        # Rosters in constant queries: every enrollment of these courses in one query,
+        # then one $in for the usernames (not one User query per student)
+        enrollments = Enrollment.objects(course__in=[c.id for c in courses]).only('course', 'student').as_pymongo()
+        rosters = {course.id: [] for course in courses}
+        for enrollment in enrollments:
+            rosters[enrollment['course']].append(enrollment['student'])
+        usernames = usernames_by_id(student_id for roster in rosters.values() for student_id in roster)
 
         # Format course data
         uploaded_courses = []
         enrolled_students = []
 
         for course in courses:
-            enroll_count = Enrollment.objects(course=course).count()
             uploaded_courses.append({
                 'id': str(course.id),
                 'title': course.title,
                 'description': course.description,
                 'created_at': course.created_at.strftime('%Y-%m-%d %H:%M'),
-                'enrollments': enroll_count,
+                'enrollments': course.enrollment_count,
                 'video_id': str(course.video_id) if course.video_id else None,
                 'youtube_link': course.youtube_link
             })
 
-            enrollments = Enrollment.objects(course=course)
-            students = [enroll.student.username for enroll in enrollments]
+            students = [usernames[student_id] for student_id in rosters[course.id] if student_id in usernames]
 
             enrolled_students.append({
                 'course_id': str(course.id),
@@ -213,37 +375,90 @@ def teacher_dashboard(request):
 
         
 #ALL USERS CAN VIEW ALL COURSES
+# Output key -> Course fields it needs, used for ?fields= projection
+COURSE_LIST_FIELDS = {
+    'id': ['id'],
+    'title': ['title'],
+    'description': ['description'],
+    'created_by': ['created_by'],
+    'created_at': ['created_at'],
+    'video_url': ['video_id'],
+    'youtube_link': ['youtube_link'],
+    'enrollments': ['enrollment_count'],
+    'hls_url': ['video_id', 'video_segmented'],
+}
+
+
+def video_url(video_id):
+    return f"http://localhost:8000/serve_video/{video_id}" if video_id else None
+
+
+def hls_url(course):
+    return f"http://localhost:8000/videos/{course.video_id}/playlist.m3u8" if course.video_segmented else None
+
+
 @csrf_exempt
-@jwt_auth
+@jwt_auth(claims_only=True)
+@conditional(lambda request: ['courses', 'enrollments'])
 def get_courses(request):
     if request.method == 'GET':
         try:
-            print("Request received from:", request.user.username)  # Debug print
-            courses = Course.objects()
-            course_list = []
-            for course in courses:
-                enroll_count = Enrollment.objects(course=course).count()
-                video_url = f"http://localhost:8000/serve_video/{course.video_id}" if course.video_id else None
-
-                course_list.append({
-                    'id': str(course.id),
-                    'title': course.title,
-                    'description': course.description,
-                    'created_by': course.created_by.username,
-                    'created_at': course.created_at.strftime('%Y-%m-%d %H:%M'),
-                    'video_url': video_url,
-                    'youtube_link': course.youtube_link,
-                    'enrollments': enroll_count
-                })
-            return JsonResponse({'courses': course_list})
+            logger.debug("Catalog requested by %s", request.user.username)
+            # Same for every user: served from the shared catalog cache, built on a miss
+            body = catalog_cache.get_or_build(request, lambda: build_course_list(request))
+            return HttpResponse(body, content_type='application/json')
+        except PaginationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
-            print("ERROR IN GET COURSES:", str(e))
+            logger.exception("get_courses failed")
             return JsonResponse({'error': str(e)}, status=500)
-        
-client = MongoClient('mongodb://localhost:27017/')
-db = client['lms']
-fs = gridfs.GridFS(db)
 
+
+def build_course_list(request):
+    # Constant number of queries: one page of courses (with their enrollment counter) and one $in for creators
+    page = paginate(request, Course.objects.no_dereference(), COURSE_LIST_FIELDS)
+    creators = usernames_by_id(c.created_by.id for c in page.items) if 'created_by' in page.fields else {}
+
+    course_list = [page.row({
+        'id': lambda: str(course.id),
+        'title': lambda: course.title,
+        'description': lambda: course.description,
+        'created_by': lambda: creators.get(course.created_by.id),
+        'created_at': lambda: course.created_at.strftime('%Y-%m-%d %H:%M'),
+        'video_url': lambda: video_url(course.video_id),
+        'youtube_link': lambda: course.youtube_link,
+        'enrollments': lambda: course.enrollment_count,
+        'hls_url': lambda: hls_url(course)
+    }) for course in page.items]
+    return page.payload('courses', course_list)
+
+
+#ALL USERS CAN SEARCH COURSES: RANKED, PREFIX (AUTOCOMPLETE), ?teacher=, PAGINATED (core/search.py)
+@csrf_exempt
+@jwt_auth(claims_only=True)
+def search_courses(request):
+    if request.method == 'GET':
+        try:
+            rows, next_cursor = search.search(request.GET.get('q', ''), teacher=request.GET.get('teacher'),
+                                              limit=request.GET.get('limit'), cursor=request.GET.get('cursor'))
+        except (search.SearchError, PaginationError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        creators = usernames_by_id(row['created_by'] for row in rows)
+        results = [{
+            'id': str(row['_id']),
+            'title': row.get('title'),
+            'description': row.get('description'),
+            'created_by': creators.get(row['created_by']),
+            'created_at': row['created_at'].strftime('%Y-%m-%d %H:%M') if row.get('created_at') else None,
+            'video_url': video_url(row.get('video_id')),
+            'youtube_link': row.get('youtube_link'),
+            'enrollments': row.get('enrollment_count', 0),
+            'hls_url': f"http://localhost:8000/videos/{row['video_id']}/playlist.m3u8" if row.get('video_segmented') else None,
+            'score': row['score'],
+        } for row in rows]
+        return JsonResponse({'courses': results, 'next_cursor': next_cursor})
+        
 from django.http import FileResponse, HttpResponse, HttpResponseNotFound, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson.objectid import ObjectId
@@ -251,31 +466,65 @@ from bson.objectid import ObjectId
 @csrf_exempt
 def serve_video(request, video_id):
     try:
-        file = fs.get(ObjectId(video_id))
-        # Support for video seek (Range header)
-        start = 0
-        end = file.length - 1
-
-        range_header = request.headers.get('Range')
-        if range_header:
-            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-            if match:
-                start = int(match.group(1))
-                if match.group(2):
-                    end = int(match.group(2))
-
-        file.seek(start)
-        chunk = file.read(end - start + 1)
-        response = HttpResponse(chunk, content_type='video/mp4')
-        response['Content-Length'] = end - start + 1
-        response['Content-Range'] = f'bytes {start}-{end}/{file.length}'
-        response['Accept-Ranges'] = 'bytes'
-        response.status_code = 206 if range_header else 200
-        return response
+        file = video_fs().get(ObjectId(video_id))
+    except Exception as e:
+        logger.warning("Video %s not served: %s", video_id, e)
+        return HttpResponseNotFound('Video not found')
 
+    # Streams chunk-aligned pieces, supports Range / multi-range / If-Range
+    return video_response(request, file)
+
+# Async version for ASGI deployments (set VIDEO_ASYNC_SERVING = True).
+# No csrf_exempt here: it wraps the view in a sync function on Django 4.2,
+# and GET requests are not CSRF checked anyway.
+async def serve_video_async(request, video_id):
+    try:
+        file = await async_open_video(video_fs(), ObjectId(video_id))
     except Exception as e:
-        print("Error serving video:", str(e))
+        logger.warning("Video %s not served: %s", video_id, e)
+        return HttpResponseNotFound('Video not found')
+
+    return async_video_response(request, file)
+
+#SEGMENTED (HLS) PLAYBACK
+# A rendition never changes for a given video_id (a new upload gets a new id),
+# so playlist and segments can be cached forever by browsers and proxies.
+def get_rendition(video_id):
+    if not ObjectId.is_valid(video_id):
+        return None
+    return VideoRendition.objects(video_id=ObjectId(video_id)).first()
+
+
+def rendition_file_response(request, file_id):
+    file = video_fs().get(file_id)
+    return video_response(request, file)
+
+
+@csrf_exempt
+def hls_playlist(request, video_id):
+    rendition = get_rendition(video_id)
+    if not rendition:
         return HttpResponseNotFound('Video not found')
+    response = HttpResponse(render_playlist(rendition), content_type=PLAYLIST_CONTENT_TYPE)
+    response['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
+
+@csrf_exempt
+def hls_init_segment(request, video_id):
+    rendition = get_rendition(video_id)
+    if not rendition or not rendition.init_id:
+        return HttpResponseNotFound('Segment not found')
+    return rendition_file_response(request, rendition.init_id)
+
+
+@csrf_exempt
+def hls_segment(request, video_id, index):
+    rendition = get_rendition(video_id)
+    if not rendition or index >= len(rendition.segment_ids):
+        return HttpResponseNotFound('Segment not found')
+    # Direct lookup by index, no seeking inside the original file
+    return rendition_file_response(request, rendition.segment_ids[index])
 
 #STUDENTS ENROLL IN A COURSE
 @csrf_exempt
@@ -286,46 +535,202 @@ def enroll_course(request):
         course_id = data['course_id']
 
         try:
-            course = Course.objects.get(id=course_id)
+            course = Course.objects.only('id').get(id=course_id)
         except Course.DoesNotExist:
             return JsonResponse({'error': 'Course not found'}, status=404)
 
-        # Prevent duplicate enrollments
-        if Enrollment.objects(course=course, student=request.user).first():
+        # Prevent duplicate enrollments: a single insert, the unique (student, course)
+        # index rejects duplicates atomically, even for concurrent double clicks
+        try:
+            Enrollment(course=course, student=request.user).save(force_insert=True)
+        except NotUniqueError:
             return JsonResponse({'error': 'Already enrolled'}, status=400)
 
-        Enrollment(course=course, student=request.user).save()
+        course = Course.objects(id=course_id).modify(inc__enrollment_count=1, set__updated_at=datetime.datetime.utcnow(), new=True)
+        if course is None:
+            # Deleted since the lookup, after its enrollments were: drop ours too
+            Enrollment.objects(course=course_id, student=request.user).delete()
+            return JsonResponse({'error': 'Course not found'}, status=404)
+        analytics.record_enrollment(course)
+        bump('enrollments', f'student:{request.user.id}')
         return JsonResponse({'message': 'Enrolled successfully'})
 
 
+#TEACHER (OWN COURSES) OR ADMIN CAN ENROLL A WHOLE COHORT AT ONCE
+BULK_ENROLL_BATCH_SIZE = 500
+DUPLICATE_KEY = 11000
+
+
+def resolve_students(identifiers):
+    # One $in query for a whole batch; each identifier may be a user id or a username
+    ids = [ObjectId(i) for i in identifiers if ObjectId.is_valid(i)]
+    users = User.objects(Q(id__in=ids) | Q(username__in=identifiers)).only('id', 'username').as_pymongo()
+    resolved = {}
+    for user in users:
+        resolved[str(user['_id'])] = user['_id']
+        resolved[user['username']] = user['_id']
+    return resolved
+
+
+def enroll_batch(course, identifiers, seen):
+    """Enroll one batch with a single unordered insert_many, returns (results, inserted student ids)."""
+    resolved = resolve_students(identifiers)
+    results, docs, doc_owners = [], [], []
+    now = datetime.datetime.utcnow()
+
+    for identifier in identifiers:
+        student_id = resolved.get(identifier)
+        if student_id is None:
+            results.append({'student': identifier, 'status': 'not_found'})
+        elif student_id in seen:
+            results.append({'student': identifier, 'status': 'duplicate_in_request'})
+        else:
+            seen.add(student_id)
+            results.append({'student': identifier, 'status': 'enrolled'})
+            docs.append({'student': student_id, 'course': course.id, 'enrolled_at': now})
+            doc_owners.append(len(results) - 1)
+
+    failed = set()
+    if docs:
+        try:
+            Enrollment._get_collection().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: everything else was inserted, duplicates are reported per student
+            for error in e.details['writeErrors']:
+                status = 'already_enrolled' if error['code'] == DUPLICATE_KEY else 'error'
+                results[doc_owners[error['index']]]['status'] = status
+                failed.add(error['index'])
+    inserted = [doc['student'] for i, doc in enumerate(docs) if i not in failed]
+    return results, inserted
+
+
+CSV_HEADERS = ('student', 'username', 'id')
+
+
+def iter_csv_students(upload):
+    # Streams the upload row by row, first column is a user id or username. Only the
+    # first row may be a header; every other row gets a result, even a blank one.
+    reader = csv.reader(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''))
+    first = next(reader, None)
+    if first is not None and (first[0].strip().lower() if first else '') not in CSV_HEADERS:
+        yield first[0].strip() if first else ''
+    for row in reader:
+        yield row[0].strip() if row else ''
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@csrf_exempt
+@jwt_auth
+def bulk_enroll(request):
+    if request.method == 'POST':
+        if request.user.role not in ('teacher', 'admin'):
+            return JsonResponse({'error': 'Only teachers and admins can bulk enroll'}, status=403)
+
+        # JSON {"course_id": ..., "students": [...]} or multipart with course_id + a CSV "file"
+        if request.content_type == 'application/json':
+            data = json.loads(request.body)
+            course_id = data.get('course_id')
+            students = data.get('students')
+            if not isinstance(students, list):
+                return JsonResponse({'error': 'students must be a list'}, status=400)
+            students = (str(s).strip() for s in students)
+        else:
+            course_id = request.POST.get('course_id')
+            upload = request.FILES.get('file')
+            if not upload:
+                return JsonResponse({'error': 'CSV file is required'}, status=400)
+            students = iter_csv_students(upload)
+
+        course = Course.objects(id=course_id).no_dereference().first() if ObjectId.is_valid(course_id) else None
+        if not course:
+            return JsonResponse({'error': 'Course not found'}, status=404)
+        if request.user.role == 'teacher' and course.created_by.id != request.user.id:
+            return JsonResponse({'error': 'You can only enroll students in your own courses'}, status=403)
+
+        results, inserted, seen = [], [], set()
+        for batch in batched(students, BULK_ENROLL_BATCH_SIZE):
+            batch_results, batch_inserted = enroll_batch(course, batch, seen)
+            results += batch_results
+            inserted += batch_inserted
+
+        total_inserted = len(inserted)
+        if total_inserted:
+            course = Course.objects(id=course_id).modify(inc__enrollment_count=total_inserted,
+                                                         set__updated_at=datetime.datetime.utcnow(), new=True)
+            if course is None:
+                Enrollment.objects(course=course_id).delete()  # deleted meanwhile, see enroll_course
+                return JsonResponse({'error': 'Course not found'}, status=404)
+            analytics.record_enrollment(course, count=total_inserted)
+            bump('enrollments', *(f'student:{student_id}' for student_id in inserted))
+
+        return JsonResponse({'enrolled': total_inserted, 'results': results})
+
+
 #ALL COURSES ENROLLED BY STUDENT
+# Output key -> Enrollment fields it needs (course details come from one batched Course query)
+MY_COURSE_FIELDS = {
+    'id': ['course'],
+    'title': ['course'],
+    'description': ['course'],
+    'created_by': ['course'],
+    'youtube_link': ['course'],
+    'video_url': ['course'],
+    'hls_url': ['course'],
+    'enrolled_at': ['enrolled_at'],
+}
+
+
 # views.py
 @csrf_exempt
 @jwt_auth
+@conditional(lambda request: ['courses', f'student:{request.user.id}'])
 def my_courses(request):
     if request.method == 'GET':
         try:
             user = request.user
-            enrollments = Enrollment.objects(student=user)
-            print(f"Enrollments for {user.username}: {enrollments}")
+            enrollments = Enrollment.objects(student=user).no_dereference()
+            logger.debug("my_courses for %s", user.username)
+
+            page = paginate(request, enrollments, MY_COURSE_FIELDS)
+            courses = {}
+            needs_course = bool(page.fields - {'enrolled_at'})
+            if needs_course:
+                course_ids = [enrollment.course.id for enrollment in page.items]
+                courses = {c.id: c for c in Course.objects(id__in=course_ids).no_dereference()}
+            creators = usernames_by_id(c.created_by.id for c in courses.values()) if 'created_by' in page.fields else {}
 
             course_list = []
-            for enrollment in enrollments:
-                course = enrollment.course
+            for enrollment in page.items:
+                course = courses.get(enrollment.course.id)
+                if course is None and needs_course:
+                    continue  # course deleted between the two queries
                 enrolled_at = getattr(enrollment, 'enrolled_at', None)
-                course_list.append({
-                    'id': str(course.id),
-                    'title': course.title,
-                    'description': course.description,
-                    'created_by': course.created_by.username,
-                    'youtube_link': course.youtube_link,
-                    'video_url': f"http://localhost:8000/serve_video/{str(course.video_id)}" if course.video_id else None,
-                    'enrolled_at': enrolled_at.strftime('%Y-%m-%d %H:%M') if enrolled_at else "N/A"
-                })
-
-            return JsonResponse({'courses': course_list})
+                course_list.append(page.row({
+                    'id': lambda: str(course.id),
+                    'title': lambda: course.title,
+                    'description': lambda: course.description,
+                    'created_by': lambda: creators.get(course.created_by.id),
+                    'youtube_link': lambda: course.youtube_link,
+                    'video_url': lambda: video_url(course.video_id),
+                    'hls_url': lambda: hls_url(course),
+                    'enrolled_at': lambda: enrolled_at.strftime('%Y-%m-%d %H:%M') if enrolled_at else "N/A"
+                }))
+
+            return page.response('courses', course_list)
+        except PaginationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
-            print("ERROR IN my_courses:", str(e))
+            logger.exception("my_courses failed")
             return JsonResponse({'error': str(e)}, status=500)
 
 
@@ -351,32 +756,46 @@ def upload_assignment(request):
                 created_by=request.user
             )
             assignment.save()
+            search.add_assignment(course.id, title)
+            bump(f'course:{course.id}')
             return JsonResponse({'message': 'Assignment uploaded successfully'})
         except Course.DoesNotExist:
             return JsonResponse({'error': 'Course not found'}, status=404)
 
 #STUDENT & TEACHER CAN SEE LIST OF ASSIGNMENTS      
+ASSIGNMENT_FIELDS = {
+    'id': ['id'],
+    'title': ['title'],
+    'description': ['description'],
+    'created_by': ['created_by'],
+    'created_at': ['created_at'],
+}
+
+
 @csrf_exempt
-@jwt_auth
+@jwt_auth(claims_only=True)
+@conditional(lambda request: [f"course:{request.GET.get('course_id')}"])
 def list_assignments(request):
     if request.method == 'GET':
         course_id = request.GET.get('course_id')
 
         try:
             course = Course.objects.get(id=course_id)
-            assignments = Assignment.objects(course=course)
-
-            data = []
-            for a in assignments:
-                data.append({
-                    'id': str(a.id),
-                    'title': a.title,
-                    'description': a.description,
-                    'created_by': a.created_by.username,
-                    'created_at': a.created_at.strftime('%Y-%m-%d %H:%M')
-                })
-
-            return JsonResponse({'assignments': data})
+            assignments = Assignment.objects(course=course).no_dereference()
+            page = paginate(request, assignments, ASSIGNMENT_FIELDS)
+            creators = usernames_by_id(a.created_by.id for a in page.items) if 'created_by' in page.fields else {}
+
+            data = [page.row({
+                'id': lambda: str(a.id),
+                'title': lambda: a.title,
+                'description': lambda: a.description,
+                'created_by': lambda: creators.get(a.created_by.id),
+                'created_at': lambda: a.created_at.strftime('%Y-%m-%d %H:%M')
+            }) for a in page.items]
+
+            return page.response('assignments', data)
+        except PaginationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Course.DoesNotExist:
             return JsonResponse({'error': 'Course not found'}, status=404)
 
@@ -394,22 +813,29 @@ def submit_assignment(request):
         content = data.get('content')
 
         try:
-            assignment = Assignment.objects.get(id=assignment_id)
-            existing = Submission.objects(assignment=assignment, student=request.user).first()
-            if existing:
-                return JsonResponse({'message': 'Already submitted'}, status=400)
-
+            assignment = Assignment.objects.only('id').get(id=assignment_id)
             submission = Submission(
                 assignment=assignment,
                 student=request.user,
                 content=content
             )
-            submission.save()
+            # Single insert, the unique (assignment, student) index rejects a second submission
+            try:
+                submission.save(force_insert=True)
+            except NotUniqueError:
+                return JsonResponse({'message': 'Already submitted'}, status=400)
             return JsonResponse({'message': 'Submission successful'})
         except Assignment.DoesNotExist:
             return JsonResponse({'error': 'Assignment not found'}, status=404)
 
 #ONLY TEACHER CAN VIEW ALL SUBMISSIONS
+SUBMISSION_FIELDS = {
+    'student': ['student'],
+    'content': ['content'],
+    'submitted_at': ['submitted_at'],
+}
+
+
 @csrf_exempt
 @jwt_auth
 def view_submissions(request):
@@ -421,73 +847,198 @@ def view_submissions(request):
 
         try:
             assignment = Assignment.objects.get(id=assignment_id)
-            submissions = Submission.objects(assignment=assignment)
-            result = []
-            for sub in submissions:
-                result.append({
-                    'student': sub.student.username,
-                    'content': sub.content,
-                    'submitted_at': sub.submitted_at.strftime('%Y-%m-%d %H:%M')
-                })
-            return JsonResponse({'submissions': result})
+            submissions = Submission.objects(assignment=assignment).no_dereference()
+            page = paginate(request, submissions, SUBMISSION_FIELDS)
+            students = usernames_by_id(sub.student.id for sub in page.items) if 'student' in page.fields else {}
+
+            result = [page.row({
+                'student': lambda: students.get(sub.student.id),
+                'content': lambda: sub.content,
+                'submitted_at': lambda: sub.submitted_at.strftime('%Y-%m-%d %H:%M')
+            }) for sub in page.items]
+            return page.response('submissions', result)
+        except PaginationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Assignment.DoesNotExist:
             return JsonResponse({'error': 'Assignment not found'}, status=404)
 
 
+#STUDENT & TEACHER DASHBOARDS: ONLY WHAT WAS CREATED / DELETED SINCE THE CLIENT'S WATERMARK (core/sync.py)
 @csrf_exempt
 @jwt_auth
-def admin_dashboard(request):
+def sync_changes(request):
     if request.method == 'GET':
-        if request.user.role != 'admin':
-            return JsonResponse({'error': 'Unauthorized'}, status=403)
-
-        # Total users (excluding admins)
-        users = User.objects(role__ne='admin')
-        total_users = users.count()
-
-        # Total courses
-        courses = Course.objects()
-        total_courses = courses.count()
-
-        # Get enrollments for each course
-        course_data = []
-        top_course = None
-        max_enrollments = 0
-
-        for course in courses:
-            enroll_count = Enrollment.objects(course=course).count()
+        if request.user.role not in ('student', 'teacher'):
+            return JsonResponse({'error': 'Only students and teachers can sync'}, status=403)
+        try:
+            since = sync.parse_watermark(request.GET.get('since'))
+        except sync.WatermarkError as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
-            if enroll_count > max_enrollments:
-                max_enrollments = enroll_count
-                top_course = course
+        changes = sync.changes_for(request.user, since)
+        usernames = usernames_by_id(
+            [c.created_by.id for c in changes.courses] + [e.student.id for e in changes.enrollments if e.student]
+            + [a.created_by.id for a in changes.assignments] + [s.student.id for s in changes.submissions])
 
-            course_data.append({
+        return JsonResponse({
+            'watermark': str(changes.watermark),
+            'full': changes.full,
+            'courses': [{
                 'id': str(course.id),
                 'title': course.title,
                 'description': course.description,
-                'created_by': course.created_by.username,
+                'created_by': usernames.get(course.created_by.id),
                 'created_at': course.created_at.strftime('%Y-%m-%d %H:%M'),
-                'enrollments': enroll_count
-            })
+                'video_url': video_url(course.video_id),
+                'youtube_link': course.youtube_link,
+                'enrollments': course.enrollment_count,
+                'hls_url': hls_url(course)
+            } for course in changes.courses],
+            'enrollments': [{
+                'id': str(enrollment.id),
+                'course_id': str(enrollment.course.id),
+                'student': usernames.get(enrollment.student.id) if enrollment.student else request.user.username,
+                'enrolled_at': enrollment.enrolled_at.strftime('%Y-%m-%d %H:%M') if enrollment.enrolled_at else "N/A"
+            } for enrollment in changes.enrollments],
+            'assignments': [{
+                'id': str(assignment.id),
+                'course_id': str(assignment.course.id),
+                'title': assignment.title,
+                'description': assignment.description,
+                'created_by': usernames.get(assignment.created_by.id),
+                'created_at': assignment.created_at.strftime('%Y-%m-%d %H:%M')
+            } for assignment in changes.assignments],
+            'submissions': [{
+                'id': str(submission.id),
+                'assignment_id': str(submission.assignment.id),
+                'student': usernames.get(submission.student.id),
+                'content': submission.content,
+                'submitted_at': submission.submitted_at.strftime('%Y-%m-%d %H:%M')
+            } for submission in changes.submissions],
+            'deleted': {f'{kind}s': [str(doc_id) for doc_id in ids] for kind, ids in changes.deleted.items()},
+        })
+
+
+#TEACHERS GET NEW ENROLLMENTS AND SUBMISSIONS OF THEIR COURSES PUSHED (SERVER-SENT EVENTS, core/realtime.py)
+# Long-lived: serve it with an ASGI server (lms_backend/asgi.py), where an idle
+# connection costs no thread. Not csrf_exempt for the same reason as serve_video_async.
+async def teacher_events(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        events = await realtime.open_stream(request)
+    except realtime.RealtimeError as e:
+        response = JsonResponse({'error': str(e)}, status=e.status)
+        if e.status == 503:
+            response['Retry-After'] = realtime.RETRY_MS // 1000
+        return response
+
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: pass events through unbuffered
+    return response
+
+
+ADMIN_USER_FIELDS = {
+    'id': ['id'],
+    'username': ['username'],
+    'email': ['email'],
+    'role': ['role'],
+}
+ADMIN_COURSE_FIELDS = {key: COURSE_LIST_FIELDS[key] for key in
+                       ('id', 'title', 'description', 'created_by', 'created_at', 'enrollments')}
+
+
+@csrf_exempt
+@jwt_auth
+def admin_dashboard(request):
+    if request.method == 'GET':
+        if request.user.role != 'admin':
+            return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+        # Totals and top course come precomputed from the analytics snapshot (one query)
+        snapshot = analytics.get_snapshot()
+        users = User.objects(role__ne='admin')
+        courses = Course.objects().no_dereference()
+
+        # Users and courses are paginated separately: ?users_cursor=...&courses_cursor=...
+        try:
+            user_page = paginate(request, users, ADMIN_USER_FIELDS, prefix='users_')
+            course_page = paginate(request, courses, ADMIN_COURSE_FIELDS, prefix='courses_')
+        except PaginationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        creator_ids = [c.created_by.id for c in course_page.items] if 'created_by' in course_page.fields else []
+        if snapshot.top_course_id:
+            creator_ids.append(snapshot.top_course_created_by)
+        creators = usernames_by_id(creator_ids)
+
+        course_data = [course_page.row({
+            'id': lambda: str(course.id),
+            'title': lambda: course.title,
+            'description': lambda: course.description,
+            'created_by': lambda: creators.get(course.created_by.id),
+            'created_at': lambda: course.created_at.strftime('%Y-%m-%d %H:%M'),
+            'enrollments': lambda: course.enrollment_count
+        }) for course in course_page.items]
 
         # Prepare top course
         top_course_data = {
-            'title': top_course.title,
-            'enrollments': max_enrollments,
-            'created_by': top_course.created_by.username
-        } if top_course else {}
+            'title': snapshot.top_course_title,
+            'enrollments': snapshot.top_course_enrollments,
+            'created_by': creators.get(snapshot.top_course_created_by)
+        } if snapshot.top_course_id else {}
 
         return JsonResponse({
-            'total_users': total_users,
-            'total_courses': total_courses,
+            'total_users': snapshot.total_users,
+            'total_courses': snapshot.total_courses,
+            'total_enrollments': snapshot.total_enrollments,
             'users': [
-                {
-                    'id': str(user.id),
-                    'username': user.username,
-                    'email': user.email,
-                    'role': user.role
-                } for user in users
+                user_page.row({
+                    'id': lambda: str(user.id),
+                    'username': lambda: user.username,
+                    'email': lambda: user.email,
+                    'role': lambda: user.role
+                }) for user in user_page.items
             ],
+            'users_next_cursor': user_page.next_cursor,
             'courses': course_data,
-            'top_course': top_course_data
+            'courses_next_cursor': course_page.next_cursor,
+            'top_course': top_course_data,
+            # How old the numbers are: last full rebuild / last incremental update
+            'analytics_refreshed_at': snapshot.refreshed_at.isoformat() if snapshot.refreshed_at else None,
+            'analytics_updated_at': snapshot.updated_at.isoformat() if snapshot.updated_at else None,
+            # Hit rate of the catalog cache in this process
+            'catalog_cache': catalog_cache.stats()
+        })
+
+
+#ONLY ADMIN CAN SEE THE MONGODB CONNECTION POOL (counters of the process that answers)
+@csrf_exempt
+@jwt_auth
+def mongo_pool(request):
+    if request.method == 'GET':
+        if request.user.role != 'admin':
+            return JsonResponse({'error': 'Unauthorized'}, status=403)
+        return JsonResponse(pool_summary())
+
+
+#ONLY ADMIN CAN SEE PER-ENDPOINT PERFORMANCE HISTOGRAMS (core/metrics.py, this process)
+@csrf_exempt
+@jwt_auth
+def performance_metrics(request):
+    if request.method == 'GET':
+        if request.user.role != 'admin':
+            return JsonResponse({'error': 'Unauthorized'}, status=403)
+        return JsonResponse({
+            'latency_buckets_ms': metrics.LATENCY_BUCKETS_MS,
+            'endpoints': metrics.snapshot(),
+            'log_records_dropped': log.dropped_records(),
+            'realtime': realtime.hub.stats(),
+            # Hit rates of the in-process caches
+            'caches': {
+                'catalog': catalog_cache.stats(),
+                'users': user_cache.stats(),
+                'tokens': tokens.verified_cache.stats(),
+            },
         })
@@ -13,4 +13,6 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lms_backend.settings')
 
+# Serve the app with this (e.g. `uvicorn lms_backend.asgi:application`) for the
+# long-lived /teacher-events/ stream: under WSGI every open connection holds a thread.
 application = get_asgi_application()
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.log.RequestIdMiddleware',  # first: request id for every log line, X-Request-ID header
+    'core.metrics.MetricsMiddleware',  # first: times the whole request, Server-Timing header
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -96,14 +98,27 @@ WSGI_APPLICATION = 'lms_backend.wsgi.application'
 # }
 
 import os
-from mongoengine import connect
-
-connect(
-    db='lms_db',
-    host='localhost',  
-    port=27017,
-    
-)
+import sys
+
+# MongoDB: one client for mongoengine and GridFS, opened by core/mongo.py.
+# Each process gets its own pool, so the server sees up to
+# (processes x MONGO_MAX_POOL_SIZE) connections; size it with the pool
+# counters from /admin-dashboard/mongo-pool/.
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_DB = os.environ.get('MONGO_DB', 'lms_db')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = 5 * 60 * 1000
+MONGO_WAIT_QUEUE_TIMEOUT_MS = 2000  # fail fast instead of queueing forever when the pool is exhausted
+MONGO_CONNECT_TIMEOUT_MS = 5000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_SOCKET_TIMEOUT_MS = 30000
+# Wire compression, off by default: it costs CPU on both ends and only pays off
+# on slow or metered links to the database (e.g. 'zlib', or 'zstd' / 'snappy'
+# with the zstandard / python-snappy packages installed)
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+# e.g. 'secondaryPreferred' on a replica set; new videos may 404 until replicated
+MONGO_VIDEO_READ_PREFERENCE = os.environ.get('MONGO_VIDEO_READ_PREFERENCE', 'primary')
 
 
 # Password validation
@@ -149,3 +164,103 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 #AUTH_USER_MODEL = 'core.User'
 
+
+# Video streaming
+# Open-ended ranges ("bytes=0-") are capped to this many bytes per response
+VIDEO_MAX_OPEN_RANGE = 8 * 1024 * 1024
+VIDEO_MAX_RANGES = 16
+# Serve videos with the async view, only worth it when running under ASGI (lms_backend.asgi)
+VIDEO_ASYNC_SERVING = os.environ.get('VIDEO_ASYNC_SERVING', '').lower() in ('1', 'true', 'yes')
+
+# Listing endpoints (core.pagination)
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+# Course search (core.search) ranks at most this many matching courses per page
+SEARCH_MAX_CANDIDATES = 1000
+
+# Admin analytics snapshot is rebuilt in the background once older than this (seconds)
+ANALYTICS_REFRESH_INTERVAL = 15 * 60
+
+# Authenticated user cache in core.utils.jwt_auth
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60  # seconds
+
+# Resumable uploads (core.uploads), largest accepted video in bytes
+UPLOAD_MAX_SIZE = 20 * 1024 ** 3
+# A complete request that died mid-way is taken over by a retry after this (seconds)
+UPLOAD_FINALIZE_TIMEOUT = 10 * 60
+
+# Background jobs (core.jobs), run workers with `python manage.py run_jobs`
+JOB_LEASE_SECONDS = 30 * 60
+JOB_RETRY_DELAY_SECONDS = 30
+
+# HLS segmenting (core.hls), done by the job workers when ffmpeg is installed
+VIDEO_SEGMENT_SECONDS = 6
+# A video replaced by its faststart copy keeps serving cached links this long (seconds)
+VIDEO_REPLACED_GRACE_SECONDS = 24 * 60 * 60
+FFMPEG_BINARY = 'ffmpeg'
+
+# Shared catalog cache (core/catalog_cache.py). LocMemCache is per process,
+# use a file / memcached / redis backend to share one copy between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TTL = 10 * 60  # seconds, entries are versioned so this only bounds memory
+
+# Password hashing (core/passwords.py). A login costs about one bcrypt check,
+# `python manage.py bench_passwords` shows logins/s per core for each cost.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # processes, 0 = inline
+PASSWORD_HASH_MAX_PENDING = 32  # queued + running, beyond that register/login answer 503
+PASSWORD_HASH_TIMEOUT = 10  # seconds
+
+# Request metrics (core/metrics.py). Counting Mongo reply bytes re-encodes every
+# reply, keep it off unless you are looking for the endpoints that pull the most data
+METRICS_REPLY_BYTES = os.environ.get('METRICS_REPLY_BYTES', '').lower() in ('1', 'true', 'yes')
+
+# Logging (core/log.py): `core.*` loggers write JSON lines from a background
+# thread, with the request id. DEBUG lines are kept for a sample of requests.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))
+# `manage.py test` would print a JSON line per request; tests check logs with assertLogs
+LOG_HANDLER = 'null' if sys.argv[1:2] == ['test'] else 'json'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample_debug': {'()': 'core.log.SampleDebugFilter'},
+    },
+    'handlers': {
+        'json': {'class': 'core.log.BackgroundHandler', 'maxsize': 10000, 'filters': ['sample_debug']},
+        'null': {'class': 'logging.NullHandler'},
+    },
+    'loggers': {
+        'core': {'handlers': [LOG_HANDLER], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
+# JWT signing keys by key id (core/tokens.py). To rotate: add a new kid, make it
+# active, remove the old one after the token lifetime (24h).
+JWT_SIGNING_KEYS = {
+    'k1': os.environ.get('JWT_KEY_K1', SECRET_KEY),
+}
+JWT_ACTIVE_KID = os.environ.get('JWT_ACTIVE_KID', 'k1')
+JWT_ACCEPT_UNVERSIONED = True  # tokens issued before kids existed, signed with SECRET_KEY
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 5 * 60  # seconds, never past the token's own exp
+
+# Delta sync (/sync/, core/sync.py). Records created up to this many seconds
+# before the client watermark are sent again, to absorb clock skew between servers.
+SYNC_OVERLAP_SECONDS = 5
+
+# Realtime push to teachers (/teacher-events/, core/realtime.py). Change streams
+# need a replica set; on a standalone server new documents are polled instead.
+REALTIME_POLL_SECONDS = 2
+REALTIME_HEARTBEAT_SECONDS = 20  # keeps idle connections open through proxies
+REALTIME_MAX_CONNECTION_SECONDS = 15 * 60  # then the browser reconnects with Last-Event-ID
+REALTIME_MAX_CONNECTIONS = 5000  # per process, beyond that 503
+REALTIME_QUEUE_SIZE = 100  # events buffered per connection before a slow client is dropped
+REALTIME_REPLAY_LIMIT = 500
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import { fetchAllPages } from '../services/api';
 import './Dashboard.css';
 
 const AdminDashboard = () => {
@@ -8,10 +9,15 @@ const AdminDashboard = () => {
   const token = localStorage.getItem('token');
 
   useEffect(() => {
-    axios.get('http://localhost:8000/admin-dashboard/', {
-      headers: { Authorization: `Bearer ${token}` }
-    })
-      .then(res => setData(res.data))
+    const url = 'http://localhost:8000/admin-dashboard/';
+    const config = { headers: { Authorization: `Bearer ${token}` } };
+    // Users and courses are paginated separately, follow both cursors
+    Promise.all([
+      axios.get(url, config),
+      fetchAllPages(url, 'users', config, 'users_'),
+      fetchAllPages(url, 'courses', config, 'courses_'),
+    ])
+      .then(([res, users, courses]) => setData({ ...res.data, users, courses }))
       .catch(err => {
         console.error('Error:', err);
         setError('Failed to load admin dashboard');
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import { fetchAllPages } from '../services/api';
 import './Dashboard.css';
 
 const StudentDashboard = () => {
@@ -28,10 +29,10 @@ const StudentDashboard = () => {
 
   const fetchCourses = async () => {
     try {
-      const res = await axios.get('http://localhost:8000/courses/', {
+      const courses = await fetchAllPages('http://localhost:8000/courses/', 'courses', {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setAvailableCourses(res.data.courses);
+      setAvailableCourses(courses);
     } catch (err) {
       console.error('Error fetching available courses:', err);
       setError('Failed to load available courses');
@@ -40,10 +41,10 @@ const StudentDashboard = () => {
 
   const fetchMyCourses = async () => {
     try {
-      const res = await axios.get('http://localhost:8000/my-courses/', {
+      const courses = await fetchAllPages('http://localhost:8000/my-courses/', 'courses', {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setMyCourses(res.data.courses || []);
+      setMyCourses(courses);
     } catch (err) {
       console.error('Error fetching my courses:', err);
       setError('Failed to load your courses');
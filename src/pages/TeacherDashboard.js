@@ -1,5 +1,6 @@
 import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
+import { fetchAllPages } from '../services/api';
 import './Dashboard.css';
 
 const TeacherDashboard = () => {
@@ -36,10 +37,10 @@ const TeacherDashboard = () => {
       });
       setUploadedCourses(res1.data.uploaded_courses);
 
-      const res2 = await axios.get('http://localhost:8000/courses/', {
+      const courses = await fetchAllPages('http://localhost:8000/courses/', 'courses', {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setAllCourses(res2.data.courses);
+      setAllCourses(courses);
     } catch (err) {
       console.error('Error fetching dashboard data:', err);
     }
@@ -10,4 +10,20 @@ API.interceptors.request.use((req) => {
   return req;
 });
 
+// Listing endpoints return one page (50 rows unless ?limit=) and the cursor of the
+// next one. Follows the cursors and returns every row of `key`. `prefix` is for
+// endpoints with several lists, e.g. 'users_' for users_cursor / users_next_cursor.
+export const fetchAllPages = async (url, key, config = {}, prefix = '') => {
+  const rows = [];
+  let cursor = null;
+  do {
+    const params = { ...config.params, [`${prefix}limit`]: 200 };
+    if (cursor) params[`${prefix}cursor`] = cursor;
+    const res = await axios.get(url, { ...config, params });
+    rows.push(...(res.data[key] || []));
+    cursor = res.data[`${prefix}next_cursor`];
+  } while (cursor);
+  return rows;
+};
+
 export default API;